@@ -0,0 +1,798 @@
+"""
+Headless command line interface of the DICOM Anonymizer, for batch jobs without the Streamlit server.
+
+Runs the same steps as the user interface: fetch files, merge the mapping sheet (the template with the
+"Update_" columns filled in) and anonymize the files in parallel, with the run journal and metrics.
+
+Usage (from the application folder):
+    python anonymize_cli.py run <folder> --fformat dcm --mapping unique_ids.csv
+    python anonymize_cli.py run <folder> --fformat dcm --mapping unique_ids.csv --workers 8 --config my_config.py
+    python anonymize_cli.py template <folder> --fformat dcm --out unique_ids.csv
+    python anonymize_cli.py watch <drop folder> --fformat dcm --mapping unique_ids.csv --settle 30
+    python anonymize_cli.py receive <output folder> --port 11112 --mapping unique_ids.csv
+    python anonymize_cli.py verify <folder> --fformat dcm
+    python anonymize_cli.py plan <folder> --fformat dcm --workers 8
+
+Sharded run on several machines (or several processes of one machine), then merge of the shard journals:
+    python anonymize_cli.py run <folder> --fformat dcm --mapping unique_ids.csv --shard 0/3
+    python anonymize_cli.py run <folder> --fformat dcm --mapping unique_ids.csv --shard 1/3
+    python anonymize_cli.py run <folder> --fformat dcm --mapping unique_ids.csv --shard 2/3
+    python anonymize_cli.py merge <folder> --shards 3
+
+Exit codes:
+    0: every file is anonymized
+    1: some files could not be anonymized (see the journal, rerun with --retry-failed),
+       original identifiers were found in the anonymized files (see <folder>-Anonymized.leaks.csv),
+       or merge found missing shards, shards of different secrets or inconsistent pseudonyms
+    2: invalid arguments, configuration or mapping sheet
+"""
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+
+import pandas as pd
+
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.anonymize_dicom import create_dcm_df, create_jobs, create_manifest, read_manifest_uids, scan_files
+from anonymizer_utils.archive_sink import ArchiveSink
+from anonymizer_utils.dedup import duplicate_index, resolve_duplicates, split_duplicates
+from anonymizer_utils.dicom_receiver import StoreReceiver, create_mapping, import_pynetdicom
+from anonymizer_utils.instrumentation import create_metrics, metrics_path
+from anonymizer_utils.pipeline import anonymize_pipelined, create_executor
+from anonymizer_utils.planner import compare_plan, plan_run
+from anonymizer_utils.run_journal import RunJournal, journal_path, journal_secret
+from anonymizer_utils.scan_cache import cached_scan
+from anonymizer_utils.sharding import merge_shard_journals, parse_shard, shard_manifest
+from anonymizer_utils.transcode import OUTPUT_SYNTAXES, encoding_summary
+from anonymizer_utils.uid_remap import check_uid_store, with_pseudonyms
+from anonymizer_utils.update_rules import compile_rules
+from anonymizer_utils.verify import collect_identifiers, leak_report_path, list_outputs, verify_outputs
+from anonymizer_utils.watcher import FolderWatcher
+from ui_utils.ui_logic import check_unmatched_rows, create_update_cols, find_conflicting_keys, update_data_editor, validate_upload
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_INVALID = 2
+
+
+class CliError(Exception):
+    """
+    An error in the arguments, configuration or mapping sheet, reported with exit code 2.
+    """
+
+
+def load_config(path: str = None) -> ModuleType:
+    """
+    Loads the settings of the application, from app_settings/config.py or another file with the same variables.
+    Variables missing in the other file are taken from app_settings/config.py.
+
+    Args:
+        path (str, optional): The path of a config file. If None, app_settings/config.py is used.
+
+    Returns:
+        ModuleType: The config module.
+    """
+    from app_settings import config as default_config
+    if path is None:
+        return default_config
+
+    if not Path(path).is_file():
+        raise CliError(f'Config file "{path}" does not exist.')
+    spec = importlib.util.spec_from_file_location('dicom_anonymizer_config', path)
+    config = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(config)
+    except Exception as e:
+        raise CliError(f'Unable to load config file "{path}": {e}')
+    for name, value in vars(default_config).items():
+        if not name.startswith('_') and not hasattr(config, name):
+            setattr(config, name, value)
+    return config
+
+
+def plain_text(message: str) -> str:
+    """
+    Removes the Streamlit markup (emoji shortcodes, colors, bold) of a message for the terminal.
+    """
+    message = re.sub(r':[a-z_]+\[(.*?)\]', r'\1', message)
+    message = re.sub(r':[a-z_]+:\s*', '', message)
+    return message.replace('**', '')
+
+
+def log(message: str, quiet: bool = False):
+    if not quiet:
+        print(message, file=sys.stderr, flush=True)
+
+
+def scan(args: argparse.Namespace, config: ModuleType, metrics) -> tuple:
+    """
+    Fetches the files of the folder, like the "Fetch files" button.
+
+    Returns:
+        tuple: The manifest and the dcm_info dataframes.
+    """
+    folder, fformat = args.folder.replace('\\', '/'), args.fformat.replace('.', '')
+    if not Path(folder).is_dir():
+        raise CliError(f'Folder "{folder}" does not exist.')
+    new_tags = list(config.new_tags.keys())
+    not_found = CliError(f'Cannot find any files with extension "{fformat}" in "{folder}".')
+    try:
+        with metrics.capture('scan'):
+            if config.scan_cache:
+                manifest, dcm_info = cached_scan(
+                    folder, fformat, config.unique_ids, config.ref_tags, new_tags,
+                    cache_dir=config.scan_cache_dir, max_bytes=config.scan_cache_max_mb * 1024 ** 2,
+                    force=args.force_rescan, max_workers=config.scan_workers, metrics=metrics
+                )
+            else:
+                manifest = create_manifest(folder, fformat, max_workers=config.scan_workers, metrics=metrics)
+                dcm_info = create_dcm_df(
+                    folder, fformat, config.unique_ids, config.ref_tags, new_tags,
+                    manifest=manifest, max_workers=config.scan_workers, metrics=metrics
+                )
+    except ValueError as e:
+        # The tables of a folder without any matching file cannot be built
+        if next(scan_files(folder, fformat), None) is None:
+            raise not_found
+        raise CliError(f'Unable to scan "{folder}" for files with extension "{fformat}": {e}')
+    if dcm_info.empty:
+        raise not_found
+    return manifest, dcm_info
+
+
+def read_mapping(path: str) -> pd.DataFrame:
+    """
+    Reads the mapping sheet (csv or excel), as uploaded in the user interface.
+    """
+    file_extension = Path(path).suffix
+    try:
+        if file_extension == '.csv':
+            return pd.read_csv(path)
+        if file_extension in ['.xls', '.xlsx']:
+            return pd.read_excel(path)
+    except Exception as e:
+        raise CliError(f'Unable to read mapping sheet "{path}": {e}')
+    raise CliError(f'Unsupported file type of mapping sheet "{path}".')
+
+
+def parse_new_tags(values: list, config: ModuleType) -> dict:
+    """
+    Parses the --new-tag TAG=VALUE options. Tags without an option get the first value of config.new_tags.
+    """
+    tags_2_create = {dcm_tag: options[0] for dcm_tag, options in config.new_tags.items()}
+    for value in values or []:
+        dcm_tag, sep, option = value.partition('=')
+        if not sep or dcm_tag not in config.new_tags:
+            raise CliError(f'Invalid --new-tag "{value}", expected TAG=VALUE with TAG in {list(config.new_tags)}.')
+        tags_2_create[dcm_tag] = option
+    return tags_2_create
+
+
+def update_rules(config: ModuleType) -> dict:
+    """
+    Compiles the default rules of config.update_tags, with the pseudonyms of config.pseudonym_tags.
+    """
+    try:
+        return compile_rules(with_pseudonyms(config.update_tags, config.pseudonym_tags, config.uid_store, config.uid_secret))
+    except ValueError as e:
+        raise CliError(str(e))
+
+
+def profile_of(config: ModuleType, tags_2_create: dict, args: argparse.Namespace):
+    """
+    Compiles the anonymization rules of the config, checking the store of the remapped UIDs first.
+    """
+    output_syntax = args.output_syntax if args.output_syntax is not None else config.output_transfer_syntax
+    try:
+        if config.remap_uids:
+            check_uid_store(config.uid_store, config.uid_secret)
+        return build_profile(tags=config.tags_2_anon, tags_2_spare=config.tags_2_spare, tags_2_create=tags_2_create,
+                             remap_uids=config.remap_uids, uid_store=config.uid_store, uid_prefix=config.uid_prefix,
+                             pixel_masks=config.pixel_masks, output_syntax=None if output_syntax == 'none' else output_syntax)
+    except ValueError as e:
+        raise CliError(str(e))
+
+
+def cmd_template(args: argparse.Namespace) -> int:
+    """
+    Writes the template of unique cases to fill in, like the "Download template as CSV" button.
+    """
+    config = load_config(args.config)
+    metrics = create_metrics(config.profiling)
+    _, dcm_info = scan(args, config, metrics)
+    uids = dcm_info[(config.unique_ids + config.ref_tags)].drop_duplicates()
+    edit_df = create_update_cols(uids, update_rules(config))
+    edit_df.reset_index(drop=True).to_csv(args.out, index=False)
+    log(f'{len(edit_df)} unique cases written in {args.out}', args.quiet)
+    return EXIT_OK
+
+
+def output_archive_of(args: argparse.Namespace, config: ModuleType):
+    output_archive = args.archive if args.archive is not None else config.output_archive
+    return None if output_archive == 'none' else output_archive
+
+
+def check_mapping(upload_df: pd.DataFrame, config: ModuleType):
+    """
+    Checks the columns of the mapping sheet, before it is matched with the cases.
+    """
+    missing_cols = [col for col in (f'Update_{tag}' for tag in config.update_tags) if col not in upload_df]
+    if config.upload_df_id not in upload_df:
+        missing_cols.insert(0, config.upload_df_id)
+    if missing_cols:
+        raise CliError(f'Error in mapping sheet: the following columns must be contained - {", ".join(missing_cols)}.')
+
+
+def merge_mapping(dcm_info: pd.DataFrame, upload_df: pd.DataFrame, config: ModuleType, quiet: bool = False,
+                  strict: bool = True) -> tuple:
+    """
+    Creates the template of the cases and fills in the "Update_" columns from the mapping sheet,
+    like uploading the sheet in the user interface.
+
+    Args:
+        dcm_info (pd.DataFrame): The dataframe from create_dcm_df().
+        upload_df (pd.DataFrame): The mapping sheet.
+        config (ModuleType): The config module.
+        quiet (bool): Whether to hide the warnings.
+        strict (bool): If True, cases without a row in the mapping sheet are an error. If False, they are left out.
+
+    Returns:
+        tuple: The data editor with the "Update_" columns, and the list of identifiers without a row in the sheet.
+    """
+    check_mapping(upload_df, config)
+    uids = dcm_info[(config.unique_ids + config.ref_tags)].drop_duplicates()
+    edit_df = create_update_cols(uids, update_rules(config))
+
+    unmatched_ids = check_unmatched_rows(upload_df, edit_df, config.upload_df_id)
+    checked_df = upload_df
+    if unmatched_ids and not strict:
+        # The rows of the cases which are left out (e.g. not arrived yet in watch mode) are checked once they match
+        edit_df = edit_df[~edit_df[config.upload_df_id].isin(unmatched_ids)]
+        matched_ids = edit_df[config.upload_df_id]
+        matched = upload_df[config.upload_df_id].isin(matched_ids)
+        if f'Update_{config.upload_df_id}' in upload_df:
+            matched |= upload_df[f'Update_{config.upload_df_id}'].isin(matched_ids)
+        checked_df = upload_df[matched]
+    error_message = validate_upload(edit_df, checked_df, config.update_tags, config.upload_df_id)
+    if error_message:
+        raise CliError(plain_text(error_message))
+
+    upload_df = upload_df.fillna('').astype(str)
+    edit_df = update_data_editor(edit_df, upload_df, config.update_tags)
+    conflicting_ids = find_conflicting_keys(upload_df, config.update_tags)
+    if conflicting_ids:
+        log(f'Warning: the following PatientID appear in several rows with different values, '
+            f'only the last row is applied - {", ".join(map(str, conflicting_ids))}.', quiet)
+    return edit_df, unmatched_ids
+
+
+def anonymize_batch(folder: str, manifest: pd.DataFrame, dcm_info: pd.DataFrame, edit_df: pd.DataFrame,
+                    config: ModuleType, args: argparse.Namespace, metrics, shard: tuple = None, executor=None) -> tuple:
+    """
+    Anonymizes the files of the manifest with the "Update_" values of edit_df, like the "Anonymize files" button,
+    skipping the files which are done in the run journal and anonymizing the duplicates once (config.duplicate_mode).
+
+    Returns:
+        tuple: The results from anonymize_pipelined() and the ArchiveSink (None when writing files).
+    """
+    output_archive = output_archive_of(args, config)
+    tags_2_create = parse_new_tags(args.new_tag, config)
+    with metrics.stage('collect_jobs'):
+        profile = profile_of(config, tags_2_create, args)
+        jobs = create_jobs(dcm_info, edit_df, manifest, config.update_tags, profile, config.streaming_threshold)
+
+    try:
+        secret = journal_secret(bool(config.remap_uids or config.pseudonym_tags), config.uid_store, config.uid_secret)
+    except ValueError as e:
+        raise CliError(str(e))
+    with RunJournal(journal_path(folder, shard)) as journal:
+        if secret is not None:
+            journal.record_mappings(edit_df, config.unique_ids, secret)
+        with metrics.stage('journal_filter'):
+            pending_jobs, job_keys = journal.filter_jobs(
+                jobs, manifest, only_failed=getattr(args, 'retry_failed', False), archive=output_archive
+            )
+        metrics.count('files_skipped', len(jobs) - len(pending_jobs))
+        if len(pending_jobs) < len(jobs):
+            log(f'{len(jobs) - len(pending_jobs)} files are skipped as they are unchanged since the previous run.', args.quiet)
+
+        duplicates = []
+        if config.duplicate_mode:
+            with metrics.stage('dedup'):
+                index = duplicate_index(manifest, config.scan_workers, metrics)
+                pending_jobs, duplicates = split_duplicates(jobs, pending_jobs, index)
+            if duplicates:
+                log(f'{len(duplicates)} files are duplicates of other files, they are anonymized once.', args.quiet)
+
+        def progress(done, total):
+            log(f'Anonymized {done}/{total} files', args.quiet)
+
+        suffix = f'-{shard[0]:03d}of{shard[1]:03d}' if shard is not None else ''
+        sink = ArchiveSink(folder, output_archive, config.archive_shard_mb * 1024 ** 2, config.archive_compress, suffix) if output_archive else None
+        with metrics.stage('anonymize_wall'):
+            results = anonymize_pipelined(
+                pending_jobs,
+                max_workers=args.workers if args.workers is not None else config.max_workers,
+                chunk_size=args.chunk_size or config.chunk_size,
+                io_threads=config.io_threads,
+                progress_callback=progress,
+                result_callback=lambda chunk_results: journal.record(chunk_results, job_keys),
+                hash_inputs=config.journal_hash,
+                metrics=metrics,
+                sink=sink,
+                executor=executor
+            )
+            if duplicates:
+                duplicate_results = resolve_duplicates(duplicates, journal.outputs(), config.duplicate_mode, sink, metrics)
+                journal.record(duplicate_results, job_keys)
+                results = results + duplicate_results
+            if sink is not None:
+                sink.close()
+                sink.write_index(results, manifest)
+    return results, sink
+
+
+def verify_batch(folder: str, dcm_info: pd.DataFrame, locations: list, config: ModuleType, args: argparse.Namespace,
+                 metrics, shard: tuple = None, append: bool = False) -> pd.DataFrame:
+    """
+    Checks that the anonymized files contain none of the original identifiers, and writes the leak report.
+
+    Args:
+        folder (str): The directory of folder with dicom files.
+        dcm_info (pd.DataFrame): The dataframe from create_dcm_df(), with the original identifiers.
+        locations (list): The output files, or "<archive>::<member>" locations.
+        config (ModuleType): The config module.
+        args (argparse.Namespace): The arguments of the command.
+        metrics (Metrics): Collects the time of the verification.
+        shard (tuple, optional): The (shard, number of shards) of a sharded run.
+        append (bool): Whether to append to the leak report (e.g. for the batches of a watcher) instead of replacing it.
+
+    Returns:
+        pd.DataFrame: The leak report.
+    """
+    identifiers = collect_identifiers(dcm_info, config.unique_ids)
+    with metrics.stage('verify'):
+        leaks, errors = verify_outputs(
+            locations, identifiers,
+            max_workers=args.workers if args.workers is not None else config.max_workers,
+            metrics=metrics
+        )
+    path = Path(leak_report_path(folder, shard))
+    leaks.to_csv(path, mode='a' if append else 'w', header=not (append and path.exists()), index=False)
+
+    for error in errors.itertuples():
+        print(f'UNREADABLE {error.output_dir}: {error.error}', file=sys.stderr)
+    # The identifiers are only written in the leak report, not in the logs
+    for leak in leaks.itertuples():
+        print(f'LEAK {leak.output_dir} {leak.location} ({leak.VR}): {leak.column}', file=sys.stderr)
+    if len(leaks):
+        log(f'Original identifiers were found {len(leaks)} times in {leaks["output_dir"].nunique()} files, see {path}', args.quiet)
+    else:
+        log(f'Verified {len(locations) - len(errors)} files: no original identifiers found.', args.quiet)
+    return leaks
+
+
+def plan_batch(folder: str, manifest: pd.DataFrame, config: ModuleType, args: argparse.Namespace, metrics):
+    """
+    Predicts the time, output size and memory of the run from a sample of the files, and prints the plan.
+
+    Returns:
+        RunPlan: The plan.
+    """
+    profile = profile_of(config, parse_new_tags(args.new_tag, config), args)
+    max_workers = args.workers if args.workers is not None else config.max_workers
+    log(f'Planning the run from a sample of {config.plan_sample_files} files...', args.quiet)
+    with metrics.stage('plan'):
+        plan = plan_run(
+            manifest, profile, f'{folder}-Anonymized',
+            max_workers=max_workers,
+            chunk_size=args.chunk_size or config.chunk_size,
+            io_threads=config.io_threads,
+            streaming_threshold=config.streaming_threshold,
+            sample_size=config.plan_sample_files
+        )
+    log(f'Plan: {plan.summary()}.', args.quiet)
+    log(plan.table().to_string(index=False), args.quiet)
+    log(plan.modalities.to_string(index=False), args.quiet)
+    for warning in plan.warnings:
+        print(f'WARNING {warning}', file=sys.stderr)
+    return plan
+
+
+def successful_outputs(results: list) -> list:
+    # Skipped duplicates share the output of their first copy
+    return list(dict.fromkeys(result['output_dir'] for result in results if result['error'] is None))
+
+
+def report(folder: str, results: list, sink, metrics, config: ModuleType, args: argparse.Namespace, seconds: float) -> list:
+    """
+    Exports the metrics and prints the failures and a summary of a run.
+
+    Returns:
+        list: The failed results.
+    """
+    max_workers = args.workers if args.workers is not None else config.max_workers
+    shard = getattr(args, 'shard', None)
+    metrics.collect_profiles()
+    metrics.export(metrics_path(folder), folder=folder, max_workers=max_workers, shard=shard)
+    if args.metrics:
+        metrics.export(args.metrics, folder=folder, max_workers=max_workers, shard=shard)
+    if metrics.profile_report:
+        log(metrics.profile_report, args.quiet)
+
+    failures = [result for result in results if result['error'] is not None]
+    for failure in failures:
+        print(f'FAILED {failure["file_dir"]}: {failure["error"]}', file=sys.stderr)
+    destination = (', '.join(sink.shards) or 'no new archive') if sink is not None else f'{folder}-Anonymized'
+    log(f'{len(results) - len(failures)} of {len(results)} files anonymized in {seconds:.1f}s, '
+        f'written in {destination}', args.quiet)
+    if encoding_summary(metrics):
+        log(f'Output encoding: {encoding_summary(metrics)}.', args.quiet)
+    return failures
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    """
+    Fetches, merges the mapping sheet and anonymizes the files, like the "Anonymize files" button.
+    """
+    config = load_config(args.config)
+    folder = args.folder.replace('\\', '/')
+    parse_new_tags(args.new_tag, config)
+    shard = None
+    if args.shard is not None:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            raise CliError(str(e))
+        if not (config.remap_uids or config.pseudonym_tags or config.uid_secret):
+            raise CliError('A sharded run needs uid_secret in the config, the same on every machine, so that merge '
+                           'can compare the pseudonyms of the shards.')
+    upload_df = read_mapping(args.mapping)
+
+    metrics = create_metrics(config.profiling)
+    start = time.perf_counter()
+    manifest, dcm_info = scan(args, config, metrics)
+    log(f'Found {len(manifest)} files in {len(dcm_info)} folders.', args.quiet)
+
+    with metrics.stage('merge'):
+        edit_df, _ = merge_mapping(dcm_info, upload_df, config, args.quiet)
+
+    if shard is not None:
+        manifest = shard_manifest(manifest, dcm_info, *shard, key=args.shard_key)
+        shard_pks = dcm_info.index[dcm_info['folder_dir'].isin(manifest['folder_dir'])]
+        edit_df = edit_df[edit_df.index.isin(shard_pks)]
+        log(f'Shard {shard[0]}/{shard[1]}: {len(manifest)} files in {len(edit_df)} cases.', args.quiet)
+
+    plan = plan_batch(folder, manifest, config, args, metrics) if args.plan else None
+    results, sink = anonymize_batch(folder, manifest, dcm_info, edit_df, config, args, metrics, shard)
+    seconds = time.perf_counter() - start
+    leaks = verify_batch(folder, dcm_info, successful_outputs(results), config, args, metrics, shard) if config.verify_output else []
+    failures = report(folder, results, sink, metrics, config, args, seconds)
+    if plan is not None and metrics.counters.get('files'):
+        max_workers = args.workers if args.workers is not None else config.max_workers
+        log(f'Plan against the run:\n{compare_plan(plan, metrics, max_workers).to_string(index=False)}', args.quiet)
+    return EXIT_FAILURES if len(failures) or len(leaks) else EXIT_OK
+
+
+def cmd_plan(args: argparse.Namespace) -> int:
+    """
+    Predicts the time, output size and memory of anonymizing a folder, without anonymizing it.
+    """
+    config = load_config(args.config)
+    folder = args.folder.replace('\\', '/')
+    metrics = create_metrics(config.profiling)
+    manifest, dcm_info = scan(args, config, metrics)
+    log(f'Found {len(manifest)} files in {len(dcm_info)} folders.', args.quiet)
+    plan_batch(folder, manifest, config, args, metrics)
+    return EXIT_OK
+
+
+def cmd_watch(args: argparse.Namespace) -> int:
+    """
+    Watches a drop folder and anonymizes the subfolders as they arrive, until interrupted (Ctrl+C).
+    The mapping sheet is read again whenever it changes, and cases without a row in it wait for the next version.
+    An invalid version of the sheet is reported and the previous one is kept until it changes again. The subfolders
+    with failed files are retried at the next polls, up to --max-attempts times, and then once they change.
+    """
+    config = load_config(args.config)
+    folder, fformat = args.folder.replace('\\', '/'), args.fformat.replace('.', '')
+    if not Path(folder).is_dir():
+        raise CliError(f'Folder "{folder}" does not exist.')
+    parse_new_tags(args.new_tag, config)
+    max_workers = args.workers if args.workers is not None else config.max_workers
+
+    watcher = FolderWatcher(folder, fformat, args.settle)
+    upload_df, mapping_mtime = None, None
+    waiting = set()     # subfolders of cases which have no row in the mapping sheet yet
+    failed = False
+    log(f'Watching {folder} every {args.interval}s (settle time {args.settle}s), press Ctrl+C to stop.', args.quiet)
+
+    executor = create_executor(max_workers)
+    try:
+        while True:
+            # Reload the mapping sheet when it changes, and retry the cases which were waiting for it
+            try:
+                if not Path(args.mapping).exists():
+                    raise CliError(f'Mapping sheet "{args.mapping}" does not exist.')
+                if os.stat(args.mapping).st_mtime_ns != mapping_mtime:
+                    new_mtime = os.stat(args.mapping).st_mtime_ns
+                    new_upload_df = read_mapping(args.mapping)
+                    check_mapping(new_upload_df, config)
+                    upload_df, mapping_mtime = new_upload_df, new_mtime
+                    watcher.forget(waiting)
+                    waiting.clear()
+            except CliError as e:
+                if upload_df is None:
+                    raise
+                # e.g. the sheet is being saved, it is read again at the next poll
+                print(f'Warning: {e} The previous mapping sheet is kept.', file=sys.stderr)
+
+            metrics = create_metrics(config.profiling)
+            start = time.perf_counter()
+            walk, settling = watcher.poll(metrics)
+            edit_df = None
+            if not walk.empty:
+                with metrics.stage('scan'):
+                    manifest = read_manifest_uids(walk, config.scan_workers, metrics)
+                    dcm_info = create_dcm_df(
+                        folder, fformat, config.unique_ids, config.ref_tags, list(config.new_tags.keys()),
+                        manifest=manifest, max_workers=config.scan_workers, metrics=metrics
+                    )
+                with metrics.stage('merge'):
+                    try:
+                        edit_df, unmatched_ids = merge_mapping(dcm_info, upload_df, config, args.quiet, strict=False)
+                    except CliError as e:
+                        # The subfolders are not marked as processed, they are merged again at the next poll
+                        print(f'Warning: {e} The new subfolders are retried at the next poll.', file=sys.stderr)
+            if edit_df is not None:
+                ready = set(manifest['folder_dir'])
+                if unmatched_ids:
+                    pending = set(dcm_info.loc[dcm_info[config.upload_df_id].isin(unmatched_ids), 'folder_dir'])
+                    waiting |= pending
+                    manifest = manifest[~manifest['folder_dir'].isin(pending)]
+                    log(f'Waiting for the mapping sheet to contain {config.upload_df_id}: '
+                        f'{", ".join(map(str, unmatched_ids))}', args.quiet)
+
+                log(f'{len(manifest)} new files in {len(ready) - len(set(waiting) & ready)} folders.', args.quiet)
+                results, sink = anonymize_batch(folder, manifest, dcm_info, edit_df, config, args, metrics, executor=executor)
+                # Subfolders with failed files are retried at the next polls, the journal skips their other files
+                failed_files = {result['file_dir'] for result in results if result['error'] is not None}
+                failed_folders = set(manifest.loc[manifest['file_dir'].isin(failed_files), 'folder_dir'])
+                watcher.mark_processed(list(ready - failed_folders))
+                for folder_dir in watcher.mark_failed(sorted(failed_folders), args.max_attempts):
+                    print(f'GAVE UP {folder_dir}: files failed {args.max_attempts} times, '
+                          f'the folder is retried once it changes.', file=sys.stderr)
+                seconds = time.perf_counter() - start
+                if config.verify_output:
+                    failed |= bool(len(verify_batch(folder, dcm_info, successful_outputs(results), config, args, metrics, append=True)))
+                failed |= bool(report(folder, results, sink, metrics, config, args, seconds))
+            elif settling:
+                log(f'{settling} folders are still being copied.', args.quiet)
+
+            if args.once and not settling:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        log('Stopped watching.', args.quiet)
+    finally:
+        executor.shutdown()
+    return EXIT_FAILURES if failed else EXIT_OK
+
+
+def cmd_merge(args: argparse.Namespace) -> int:
+    """
+    Combines the journals of the shards of a run and checks that they used the same pseudonyms.
+    """
+    config = load_config(args.config)
+    folder = args.folder.replace('\\', '/')
+    if args.shards < 1:
+        raise CliError('--shards must be at least 1.')
+    summary = merge_shard_journals(folder, args.shards, config.unique_ids)
+
+    for path in summary['missing']:
+        print(f'MISSING {path}', file=sys.stderr)
+    if len(summary['key_ids']) > 1:
+        print('SECRETS the shards hashed the identifiers with different secrets, so their pseudonyms cannot be compared. '
+              'Set the same uid_secret on every machine and rerun the shards.', file=sys.stderr)
+    conflicts = summary['conflicts']
+    for conflict in conflicts.itertuples():
+        print(f'CONFLICT ({conflict.kind}) {conflict.column} of {conflict.value}: '
+              f'{conflict.conflicting_values} in shards {conflict.shards}', file=sys.stderr)
+    if not conflicts.empty:
+        conflicts_path = Path(journal_path(folder)).with_name(f'{Path(folder).name}-Anonymized.conflicts.csv')
+        conflicts.to_csv(conflicts_path, index=False)
+        log(f'Conflicts written in {conflicts_path}', args.quiet)
+
+    log(f'Merged {args.shards - len(summary["missing"])} of {args.shards} shard journals into {journal_path(folder)}: '
+        f'{summary["files"]} files, {summary["failed"]} failed, {len(conflicts)} conflicts.', args.quiet)
+    return EXIT_FAILURES if summary['missing'] or len(summary['key_ids']) > 1 or not conflicts.empty else EXIT_OK
+
+
+def cmd_receive(args: argparse.Namespace) -> int:
+    """
+    Runs a DICOM C-STORE receiver which anonymizes the datasets as they arrive, until interrupted (Ctrl+C).
+    """
+    config = load_config(args.config)
+    try:
+        import_pynetdicom()
+    except ImportError as e:
+        raise CliError(str(e))
+
+    mapping = None
+    if args.mapping is not None:
+        upload_df = read_mapping(args.mapping)
+        check_mapping(upload_df, config)
+        mapping = create_mapping(upload_df, config.update_tags)
+    elif not args.allow_unmapped:
+        raise CliError('--mapping is required, or --allow-unmapped to only apply the default rules of config.update_tags.')
+
+    tags_2_create = parse_new_tags(args.new_tag, config)
+    profile = profile_of(config, tags_2_create, args)
+    metrics = create_metrics(config.profiling)
+    receiver = StoreReceiver(
+        args.output, profile, update_rules(config), mapping,
+        max_workers=args.workers if args.workers is not None else config.max_workers,
+        metrics=metrics, log=lambda message: print(message, file=sys.stderr)
+    )
+    log(f'Receiving on port {args.port} as {args.ae_title}, writing in {args.output}, press Ctrl+C to stop.', args.quiet)
+    # Stop on SIGTERM (e.g. from a service manager) as on Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    start = time.perf_counter()
+    try:
+        receiver.start(args.port, args.ae_title, args.address, args.max_associations, block=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.shutdown()
+
+    metrics.collect_profiles()
+    metrics.export(metrics_path(args.output.rstrip('/\\')), folder=args.output, port=args.port)
+    log(f'Stopped receiving: {metrics.counters["files"]} files anonymized, {metrics.counters["refused"]} refused, '
+        f'{metrics.counters["errors"]} failed in {time.perf_counter() - start:.1f}s.', args.quiet)
+    if encoding_summary(metrics):
+        log(f'Output encoding: {encoding_summary(metrics)}.', args.quiet)
+    return EXIT_FAILURES if metrics.counters['errors'] else EXIT_OK
+
+
+def cmd_verify(args: argparse.Namespace) -> int:
+    """
+    Checks the anonymized files of a folder (or the given outputs) against the original identifiers of the folder.
+    """
+    config = load_config(args.config)
+    folder = args.folder.replace('\\', '/')
+    outputs = args.output
+    if not outputs:
+        folder_dir = Path(folder)
+        outputs = [str(path) for path in sorted(folder_dir.parent.glob(f'{folder_dir.name}-Anonymized*'))
+                   if path.name == f'{folder_dir.name}-Anonymized' or path.name.endswith(('.zip', '.tar', '.tar.gz'))]
+    missing = [output for output in outputs if not Path(output).exists()]
+    if missing or not outputs:
+        raise CliError(f'Cannot find the anonymized files: {", ".join(missing) or f"{folder}-Anonymized"}.')
+
+    metrics = create_metrics(config.profiling)
+    start = time.perf_counter()
+    _, dcm_info = scan(args, config, metrics)
+    fformat = args.fformat.replace('.', '')
+    locations = [location for output in outputs for location in list_outputs(output, fformat)]
+    log(f'Verifying {len(locations)} files of {", ".join(outputs)}.', args.quiet)
+    leaks = verify_batch(folder, dcm_info, locations, config, args, metrics)
+    log(f'Verified in {time.perf_counter() - start:.1f}s.', args.quiet)
+    return EXIT_FAILURES if len(leaks) else EXIT_OK
+
+
+def add_scan_arguments(parser: argparse.ArgumentParser, rescan: bool = True):
+    parser.add_argument('folder', help='folder with the DICOM files')
+    parser.add_argument('--fformat', required=True, help='file extension, e.g. "dcm"')
+    parser.add_argument('--config', help='a config file with the variables of app_settings/config.py')
+    if rescan:
+        parser.add_argument('--force-rescan', action='store_true', help='ignore the scan cache')
+    parser.add_argument('--quiet', action='store_true', help='only report the failures')
+
+
+def add_anonymize_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--mapping', required=True, help='the filled-in template (csv or excel)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: config.max_workers)')
+    parser.add_argument('--chunk-size', type=int, default=None, help='files per worker task (default: config.chunk_size)')
+    parser.add_argument('--new-tag', action='append', metavar='TAG=VALUE',
+                        help='value of a tag of config.new_tags created where it is missing (default: its first option)')
+    parser.add_argument('--archive', choices=['zip', 'tar', 'none'], default=None,
+                        help='write into sharded archives instead of a folder (default: config.output_archive)')
+    parser.add_argument('--output-syntax', choices=[*OUTPUT_SYNTAXES, 'none'], default=None,
+                        help='re-encode the anonymized files (default: config.output_transfer_syntax)')
+    parser.add_argument('--metrics', help='also export the metrics to this file (.csv or .jsonl)')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='anonymize a folder with a mapping sheet')
+    add_scan_arguments(run)
+    add_anonymize_arguments(run)
+    run.add_argument('--shard', metavar='K/N', help='only process shard K (from 0) of N, e.g. one per machine')
+    run.add_argument('--shard-key', choices=['patient', 'series'], default='patient',
+                     help='the files of a patient, or of a series, are in the same shard')
+    run.add_argument('--retry-failed', action='store_true', help='only retry the files which failed in the previous run')
+    run.add_argument('--plan', action='store_true',
+                     help='predict the run from a sample of the files first, and check the prediction afterwards')
+    run.set_defaults(func=cmd_run)
+
+    watch = commands.add_parser('watch', help='anonymize the subfolders arriving in a drop folder')
+    add_scan_arguments(watch, rescan=False)
+    add_anonymize_arguments(watch)
+    watch.add_argument('--interval', type=float, default=5.0, help='seconds between two polls of the folder')
+    watch.add_argument('--settle', type=float, default=30.0,
+                       help='seconds a subfolder must stay unchanged before it is anonymized (copy in progress)')
+    watch.add_argument('--once', action='store_true', help='stop when all subfolders are settled and anonymized')
+    watch.add_argument('--max-attempts', type=int, default=3,
+                       help='polls a subfolder with failed files is anonymized at, before it waits for a change')
+    watch.set_defaults(func=cmd_watch)
+
+    template = commands.add_parser('template', help='write the template of unique cases')
+    add_scan_arguments(template)
+    template.add_argument('--out', default='unique_ids.csv', help='output csv file')
+    template.set_defaults(func=cmd_template)
+
+    receive = commands.add_parser('receive', help='receive datasets over DICOM (C-STORE) and anonymize them in memory')
+    receive.add_argument('output', help='folder of the anonymized files')
+    receive.add_argument('--port', type=int, default=11112)
+    receive.add_argument('--ae-title', default='DICOMANON')
+    receive.add_argument('--address', default='0.0.0.0', help='address to listen on')
+    receive.add_argument('--max-associations', type=int, default=10, help='associations handled at once')
+    receive.add_argument('--mapping', help='the mapping sheet (csv or excel) matched on PatientID')
+    receive.add_argument('--allow-unmapped', action='store_true',
+                         help='without --mapping, apply the default rules of config.update_tags instead of refusing')
+    receive.add_argument('--workers', type=int, default=None, help='worker processes (default: config.max_workers)')
+    receive.add_argument('--new-tag', action='append', metavar='TAG=VALUE',
+                         help='value of a tag of config.new_tags created where it is missing (default: its first option)')
+    receive.add_argument('--output-syntax', choices=[*OUTPUT_SYNTAXES, 'none'], default=None,
+                         help='re-encode the anonymized files (default: config.output_transfer_syntax)')
+    receive.add_argument('--config', help='a config file with the variables of app_settings/config.py')
+    receive.add_argument('--quiet', action='store_true', help='only report refused and failed datasets')
+    receive.set_defaults(func=cmd_receive)
+
+    verify = commands.add_parser('verify', help='check that the anonymized files contain none of the original identifiers')
+    add_scan_arguments(verify)
+    verify.add_argument('--output', action='append',
+                        help='an anonymized folder or archive (default: "<folder>-Anonymized" and its archives)')
+    verify.add_argument('--workers', type=int, default=None, help='worker processes (default: config.max_workers)')
+    verify.set_defaults(func=cmd_verify)
+
+    plan = commands.add_parser('plan', help='predict the time, output size and memory of a run from a sample of the files')
+    add_scan_arguments(plan)
+    plan.add_argument('--workers', type=int, default=None, help='the largest number of worker processes planned (default: config.max_workers)')
+    plan.add_argument('--chunk-size', type=int, default=None, help='files per worker task (default: config.chunk_size)')
+    plan.add_argument('--new-tag', action='append', metavar='TAG=VALUE',
+                      help='value of a tag of config.new_tags created where it is missing (default: its first option)')
+    plan.add_argument('--output-syntax', choices=[*OUTPUT_SYNTAXES, 'none'], default=None,
+                      help='re-encode the anonymized files (default: config.output_transfer_syntax)')
+    plan.set_defaults(func=cmd_plan)
+
+    merge = commands.add_parser('merge', help='merge the journals of a sharded run and check the pseudonyms')
+    merge.add_argument('folder', help='folder with the DICOM files')
+    merge.add_argument('--shards', type=int, required=True, help='the number of shards N')
+    merge.add_argument('--config', help='a config file with the variables of app_settings/config.py')
+    merge.add_argument('--quiet', action='store_true', help='only report missing shards and conflicts')
+    merge.set_defaults(func=cmd_merge)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except CliError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return EXIT_INVALID
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import hashlib
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Optional, Union
+
+from pydicom.tag import BaseTag, Tag
+
+from anonymizer_utils.pixel_mask import build_masks
+from anonymizer_utils.transcode import resolve_output_syntax
+from anonymizer_utils.uid_remap import DEFAULT_UID_TAGS, uid_store_path
+
+# Default tags to remove for anonymization
+DEFAULT_TAGS = (
+    (0x0010, 0x0010),  # Patient's Name
+    (0x0010, 0x0020),  # Patient ID
+    (0x0010, 0x0030),  # Patient's Birth Date
+    (0x0010, 0x0040),  # Patient's Sex
+    (0x0010, 0x1040),  # Patient's Address
+    (0x0010, 0x2154),  # Patient's Phone Number
+    (0x0008, 0x0050),  # Accession Number
+    (0x0020, 0x0010),  # Study ID
+    (0x0008, 0x0080),  # Institution Name
+    (0x0008, 0x0081),  # Institution Address
+    (0x0008, 0x0090),  # Referring Physician's Name
+    (0x0008, 0x1048),  # Physician(s) of Record
+    (0x0008, 0x1050),  # Performing Physician's Name
+    (0x0008, 0x1070),  # Operator's Name
+    (0x0010, 0x1090),  # Medical Record Locator
+    (0x0010, 0x21B0),  # Additional Patient History
+    (0x0010, 0x4000),  # Patient Comments
+    (0x0032, 0x1032),  # Requesting Physician
+    (0x0008, 0x1040),  # Institutional Department Name
+)
+
+# Value representations (VR) to be anonymized
+DEFAULT_VA_TYPES = ('PN', 'LO', 'SH', 'AE', 'DT', 'DA')
+
+
+@lru_cache(maxsize=None)
+def resolve_tag(dcm_tag) -> BaseTag:
+    """
+    Resolves a DICOM keyword (e.g. 'PatientID') or a (group, element) tuple to a Tag.
+
+    Args:
+        dcm_tag (str, tuple or int): The DICOM tag to be resolved.
+
+    Returns:
+        BaseTag: The resolved DICOM tag.
+    """
+    return Tag(dcm_tag)
+
+
+@dataclass(frozen=True)
+class AnonymizationProfile:
+    """
+    An immutable set of anonymization rules, compiled once per run and shared by every file.
+
+    Attributes:
+        va_types (frozenset): VR types of which the values are anonymized.
+        tags (frozenset): DICOM tags of which the values are cleared.
+        tags_2_spare (frozenset): DICOM tags which are not modified.
+        tags_2_create (tuple): (keyword, value) pairs of the DICOM tags to be created.
+        remap_uids (frozenset): DICOM tags of which the UIDs are replaced by the UIDRemapper of uid_store.
+        uid_store (str, optional): The path of the store of the remapped UIDs.
+        uid_prefix (str, optional): The root of the new UIDs.
+        pixel_masks (tuple): PixelMask of the regions of the pixels to be blanked, by header.
+        output_syntax (str, optional): The transfer syntax UID of the output files. If None, the input one is kept.
+    """
+    va_types: frozenset
+    tags: frozenset
+    tags_2_spare: frozenset
+    tags_2_create: tuple
+    remap_uids: frozenset = frozenset()
+    uid_store: Optional[str] = None
+    uid_prefix: Optional[str] = None
+    pixel_masks: tuple = ()
+    output_syntax: Optional[str] = None
+
+    def fingerprint(self) -> str:
+        """
+        Returns a stable hash of the rules, which changes whenever the effective profile changes.
+        """
+        canonical = [
+            (field.name, sorted(map(repr, value)) if isinstance(value, frozenset) else repr(value))
+            for field in fields(self)
+            for value in [getattr(self, field.name)]
+        ]
+        return hashlib.sha256(repr(canonical).encode('utf-8')).hexdigest()
+
+
+def build_profile(tags: Optional[list] = None,
+                  tags_2_spare: Optional[list] = None,
+                  tags_2_create: Optional[dict] = None,
+                  va_types: Optional[list] = None,
+                  remap_uids: Union[list, bool, None] = None,
+                  uid_store: Optional[str] = None,
+                  uid_prefix: Optional[str] = None,
+                  pixel_masks: Optional[list] = None,
+                  output_syntax: Optional[str] = None) -> AnonymizationProfile:
+    """
+    Compiles the anonymization rules (e.g. from app_settings/config.py) into an AnonymizationProfile.
+
+    Args:
+        tags (list of tuples, optional): DICOM tags to be cleared. If None, DEFAULT_TAGS are used.
+        tags_2_spare (list, optional): DICOM tags that should not be modified.
+        tags_2_create (dict, optional): DICOM keywords and values of the tags to be created.
+        va_types (list, optional): VR types to be anonymized. If None, DEFAULT_VA_TYPES are used.
+        remap_uids (list or bool, optional): DICOM tags of which the UIDs are remapped deterministically. If True,
+            DEFAULT_UID_TAGS are used. If None, UIDs are kept.
+        uid_store (str, optional): The path of the store of the remapped UIDs. If None, DEFAULT_UID_STORE is used.
+        uid_prefix (str, optional): The root of the new UIDs. If None, the pydicom root is used.
+        pixel_masks (list, optional): The regions of the pixels to be blanked, by header (see build_masks()).
+        output_syntax (str, optional): The transfer syntax of the output files, a name of OUTPUT_SYNTAXES
+            (e.g. 'rle'). If None, the transfer syntax of the input files is kept.
+
+    Returns:
+        AnonymizationProfile: The compiled profile.
+
+    Raises:
+        ValueError: If a pixel mask or the output transfer syntax is invalid, or the encoder is not installed.
+    """
+    if tags is None:
+        tags = DEFAULT_TAGS
+    if va_types is None:
+        va_types = DEFAULT_VA_TYPES
+    if remap_uids is True:
+        remap_uids = DEFAULT_UID_TAGS
+
+    return AnonymizationProfile(
+        va_types=frozenset(v.strip() for v in va_types),
+        tags=frozenset(resolve_tag(t) for t in tags),
+        tags_2_spare=frozenset(resolve_tag(t) for t in (tags_2_spare or [])),
+        tags_2_create=tuple((tags_2_create or {}).items()),
+        remap_uids=frozenset(resolve_tag(t) for t in (remap_uids or [])),
+        uid_store=uid_store_path(uid_store) if remap_uids else None,
+        uid_prefix=uid_prefix if remap_uids else None,
+        pixel_masks=build_masks(pixel_masks),
+        output_syntax=resolve_output_syntax(output_syntax),
+    )
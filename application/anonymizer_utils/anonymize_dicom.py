@@ -1,10 +1,33 @@
+from __future__ import annotations
+
+import os
+import struct
+import sys
+import threading
 import pydicom
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pydicom import DataElement, Dataset
 from pydicom.errors import InvalidDicomError
-from pydicom import *
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 from pydicom.tag import Tag
-import pandas as pd
+from pydicom.filebase import DicomFileLike
+from pydicom.filereader import read_dataset
+from pydicom.filewriter import write_dataset
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+from functools import partial
+from io import BytesIO
+
+from anonymizer_utils.anonymization_profile import AnonymizationProfile, build_profile, resolve_tag
+from anonymizer_utils.instrumentation import Metrics, timed
+from anonymizer_utils.pixel_mask import apply_mask, find_mask
+from anonymizer_utils.transcode import encode_dataset, needs_encoding
+from anonymizer_utils.uid_remap import remap_value
+
+# pandas is only imported by the functions which build dataframes, so that worker processes do not load it
+if TYPE_CHECKING:
+    import pandas as pd
 
 def create_output_dir(file_dir: str, folder_dir: Path) -> str:
     """
@@ -19,7 +42,202 @@ def create_output_dir(file_dir: str, folder_dir: Path) -> str:
     """
     return str(file_dir).replace(str(folder_dir), str(folder_dir.parent / f"{folder_dir.name}-Anonymized"))
 
-def create_dcm_df(folder: str, fformat: str, unique_ids: list, ref_tags: list, new_tags: list) -> pd.DataFrame:
+@contextmanager
+def open_output(output_dir: str):
+    """
+    Opens an output file for writing. The content is written to a temporary file next to it, which replaces the
+    output once complete, so that a reader or another writer of the same path never sees a partial file.
+
+    Args:
+        output_dir (str): The path of the output file.
+
+    Yields:
+        file: The temporary file, opened in binary mode.
+    """
+    Path(output_dir).parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = f'{output_dir}.{os.getpid()}-{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_dir, 'wb') as f:
+            yield f
+        os.replace(tmp_dir, output_dir)
+    except BaseException:
+        if os.path.exists(tmp_dir):
+            os.remove(tmp_dir)
+        raise
+
+def scan_files(folder_dir: str, fformat: str):
+    """
+    Recursively yields the files with the file extension in a folder, using os.scandir. 
+    
+    Args: 
+        folder_dir (str): The folder to be scanned.
+        fformat (str): The file format of the targeted files. 
+    
+    Yields:
+        os.DirEntry: The directory entry of each matched file.
+    """
+    suffix = f'.{fformat}'
+    stack = [folder_dir]
+    while stack: 
+        with os.scandir(stack.pop()) as it: 
+            for entry in it: 
+                if entry.is_dir(follow_symlinks=False): 
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix) and entry.is_file(): 
+                    yield entry
+
+def read_tags(file_dir: str, dcm_tags: list) -> dict:
+    """
+    Reads the values of specific DICOM tags from the header of a DICOM file. 
+    
+    Args: 
+        file_dir (str): The DICOM file path.
+        dcm_tags (list): The DICOM keywords to be read. 
+    
+    Returns:
+        dict: A dictionary with DICOM keyword as key and its value (or None if missing) as value.
+    """
+    f = pydicom.dcmread(str(file_dir), stop_before_pixels=True, specific_tags=list(dcm_tags))
+    return {dcm_tag: getattr(f, dcm_tag, None) for dcm_tag in dcm_tags}
+
+def read_headers(file_dirs: list, dcm_tags: list, max_workers: Optional[int] = None) -> list:
+    """
+    Reads specific DICOM tags from many files concurrently on a thread pool, to hide the I/O latency of slow (network) storage. 
+    
+    Args: 
+        file_dirs (list): The DICOM file paths.
+        dcm_tags (list): The DICOM keywords to be read. 
+        max_workers (int, optional): The number of threads. If None, min(32, 4 x CPU cores) threads are used.
+    
+    Returns:
+        list: A list of dictionaries from read_tags(), in the same order as file_dirs. Unreadable files give values of None.
+    """
+    def read_or_none(file_dir): 
+        try: 
+            return read_tags(file_dir, dcm_tags)
+        except Exception as e: 
+            print(f"{e = }")
+            return dict.fromkeys(dcm_tags)
+
+    if max_workers is None: 
+        max_workers = min(32, 4 * (os.cpu_count() or 1))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor: 
+        return list(executor.map(read_or_none, file_dirs))
+
+# DICOM tags read from every file of the manifest (SOPInstanceUID indexes the duplicates)
+MANIFEST_UID_TAGS = ['StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID']
+
+def walk_folder(folder: str, fformat: str, metrics: Optional[Metrics] = None) -> pd.DataFrame: 
+    """
+    Lists every file with the file extension in the subfolders of the folder in a single directory traversal. 
+    
+    Args: 
+        folder (str): The directory of folder with dicom files.
+        fformat (str): The file format of the targeted files. 
+        metrics (Metrics, optional): Collects the time of directory walking.
+    
+    Returns:
+        pd.DataFrame: A dataframe with columns folder_dir, file_dir, size and mtime_ns, ordered by subfolder and file path.
+    """
+    import pandas as pd
+    manifest = {
+        'folder_dir': [], 
+        'file_dir': [], 
+        'size': [], 
+        'mtime_ns': []
+    }
+    with timed(metrics, 'scan_walk'): 
+        with os.scandir(folder) as it: 
+            sub_folders = sorted(entry.path for entry in it if entry.is_dir())
+
+        for sub_folder in sub_folders: 
+            for entry in sorted(scan_files(sub_folder, fformat), key=lambda e: e.path): 
+                stat = entry.stat()
+                manifest['folder_dir'].append(str(Path(sub_folder)))
+                manifest['file_dir'].append(str(Path(entry.path)))
+                manifest['size'].append(stat.st_size)
+                manifest['mtime_ns'].append(stat.st_mtime_ns)
+
+    if metrics is not None: 
+        metrics.count('files_scanned', len(manifest['file_dir']))
+        metrics.count('bytes_scanned', sum(manifest['size']))
+
+    return pd.DataFrame(manifest)
+
+def read_manifest_uids(manifest: pd.DataFrame, max_workers: Optional[int] = None, metrics: Optional[Metrics] = None) -> pd.DataFrame: 
+    """
+    Reads the MANIFEST_UID_TAGS of every file of a manifest from walk_folder(). 
+    
+    Args: 
+        manifest (pd.DataFrame): The dataframe from walk_folder().
+        max_workers (int, optional): The number of threads reading the file headers.
+        metrics (Metrics, optional): Collects the time of header reading.
+    
+    Returns:
+        pd.DataFrame: The manifest with a column for each of the MANIFEST_UID_TAGS.
+    """
+    import pandas as pd
+    with timed(metrics, 'scan_read_headers'): 
+        uids = pd.DataFrame.from_records(
+            read_headers(manifest['file_dir'].tolist(), MANIFEST_UID_TAGS, max_workers), 
+            columns=MANIFEST_UID_TAGS, 
+            index=manifest.index
+        )
+    return pd.concat([manifest.drop(columns=MANIFEST_UID_TAGS, errors='ignore'), uids], axis=1)
+
+def create_manifest(folder: str, fformat: str, read_uids: bool = True, max_workers: Optional[int] = None, 
+                    metrics: Optional[Metrics] = None) -> pd.DataFrame:
+    """
+    Builds a manifest of every DICOM file in the subfolders of the folder in a single directory traversal. 
+    
+    Args: 
+        folder (str): The directory of folder with dicom files.
+        fformat (str): The file format of the targeted files. 
+        read_uids (bool): Whether to read the MANIFEST_UID_TAGS (e.g. StudyInstanceUID and SeriesInstanceUID) from the file headers.
+        max_workers (int, optional): The number of threads reading the file headers.
+        metrics (Metrics, optional): Collects the time of directory walking and header reading.
+    
+    Returns:
+        pd.DataFrame: A dataframe with columns folder_dir, file_dir, size, mtime_ns and MANIFEST_UID_TAGS, 
+        ordered by subfolder and file path.
+    """
+    manifest = walk_folder(folder, fformat, metrics)
+    if read_uids: 
+        return compact_manifest(read_manifest_uids(manifest, max_workers, metrics))
+    return compact_manifest(manifest.assign(**{dcm_tag: None for dcm_tag in MANIFEST_UID_TAGS}))
+
+def compact_manifest(manifest: pd.DataFrame) -> pd.DataFrame: 
+    """
+    Stores the text columns of a manifest compactly, as it has a row per file: the columns of which the values 
+    repeat (e.g. folder_dir, StudyInstanceUID) as categories, and the other ones (e.g. file_dir, SOPInstanceUID) 
+    as Arrow strings when pyarrow is installed, instead of a Python object per value. 
+    
+    Args: 
+        manifest (pd.DataFrame): The dataframe from walk_folder() or read_manifest_uids().
+    
+    Returns:
+        pd.DataFrame: The manifest with compact columns.
+    """
+    import pandas as pd
+    try: 
+        string_dtype = pd.StringDtype('pyarrow')
+    except ImportError: 
+        string_dtype = None
+
+    columns = {}
+    for col in ['folder_dir', 'file_dir'] + MANIFEST_UID_TAGS: 
+        if col not in manifest or manifest[col].dtype != object: 
+            continue
+        if manifest[col].nunique() <= len(manifest) // 2: 
+            columns[col] = manifest[col].astype('category')
+        elif string_dtype is not None: 
+            columns[col] = manifest[col].astype(string_dtype)
+    return manifest.assign(**columns)
+
+def create_dcm_df(folder: str, fformat: str, unique_ids: list, ref_tags: list, new_tags: list, 
+                  manifest: Optional[pd.DataFrame] = None, max_workers: Optional[int] = None, 
+                  metrics: Optional[Metrics] = None) -> pd.DataFrame:
     """
     Gathers the meta data of each DICOM file from the folder. 
         
@@ -29,39 +247,30 @@ def create_dcm_df(folder: str, fformat: str, unique_ids: list, ref_tags: list, n
         unique_ids (list): The list of columns used as primary keys.
         ref_tags (list): The list of columns to be shown in template.
         new_tags (list): The list of tags to be determine its existence. 
+        manifest (pd.DataFrame, optional): The file manifest from create_manifest(). If None, the folder is scanned.
+        max_workers (int, optional): The number of threads reading the file headers.
+        metrics (Metrics, optional): Collects the time of header reading.
         
     Returns:
         pd.DataFrame: A dataframe which contains information of the dicom tags. 
     """
+    import pandas as pd
+    if manifest is None: 
+        manifest = create_manifest(folder, fformat, read_uids=False, metrics=metrics)
+
     folder_dir = Path(folder)
-    dcm_info = {
-        'folder_dir': [], 
-        'output_dir': []
-    }
-    dcm_info.update({dcm_tag: [] for dcm_tag in (unique_ids + ref_tags + new_tags)})
-    
-    for sub_folder in folder_dir.iterdir():
-        if sub_folder.is_dir():
-            for file_dir in sub_folder.rglob(f"*.{fformat}"):
-                dcm_info['folder_dir'].append(str(sub_folder))
-                dcm_info['output_dir'].append(create_output_dir(sub_folder, folder_dir))
-
-                try:
-                    f = pydicom.dcmread(str(file_dir), stop_before_pixels=True)
-                    
-                    # Gather information from DICOM tags
-                    for dcm_tag in (unique_ids + ref_tags + new_tags):
-                        if dcm_tag == 'PatientName': 
-                            dcm_info[dcm_tag].append(''.join(getattr(f, dcm_tag, '')))
-                        else: 
-                            dcm_info[dcm_tag].append(getattr(f, dcm_tag, None))
-                    
-                except Exception as e:
-                    print(f"{e = }")
-
-                break   # only the read the 1st file of the subholder
-    
-    df = pd.DataFrame(dcm_info)
+    dcm_tags = list(dict.fromkeys(unique_ids + ref_tags + new_tags))
+
+    # Only read the 1st file of each subfolder
+    first_files = manifest.groupby('folder_dir', sort=False, observed=True)['file_dir'].first()
+
+    # Gather information from DICOM tags
+    with timed(metrics, 'template_read_headers'): 
+        df = pd.DataFrame.from_records(read_headers(first_files.tolist(), dcm_tags, max_workers), columns=dcm_tags)
+    if 'PatientName' in df: 
+        df['PatientName'] = df['PatientName'].map(lambda x: '' if x is None else str(x))
+    df.insert(0, 'folder_dir', first_files.index.tolist())
+    df.insert(1, 'output_dir', [create_output_dir(Path(sub_folder), folder_dir) for sub_folder in first_files.index])
     df['PK'] = df[unique_ids].astype(str).agg('_'.join, axis=1)
     df.set_index('PK', inplace=True)
     
@@ -78,74 +287,252 @@ def consolidate_tags(row: pd.Series, update_tags: dict) -> dict:
     Returns:
         dict: An updated dictionary with DICOM tag series number as key.
     """
-    # DICOM Tag Table
-    tag_dict = {
-        'PatientName':              Tag((0x0010, 0x0010)),
-        'PatientID':                Tag((0x0010, 0x0020)),
-        'PatientBirthDate':         Tag((0x0010, 0x0030)),
-        'PatientSex':               Tag((0x0010, 0x0040)),
-        'AccessionNumber':          Tag((0x0008, 0x0050)),
-        'InstitutionName':          Tag((0x0008, 0x0080)),
-        'StudyDate':                Tag((0x0008, 0x0020))
-    }
-    
-    update = {}
-    for dcm_tag in update_tags:
-        update[tag_dict[dcm_tag]] = row[f'Update_{dcm_tag}']
+    return {resolve_tag(dcm_tag): row[f'Update_{dcm_tag}'] for dcm_tag in update_tags}
+
+def create_jobs(dcm_info: pd.DataFrame, 
+                edit_df: pd.DataFrame, 
+                manifest: pd.DataFrame, 
+                update_tags: dict, 
+                profile: AnonymizationProfile, 
+                streaming_threshold: Optional[int] = None) -> list: 
+    """
+    Creates the keyword arguments of anonymize() for every file of the manifest. The output of a file keeps its
+    path relative to its subfolder, so that the files of the series of a case cannot overwrite each other.
     
-    return update
+    Args:
+        dcm_info (pd.DataFrame): The dataframe from create_dcm_df().
+        edit_df (pd.DataFrame): The data editor with the "Update_" columns, indexed as dcm_info.
+        manifest (pd.DataFrame): The file manifest from create_manifest().
+        update_tags (dict): The DICOM tags to be updated.
+        profile (AnonymizationProfile): The compiled anonymization rules.
+        streaming_threshold (int, optional): Files of at least this size (bytes) are anonymized in streaming mode.
+        
+    Returns:
+        list: A list of dictionaries with keyword arguments of anonymize(), one per file.
+    """
+    anon_dcm_df = dcm_info.filter(like='dir', axis=1).join(edit_df.filter(like='Update_', axis=1))
+    files = {folder_dir: list(zip(group['file_dir'], group['size'])) for folder_dir, group in manifest.groupby('folder_dir', observed=True)}
+
+    jobs = []
+    for _, row in anon_dcm_df.iterrows():
+        update = consolidate_tags(row, update_tags)
+        for file_dir, size in files.get(row['folder_dir'], []):
+            jobs.append({
+                'file_dir': str(file_dir), 
+                'output_dir': f"{row['output_dir']}/{Path(file_dir).relative_to(row['folder_dir']).as_posix()}", 
+                'update': update,
+                'profile': profile, 
+                'streaming': streaming_threshold is not None and int(size) >= streaming_threshold
+            })
+    return jobs
 
 def remove_info(dataset: Dataset,
                 data_element: DataElement,
-                va_type: Optional[list[str]],
-                tags: Optional[list[tuple]],
-                update: Optional[dict],
-                tags_2_spare: list[tuple]):
+                profile: AnonymizationProfile,
+                update: Optional[dict] = None):
     """
     Removes (anonymizes) or updates specific information from a DICOM dataset.
 
     Args:
         dataset: The DICOM dataset containing the data element to be modified.
         data_element: The specific data element (tag) to be processed.
-        va_type (list, optional): A list of VR types that should be cleared.
-        tags (list of tuples, optional): A list of DICOM tags for which the value should be cleared.
+        profile (AnonymizationProfile): The compiled anonymization rules.
         update (dict, optional): A dictionary containing tags as keys and the new values as values. 
-        tags_2_spare (list, optional): A list of tags that should be spared from deletion or anonymization. 
 
     Returns:
         None: The function modifies the data element in place and does not return a value.
     """
-    va_type=["PN", "LO", "SH", "AE", "DT", "DA"]
+    tag = data_element.tag
+
     # Spare sequence name
-    if data_element.tag in tags_2_spare:
+    if tag in profile.tags_2_spare:
         return
 
+    # Remap UIDs
+    if tag in profile.remap_uids and data_element.value:
+        data_element.value = remap_value(data_element.value, profile.uid_store, profile.uid_prefix)
+
     # Delete by value group
-    if data_element.VR.strip() in [v.strip() for v in va_type]:
+    if data_element.VR in profile.va_types:
         try:
             data_element.value = "Anonymized"
         except:
             data_element.value = ""
         
     # Delete by tag
-    if data_element.tag in tags:
+    if tag in profile.tags:
         data_element.value = ""
 
-    if not update is None:
-        keylist = list(update.keys())
-        if data_element.tag in list(update.keys()):
-            data_element.value = update[data_element.tag]
+    if update and tag in update:
+        data_element.value = update[tag]
             
+def anonymize_dataset(f: Dataset, profile: AnonymizationProfile, update: Optional[dict] = None, create_tags: bool = True, 
+                      metrics: Optional[Metrics] = None): 
+    """
+    Anonymizes a DICOM dataset in memory by removing private tags, removing or updating the values
+    of the elements by the profile and creating the new tags. The pixel data is only decoded when a
+    pixel mask of the profile matches the header.
+    
+    Args: 
+        f (Dataset): The DICOM dataset to be modified in place.
+        profile (AnonymizationProfile): The compiled anonymization rules.
+        update (dict, optional): A dictionary of tags and their new values for updates.
+        create_tags (bool): Whether to create the tags_2_create of the profile.
+        metrics (Metrics, optional): Collects the time of each step and the number of elements visited.
+    """
+    # Pixel masks are matched with the original header
+    mask = find_mask(f, profile.pixel_masks) if profile.pixel_masks and 'PixelData' in f else None
+
+    callback = partial(remove_info, profile=profile, update=update)
+    if metrics is not None: 
+        def callback(dataset, data_element, inner=callback): 
+            metrics.counters['elements'] += 1
+            inner(dataset, data_element)
+
+    # Remove and update tags
+    with timed(metrics, 'remove_private_tags'): 
+        f.remove_private_tags()
+    with timed(metrics, 'walk'): 
+        f.walk(callback)
+
+    # Keep the file meta information consistent with the remapped SOPInstanceUID
+    file_meta = getattr(f, 'file_meta', None)
+    if profile.remap_uids and file_meta is not None and 'MediaStorageSOPInstanceUID' in file_meta and 'SOPInstanceUID' in f:
+        file_meta.MediaStorageSOPInstanceUID = f.SOPInstanceUID
+
+    # Blank the burned-in annotations
+    if mask is not None:
+        with timed(metrics, 'mask_pixels'):
+            apply_mask(f, mask)
+        if metrics is not None:
+            metrics.count('files_masked')
+    
+    # Create new tags
+    if create_tags: 
+        for dcm_tag, value in profile.tags_2_create:
+            setattr(f, dcm_tag, value)
+
+def pixel_data_end(fp, offset: int, is_implicit_VR: bool, is_little_endian: bool) -> int:
+    """
+    Finds the end of the pixel data element which starts at offset, without reading its value. 
+    
+    Args: 
+        fp: The opened DICOM file.
+        offset (int): The file position of the pixel data tag.
+        is_implicit_VR (bool): Whether the file is encoded in implicit VR.
+        is_little_endian (bool): Whether the file is encoded in little endian.
+    
+    Returns:
+        int: The file position right after the pixel data element.
+    """
+    endian = '<' if is_little_endian else '>'
+    fp.seek(offset + 4)
+    if is_implicit_VR: 
+        length, = struct.unpack(f'{endian}L', fp.read(4))
+    else: 
+        vr = fp.read(2)
+        if vr in (b'OB', b'OW', b'OF', b'OD', b'OL', b'OV', b'UN'): 
+            fp.seek(2, os.SEEK_CUR)
+            length, = struct.unpack(f'{endian}L', fp.read(4))
+        else: 
+            length, = struct.unpack(f'{endian}H', fp.read(2))
+
+    if length != 0xFFFFFFFF: 
+        return fp.tell() + length
+    
+    # Encapsulated pixel data: skip the items until the sequence delimiter
+    while True: 
+        group, elem, length = struct.unpack(f'{endian}HHL', fp.read(8))
+        if (group, elem) == (0xFFFE, 0xE0DD): 
+            return fp.tell()
+        fp.seek(length, os.SEEK_CUR)
+
+def copy_file_range(src, dst, offset: int, count: int, chunk_size: int = 1024 * 1024): 
+    """
+    Copies count bytes from offset of the src file to the current position of the dst file in fixed-size chunks, 
+    using os.sendfile where it is supported. 
+    
+    Args: 
+        src: The source file opened in binary mode.
+        dst: The destination file opened in binary mode.
+        offset (int): The position in src to copy from.
+        count (int): The number of bytes to be copied.
+        chunk_size (int): The number of bytes copied at once.
+    """
+    dst.flush()
+    if sys.platform.startswith('linux'): 
+        while count > 0: 
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, min(count, chunk_size))
+            if sent == 0: 
+                break
+            offset, count = offset + sent, count - sent
+        dst.seek(0, os.SEEK_END)
+        return
+    src.seek(offset)
+    while count > 0: 
+        buffer = src.read(min(count, chunk_size))
+        if not buffer: 
+            break
+        dst.write(buffer)
+        count -= len(buffer)
+
+def count_file(metrics: Optional[Metrics], file_dir: str, output_dir: str): 
+    """
+    Counts an anonymized file and its input and output bytes in metrics.
+    """
+    if metrics is not None: 
+        metrics.count('files')
+        metrics.count('bytes_in', os.path.getsize(file_dir))
+        metrics.count('bytes_out', os.path.getsize(output_dir))
+
+def anonymize_bytes(data: bytes, 
+                    update: Optional[dict] = None, 
+                    profile: Optional[AnonymizationProfile] = None, 
+                    metrics: Optional[Metrics] = None) -> bytes: 
+    """
+    Anonymizes a DICOM file which is already read in memory, without any disk access. 
+    The output is the same as the file written by anonymize().
+
+    Args:
+        data (bytes): The content of the input DICOM file.
+        update (dict, optional): A dictionary of tags and their new values for updates.
+        profile (AnonymizationProfile, optional): A compiled profile. If None, the default profile is used.
+        metrics (Metrics, optional): Collects the time of parsing, anonymizing and encoding.
+
+    Returns:
+        bytes: The content of the anonymized DICOM file, in the output transfer syntax of the profile.
+
+    Raises:
+        InvalidDicomError: If the input is not a valid DICOM file.
+    """
+    if profile is None:
+        profile = build_profile()
+
+    with timed(metrics, 'parse'): 
+        f = pydicom.dcmread(BytesIO(data))
+    anonymize_dataset(f, profile, update, metrics=metrics)
+
+    if profile.output_syntax is not None: 
+        return encode_dataset(f, profile.output_syntax, metrics)
+    with timed(metrics, 'encode'): 
+        buffer = BytesIO()
+        f.save_as(buffer)
+    return buffer.getvalue()
+
 def anonymize(file_dir: str, 
               output_dir: str, 
               tags: Optional[list] = None, 
               update: Optional[dict] = None, 
               tags_2_spare: Optional[dict] = None,
-              tags_2_create: Optional[dict] = None):
+              tags_2_create: Optional[dict] = None,
+              profile: Optional[AnonymizationProfile] = None,
+              streaming: bool = False,
+              metrics: Optional[Metrics] = None):
     """
     - Anonymizes a DICOM file by removing sensitive information based on specified tags. 
     - If no tags are provided, defaults to a predefined list. 
-    - Saves the modified file to the specified output directory and handles invalid DICOM files.
+    - Saves the modified file to the specified output directory. 
+    - Errors (e.g. InvalidDicomError) are raised to the caller, so that failures can be collected per file.
 
 
     ..note::
@@ -167,47 +554,75 @@ def anonymize(file_dir: str,
         update (dict, optional): A dictionary of tags and their new values for updates.
         tags_2_spare (list, optional): Tags that should not be modified.
         tags_2_create (list, optional): Tags to be created.
+        profile (AnonymizationProfile, optional): A compiled profile. If given, tags, tags_2_spare and tags_2_create are ignored.
+        streaming (bool): If True, only the header is loaded in memory and the pixel data is copied from the input 
+            file to the output file in chunks. Deflated files, files matching a pixel mask, and files re-encoded to the 
+            output transfer syntax of the profile are always processed in memory. Files which are kept in their
+            transfer syntax (already in the output syntax, or with compressed pixel data) are still streamed.
+        metrics (Metrics, optional): Collects the time of reading, anonymizing and writing, and the files and bytes processed.
 
     Returns:
         int: Returns 0 upon successful processing.
+
+    Raises:
+        InvalidDicomError: If the input file is not a valid DICOM file.
     """
-    # Default tags to remove for anonymization
-    if tags is None:
-        tags = [
-            (0x0010, 0x0010),  # Patient's Name
-            (0x0010, 0x0020),  # Patient ID
-            (0x0010, 0x0030),  # Patient's Birth Date
-            (0x0010, 0x0040),  # Patient's Sex
-            (0x0010, 0x1040),  # Patient's Address
-            (0x0010, 0x2154),  # Patient's Phone Number
-            (0x0008, 0x0050),  # Accession Number
-            (0x0020, 0x0010),  # Study ID
-            (0x0008, 0x0080),  # Institution Name
-            (0x0008, 0x0081),  # Institution Address
-            (0x0008, 0x0090),  # Referring Physician's Name
-            (0x0008, 0x1048),  # Physician(s) of Record
-            (0x0008, 0x1050),  # Performing Physician's Name
-            (0x0008, 0x1070),  # Operator's Name
-            (0x0010, 0x1090),  # Medical Record Locator
-            (0x0010, 0x21B0),  # Additional Patient History
-            (0x0010, 0x4000),  # Patient Comments
-            (0x0032, 0x1032),  # Requesting Physician
-            (0x0008, 0x1040),  # Institutional Department Name
-        ]
-    try:
-        f = pydicom.dcmread(str(file_dir))
-        
-        # Remove and update tags
-        f.remove_private_tags()
-        f.walk(lambda x1, x2: remove_info(x1, x2, tags=tags, va_type=[], update=update, tags_2_spare=tags_2_spare))
-        
-        # Create new tags
-        for dcm_tag, value in tags_2_create.items():
-            setattr(f, dcm_tag, value)
-        
+    if profile is None:
+        profile = build_profile(tags=tags, tags_2_spare=tags_2_spare, tags_2_create=tags_2_create)
+
+    if not streaming: 
+        with timed(metrics, 'read'): 
+            f = pydicom.dcmread(str(file_dir))
+        anonymize_dataset(f, profile, update, metrics=metrics)
+        data = encode_dataset(f, profile.output_syntax, metrics) if profile.output_syntax is not None else None
+
         # Write files
-        Path(output_dir).parent.mkdir(parents=True, exist_ok=True)
-        f.save_as(output_dir)
-    except InvalidDicomError:
-        print(f"Error when reading: {f}")
-    return 0
\ No newline at end of file
+        with timed(metrics, 'write'), open_output(output_dir) as dst: 
+            if data is None: 
+                f.save_as(dst)
+            else: 
+                dst.write(data)
+        count_file(metrics, file_dir, output_dir)
+        return 0
+
+    with open(file_dir, 'rb') as src: 
+        # Read the header only, the file position stops at the pixel data tag
+        with timed(metrics, 'read'): 
+            f = pydicom.dcmread(src, stop_before_pixels=True)
+        pixel_offset = src.tell()
+        transfer_syntax = f.file_meta.get('TransferSyntaxUID')
+        # Deflated files, files of which the pixels are masked, and files to be re-encoded are processed in memory
+        if (transfer_syntax == DeflatedExplicitVRLittleEndian or find_mask(f, profile.pixel_masks) is not None 
+                or needs_encoding(transfer_syntax, profile.output_syntax)): 
+            return anonymize(file_dir, output_dir, update=update, profile=profile, streaming=False, metrics=metrics)
+        if transfer_syntax is not None: 
+            is_implicit_VR, is_little_endian = transfer_syntax.is_implicit_VR, transfer_syntax.is_little_endian
+        else: 
+            is_implicit_VR, is_little_endian = f.original_encoding
+        
+        # Elements after the pixel data (e.g. private tags of group 7FE1) are anonymized as well
+        file_size = os.fstat(src.fileno()).st_size
+        trailer = None
+        if pixel_offset < file_size: 
+            pixel_end = pixel_data_end(src, pixel_offset, is_implicit_VR, is_little_endian)
+            if pixel_end < file_size: 
+                src.seek(pixel_end)
+                with timed(metrics, 'read'): 
+                    trailer = read_dataset(src, is_implicit_VR, is_little_endian, parent_encoding=f.get('SpecificCharacterSet', 'iso8859'))
+                anonymize_dataset(trailer, profile, update, create_tags=False, metrics=metrics)
+        else: 
+            pixel_end = pixel_offset
+
+        anonymize_dataset(f, profile, update, metrics=metrics)
+
+        # Write the header, then copy the pixel data element byte by byte
+        with timed(metrics, 'write'): 
+            with open_output(output_dir) as dst: 
+                f.save_as(dst)
+                copy_file_range(src, dst, pixel_offset, pixel_end - pixel_offset)
+                if trailer is not None and len(trailer): 
+                    fp = DicomFileLike(dst)
+                    fp.is_implicit_VR, fp.is_little_endian = is_implicit_VR, is_little_endian
+                    write_dataset(fp, trailer, parent_encoding=f.get('SpecificCharacterSet', 'iso8859'))
+    count_file(metrics, file_dir, output_dir)
+    return 0
@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Optional
+
+from anonymizer_utils.instrumentation import Metrics
+from anonymizer_utils.worker import anonymize_chunk, init_worker
+
+
+def anonymize_files(jobs: list,
+                    max_workers: Optional[int] = None,
+                    chunk_size: int = 16,
+                    progress_callback: Optional[Callable[[int, int], None]] = None,
+                    result_callback: Optional[Callable[[list], None]] = None,
+                    hash_inputs: bool = False,
+                    metrics: Optional[Metrics] = None,
+                    max_pending: Optional[int] = None) -> list:
+    """
+    Anonymizes DICOM files in parallel over a pool of worker processes, each reading, anonymizing and writing
+    its files.
+
+    The user interface and the command line interface use anonymize_pipelined() of pipeline.py instead. This
+    engine is only kept as the baseline of "python -m benchmarks.run --engine pool".
+
+    Args:
+        jobs (list): A list of dictionaries with keyword arguments of anonymize(), one per file.
+        max_workers (int, optional): The number of worker processes. If None, all CPU cores are used.
+        chunk_size (int): The number of files submitted to a worker at once.
+        progress_callback (callable, optional): Called as progress_callback(done, total) after each chunk.
+        result_callback (callable, optional): Called with the list of results of each chunk as soon as it is done,
+            e.g. to record them in a RunJournal.
+        hash_inputs (bool): Whether to compute the hash of each input file.
+        metrics (Metrics, optional): Collects the metrics of all workers. Its profiling mode is applied in the workers.
+        max_pending (int, optional): The number of chunks submitted to the pool ahead of the results, which bounds
+            the memory of queued jobs. If None, 2 chunks per worker.
+
+    Returns:
+        list: A list of dictionaries (file_dir, output_dir, size, mtime_ns, digest, error) in the same order as jobs.
+    """
+    total = len(jobs)
+    results = [None] * total
+    chunks = [list(enumerate(jobs[i:i + chunk_size], start=i)) for i in range(0, total, chunk_size)]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    done = 0
+
+    profiling = metrics.profiling if metrics is not None else None
+    profile_dir = metrics.profile_dir if metrics is not None else None
+
+    def collect(chunk_results, chunk_metrics):
+        nonlocal done
+        if metrics is not None:
+            metrics.merge(chunk_metrics)
+        collected = []
+        for idx, result in chunk_results:
+            results[idx] = {'file_dir': str(jobs[idx]['file_dir']), 'output_dir': str(jobs[idx]['output_dir']), **result}
+            collected.append(results[idx])
+        done += len(chunk_results)
+        if result_callback is not None:
+            result_callback(collected)
+        if progress_callback is not None:
+            progress_callback(done, total)
+
+    if max_workers <= 1 or len(chunks) <= 1:
+        # Run in the current process when parallelism does not pay off
+        for chunk in chunks:
+            collect(*anonymize_chunk(chunk, hash_inputs, profiling, profile_dir))
+    else:
+        workers = min(max_workers, len(chunks))
+        if max_pending is None:
+            max_pending = 2 * workers
+        pending_chunks = iter(chunks)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = {}
+            while True:
+                # Keep at most max_pending chunks in the pool, so that the queue does not hold every job
+                for chunk in pending_chunks:
+                    futures[executor.submit(anonymize_chunk, chunk, hash_inputs, profiling, profile_dir)] = chunk
+                    if len(futures) >= max_pending:
+                        break
+                if not futures:
+                    break
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    chunk = futures.pop(future)
+                    try:
+                        chunk_results, chunk_metrics = future.result()
+                    except Exception as e:
+                        # The worker died (e.g. out of memory), mark the whole chunk as failed
+                        error = f'{type(e).__name__}: {e}'
+                        chunk_results = [
+                            (idx, {'size': None, 'mtime_ns': None, 'digest': None, 'error': error}) for idx, _ in chunk
+                        ]
+                        chunk_metrics = {'counters': {'errors': len(chunk)}}
+                    collect(chunk_results, chunk_metrics)
+
+    return results
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import io
+import re
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from anonymizer_utils.anonymize_dicom import MANIFEST_UID_TAGS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+ARCHIVE_FORMATS = ('zip', 'tar')
+
+# Separator between the archive and the member in the output_dir of results and run journals
+MEMBER_SEPARATOR = '::'
+
+
+def split_location(output_dir: str) -> tuple:
+    """
+    Splits an output location "<archive>::<member>" into the archive path and the member name.
+    Returns (output_dir, None) for a plain file.
+    """
+    archive, sep, member = str(output_dir).partition(MEMBER_SEPARATOR)
+    return (archive, member) if sep else (archive, None)
+
+
+class ArchiveSink:
+    """
+    Writes anonymized files straight into sharded ZIP or TAR archives named "<folder>-Anonymized-000.zip", ...
+    instead of a mirrored folder tree. A new shard is started when the current one would exceed max_bytes.
+
+    The sink lives in the main process and is shared by the writer threads of anonymize_pipelined(),
+    the archives being written under a lock. Files of streaming jobs are anonymized by the workers into a
+    spool folder first, then moved into the archive.
+    """
+
+    def __init__(self, folder: str, fmt: str = 'zip', max_bytes: int = 2 * 1024 ** 3, compress: bool = True, suffix: str = ''):
+        """
+        Args:
+            folder (str): The directory of folder with dicom files.
+            fmt (str): 'zip' or 'tar'.
+            max_bytes (int): The size limit of a shard, in uncompressed bytes.
+            compress (bool): Whether to compress the members (deflate for zip, gzip for tar).
+            suffix (str): Added to the names of the archives, spool folder and index, e.g. to keep the shards of
+                a sharded run apart ("<folder>-Anonymized<suffix>-000.zip").
+        """
+        if fmt not in ARCHIVE_FORMATS:
+            raise ValueError(f'Unknown archive format "{fmt}", expected one of {ARCHIVE_FORMATS}.')
+        folder_dir = Path(folder)
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.output_root = folder_dir.parent / f'{folder_dir.name}-Anonymized'
+        self.spool_root = folder_dir.parent / f'{folder_dir.name}-Anonymized{suffix}.spool'
+        self.index_path = folder_dir.parent / f'{folder_dir.name}-Anonymized{suffix}.index.csv'
+        self.extension = 'zip' if fmt == 'zip' else ('tar.gz' if compress else 'tar')
+
+        # Shards of previous runs are kept, the new shards are numbered after them
+        self.prefix = folder_dir.parent / f'{folder_dir.name}-Anonymized{suffix}'
+        pattern = re.compile(rf'{re.escape(self.prefix.name)}-(\d{{3}})\.{re.escape(self.extension)}')
+        numbers = [int(m.group(1)) for p in folder_dir.parent.iterdir() if (m := pattern.fullmatch(p.name))]
+        self.shard_number = max(numbers, default=-1)
+        self.shards = []
+        self.archive = None
+        self.shard_bytes = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def member_name(self, output_dir: str, root: Path) -> str:
+        return Path(output_dir).relative_to(root).as_posix()
+
+    def spool_path(self, output_dir: str) -> str:
+        """
+        Maps the output path of a streaming job to the spool folder.
+        """
+        return str(self.spool_root / self.member_name(output_dir, self.output_root))
+
+    def open_shard(self):
+        if self.archive is not None:
+            self.archive.close()
+        self.shard_number += 1
+        path = f'{self.prefix}-{self.shard_number:03d}.{self.extension}'
+        if self.fmt == 'zip':
+            compression = zipfile.ZIP_DEFLATED if self.compress else zipfile.ZIP_STORED
+            self.archive = zipfile.ZipFile(path, 'w', compression=compression, allowZip64=True)
+        else:
+            self.archive = tarfile.open(path, 'w:gz' if self.compress else 'w')
+        self.shards.append(path)
+        self.shard_bytes = 0
+
+    def add(self, member: str, data: bytes = None, path: str = None) -> str:
+        """
+        Adds a member to the current shard, from bytes or from a file.
+
+        Args:
+            member (str): The name of the member in the archive.
+            data (bytes, optional): The content of the member.
+            path (str, optional): A file with the content of the member, if data is None.
+
+        Returns:
+            str: The location of the member, "<archive>::<member>".
+        """
+        size = len(data) if data is not None else Path(path).stat().st_size
+        with self.lock:
+            if self.archive is None or (self.shard_bytes and self.shard_bytes + size > self.max_bytes):
+                self.open_shard()
+            if self.fmt == 'zip':
+                if data is not None:
+                    self.archive.writestr(zipfile.ZipInfo(member, time.localtime()[:6]), data, compress_type=self.archive.compression)
+                else:
+                    self.archive.write(path, member)
+            else:
+                if data is not None:
+                    info = tarfile.TarInfo(member)
+                    info.size, info.mtime = size, time.time()
+                    self.archive.addfile(info, io.BytesIO(data))
+                else:
+                    self.archive.add(path, arcname=member)
+            self.shard_bytes += size
+            return f'{self.shards[-1]}{MEMBER_SEPARATOR}{member}'
+
+    def write(self, output_dir: str, data: bytes) -> str:
+        """
+        Adds an anonymized file under its path relative to the "-Anonymized" folder.
+        """
+        return self.add(self.member_name(output_dir, self.output_root), data=data)
+
+    def write_spooled(self, spool_path: str) -> str:
+        """
+        Moves a file of the spool folder into the archive.
+        """
+        location = self.add(self.member_name(spool_path, self.spool_root), path=spool_path)
+        Path(spool_path).unlink()
+        return location
+
+    def close(self):
+        with self.lock:
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+        shutil.rmtree(self.spool_root, ignore_errors=True)
+
+    def write_index(self, results: list, manifest: pd.DataFrame) -> pd.DataFrame:
+        """
+        Appends the members written in this run to the index file "<folder>-Anonymized.index.csv",
+        which maps the original files, studies and series to the archives and members.
+
+        Args:
+            results (list): The results from anonymize_pipelined().
+            manifest (pd.DataFrame): The file manifest from create_manifest().
+
+        Returns:
+            pd.DataFrame: The rows of this run, with columns archive, member, file_dir and the UIDs of MANIFEST_UID_TAGS.
+        """
+        import pandas as pd
+        rows = []
+        for result in results:
+            archive, member = split_location(result['output_dir'])
+            if result['error'] is None and member is not None:
+                rows.append({'archive': Path(archive).name, 'member': member, 'file_dir': result['file_dir']})
+        uid_cols = [col for col in MANIFEST_UID_TAGS if col in manifest]
+        index = pd.DataFrame(rows, columns=['archive', 'member', 'file_dir'])
+        index = index.merge(manifest[['file_dir'] + uid_cols], on='file_dir', how='left')
+        index.to_csv(self.index_path, mode='a', header=not self.index_path.exists(), index=False)
+        return index
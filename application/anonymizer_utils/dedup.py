@@ -0,0 +1,164 @@
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from anonymizer_utils.archive_sink import ArchiveSink
+from anonymizer_utils.instrumentation import Metrics, timed
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Handling of the duplicates of a file: not written, or hard links to the anonymized first copy
+DUPLICATE_MODES = ('skip', 'link')
+
+
+def content_hash(file_dir: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Computes a fast hash of a file: XXH3 (128 bits) if xxhash is installed, BLAKE2b otherwise.
+
+    Args:
+        file_dir (str): The file path.
+        block_size (int): The number of bytes read at once.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    digest = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    with open(file_dir, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def duplicate_index(manifest: pd.DataFrame, max_workers: Optional[int] = None, metrics: Optional[Metrics] = None) -> pd.Series:
+    """
+    Keys the files by SOPInstanceUID (read by the scan) and content hash. Only the files which share their
+    SOPInstanceUID and size with another file are hashed, so that exports without duplicates are not read again.
+
+    Args:
+        manifest (pd.DataFrame): The file manifest from create_manifest(), with the SOPInstanceUID of every file.
+        max_workers (int, optional): The number of threads hashing the files. If None, min(32, 4 x CPU cores) threads are used.
+        metrics (Metrics, optional): Collects the time of hashing and the number of files hashed.
+
+    Returns:
+        pd.Series: The key "<SOPInstanceUID>:<hash>" of the candidate files, indexed by file_dir.
+    """
+    if 'SOPInstanceUID' not in manifest or manifest.empty:
+        return pd.Series(dtype=object)
+    files = manifest.dropna(subset=['SOPInstanceUID'])
+    candidates = files[files.duplicated(subset=['SOPInstanceUID', 'size'], keep=False)]
+    if candidates.empty:
+        return pd.Series(dtype=object)
+
+    def hash_or_none(file_dir):
+        try:
+            return content_hash(file_dir)
+        except OSError:
+            return None
+
+    if max_workers is None:
+        max_workers = min(32, 4 * (os.cpu_count() or 1))
+    with timed(metrics, 'dedup_hash'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashes = list(executor.map(hash_or_none, candidates['file_dir']))
+    if metrics is not None:
+        metrics.count('files_hashed', len(candidates))
+
+    keys = candidates['SOPInstanceUID'].astype(str) + ':' + pd.Series(hashes, index=candidates.index)
+    return pd.Series(keys.to_numpy(), index=candidates['file_dir'].to_numpy()).dropna()
+
+
+def split_duplicates(jobs: list, pending_jobs: list, index: pd.Series) -> tuple:
+    """
+    Separates the duplicates from the jobs to be run. A file is a duplicate of the first file of the jobs with
+    the same key when both are anonymized with the same profile and updated values, so that their outputs are identical.
+
+    Args:
+        jobs (list): All the jobs of the run, in order, including the ones done by previous runs.
+        pending_jobs (list): The jobs to be run, from RunJournal.filter_jobs().
+        index (pd.Series): The keys from duplicate_index().
+
+    Returns:
+        tuple: The jobs to be run, and a list of (job, job of the first copy) of the duplicates.
+    """
+    if index.empty:
+        return pending_jobs, []
+
+    first_copies = {}
+    for job in jobs:
+        key = index.get(str(job['file_dir']))
+        if key is not None:
+            update = tuple(sorted((int(tag), str(value)) for tag, value in (job.get('update') or {}).items()))
+            first_copies.setdefault((key, job['profile'], update), job)
+
+    unique_jobs, duplicates = [], []
+    for job in pending_jobs:
+        key = index.get(str(job['file_dir']))
+        update = tuple(sorted((int(tag), str(value)) for tag, value in (job.get('update') or {}).items()))
+        first_copy = first_copies.get((key, job['profile'], update)) if key is not None else None
+        if first_copy is None or first_copy is job:
+            unique_jobs.append(job)
+        else:
+            duplicates.append((job, first_copy))
+    return unique_jobs, duplicates
+
+
+def resolve_duplicates(duplicates: list, outputs: dict, mode: str = 'skip', sink: Optional[ArchiveSink] = None,
+                       metrics: Optional[Metrics] = None) -> list:
+    """
+    Completes the duplicates once their first copies are anonymized.
+
+    Args:
+        duplicates (list): The (job, job of the first copy) tuples from split_duplicates().
+        outputs (dict): The output_dir of the anonymized first copies (e.g. from the results and the run journal),
+            by file_dir. First copies which failed are missing.
+        mode (str): 'skip' records the output of the first copy, 'link' also creates a hard link (or a copy)
+            of it at the output path of the duplicate. In archives, duplicates are always skipped.
+        sink (ArchiveSink, optional): The archives of the run.
+        metrics (Metrics, optional): Collects the number of duplicates.
+
+    Returns:
+        list: A result dictionary (file_dir, output_dir, size, mtime_ns, digest, error, status) per duplicate,
+        with status 'duplicate'.
+    """
+    if mode not in DUPLICATE_MODES:
+        raise ValueError(f'Unknown duplicate mode "{mode}", expected one of {DUPLICATE_MODES}.')
+
+    results = []
+    for job, first_copy in duplicates:
+        result = {'file_dir': str(job['file_dir']), 'output_dir': None, 'size': None, 'mtime_ns': None,
+                  'digest': None, 'error': None, 'status': 'duplicate'}
+        output_dir = outputs.get(str(first_copy['file_dir']))
+        try:
+            stat = os.stat(job['file_dir'])
+            result['size'], result['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+            if output_dir is None:
+                raise FileNotFoundError(f'{first_copy["file_dir"]}, of which it is a duplicate, was not anonymized')
+            if mode == 'link' and sink is None:
+                target = Path(job['output_dir'])
+                # A target which is the first copy itself (or already a link to it) is kept, so that it is never removed
+                if not (target.exists() and os.path.samefile(target, output_dir)):
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    if target.exists():
+                        target.unlink()
+                    try:
+                        os.link(output_dir, target)
+                    except OSError:
+                        shutil.copyfile(output_dir, target)
+                output_dir = str(target)
+            result['output_dir'] = output_dir
+        except Exception as e:
+            result['output_dir'] = str(job['output_dir'])
+            result['error'] = f'{type(e).__name__}: {e}'
+            result['status'] = 'failed'
+        results.append(result)
+
+    if metrics is not None:
+        metrics.count('duplicates', sum(result['error'] is None for result in results))
+    return results
@@ -0,0 +1,194 @@
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pydicom
+
+from anonymizer_utils.anonymization_profile import AnonymizationProfile, resolve_tag
+from anonymizer_utils.anonymize_dicom import open_output
+from anonymizer_utils.instrumentation import Metrics
+from anonymizer_utils.pipeline import create_executor
+from anonymizer_utils.update_rules import compile_rules, default_values
+from anonymizer_utils.worker import anonymize_received
+
+# Statuses of the C-STORE responses
+STATUS_SUCCESS = 0x0000
+STATUS_OUT_OF_RESOURCES = 0xA700
+STATUS_CANNOT_UNDERSTAND = 0xC000
+
+
+def import_pynetdicom():
+    """
+    Imports pynetdicom, which is only needed by the receiver.
+    """
+    try:
+        import pynetdicom
+    except ImportError:
+        raise ImportError('The DICOM receiver requires pynetdicom, install it with "pip install pynetdicom".')
+    return pynetdicom
+
+
+def create_mapping(upload_df: pd.DataFrame, update_tags: dict, key: str = 'PatientID') -> dict:
+    """
+    Indexes the mapping sheet by key. As in update_data_editor(), the last row of a duplicated key is applied.
+
+    Args:
+        upload_df (pd.DataFrame): The mapping sheet.
+        update_tags (dict): The DICOM tags to be updated.
+        key (str): The column used to match the datasets.
+
+    Returns:
+        dict: A dictionary with the key as key and the dictionary of "Update_" values as value.
+    """
+    cols = [f'Update_{tag}' for tag in update_tags]
+    upload_df = upload_df.fillna('').astype(str).drop_duplicates(subset=key, keep='last')
+    return upload_df.set_index(key)[cols].to_dict('index')
+
+
+def update_values(identifiers: dict, update_tags: dict, mapping: dict, key: str = 'PatientID') -> Optional[dict]:
+    """
+    Computes the updated values of a received dataset, like create_update_cols() and update_data_editor() do
+    for the template: the default rules of update_tags, overwritten by the row of the mapping sheet.
+
+    Args:
+        identifiers (dict): The values of the DICOM tags of the dataset (as str).
+        update_tags (dict): The DICOM tags to be updated, with their default rules, preferably from compile_rules().
+        mapping (dict): The mapping sheet from create_mapping(), or None to only apply the default rules.
+        key (str): The column used to match the dataset.
+
+    Returns:
+        dict or None: The update dictionary of anonymize(), or None if the dataset has no row in the mapping sheet.
+    """
+    if mapping is not None:
+        row = mapping.get(identifiers.get(key, ''))
+        if row is None:
+            return None
+        values = {tag: row[f'Update_{tag}'] for tag in update_tags}
+    else:
+        values = {tag: value.iloc[0] if isinstance(value, pd.Series) else value
+                  for tag, value in default_values(pd.DataFrame([identifiers]), update_tags).items()}
+    return {resolve_tag(tag): value for tag, value in values.items()}
+
+
+class StoreReceiver:
+    """
+    A DICOM C-STORE receiver (Storage SCP) which anonymizes the datasets as they arrive, so that only the
+    anonymized files are written and no copy of the original files is staged on disk.
+
+    Each association is handled in its own thread by pynetdicom, and the datasets are anonymized from bytes
+    to bytes by a pool of worker processes.
+    """
+
+    def __init__(self,
+                 output_folder: str,
+                 profile: AnonymizationProfile,
+                 update_tags: dict,
+                 mapping: Optional[dict] = None,
+                 key: str = 'PatientID',
+                 max_workers: Optional[int] = None,
+                 metrics: Optional[Metrics] = None,
+                 log=print):
+        """
+        Args:
+            output_folder (str): The folder of the anonymized files, written as
+                "<PatientID>/<StudyInstanceUID>/<SeriesInstanceUID>/<SOPInstanceUID>.dcm" with the anonymized values.
+            profile (AnonymizationProfile): The compiled anonymization rules.
+            update_tags (dict): The DICOM tags to be updated, with their default rules.
+            mapping (dict, optional): The mapping sheet from create_mapping(). Datasets without a row are refused.
+                If None, only the default rules of update_tags are applied.
+            key (str): The column used to match the datasets with the mapping sheet.
+            max_workers (int, optional): The number of worker processes. If None, all CPU cores are used.
+            metrics (Metrics, optional): Collects the metrics of the received datasets.
+            log (callable): Called with the messages of refused datasets.
+        """
+        self.output_folder = Path(output_folder)
+        self.profile = profile
+        # Compiled once, e.g. the pseudonym rules open the remapping table
+        self.update_tags = compile_rules(update_tags)
+        self.mapping = mapping
+        self.key = key
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.log = log
+        self.executor = create_executor(max_workers)
+        self.lock = threading.Lock()
+        self.server = None
+
+    def output_path(self, data: bytes) -> Path:
+        """
+        Generates the path of an anonymized file from its anonymized header.
+        """
+        ds = pydicom.dcmread(BytesIO(data), stop_before_pixels=True)
+        parts = [ds.get('PatientID', ''), ds.get('StudyInstanceUID', ''), ds.get('SeriesInstanceUID', '')]
+        parts = [str(part).replace('/', '_').replace('\\', '_') or 'unknown' for part in parts]
+        return self.output_folder.joinpath(*parts, f"{ds.get('SOPInstanceUID', 'unknown')}.dcm")
+
+    def handle_store(self, event) -> int:
+        """
+        Handler of the C-STORE requests (evt.EVT_C_STORE).
+        """
+        dataset = event.dataset
+        identifiers = {tag: str(dataset.get(tag, '')) for tag in set(self.update_tags) | {self.key}}
+        update = update_values(identifiers, self.update_tags, self.mapping, self.key)
+        if update is None:
+            self.log(f'Refused {dataset.get("SOPInstanceUID", "")}: {self.key} has no row in the mapping sheet.')
+            with self.lock:
+                self.metrics.count('refused')
+            return STATUS_CANNOT_UNDERSTAND
+
+        data = event.encoded_dataset(include_meta=True)
+        try:
+            output, chunk_metrics = self.executor.submit(anonymize_received, data, update, self.profile).result()
+        except Exception as e:
+            self.log(f'Failed {dataset.get("SOPInstanceUID", "")}: {type(e).__name__}: {e}')
+            with self.lock:
+                self.metrics.count('errors')
+            return STATUS_CANNOT_UNDERSTAND
+
+        try:
+            with open_output(str(self.output_path(output))) as f:
+                f.write(output)
+        except OSError as e:
+            self.log(f'Failed to write {dataset.get("SOPInstanceUID", "")}: {e}')
+            with self.lock:
+                self.metrics.count('errors')
+            return STATUS_OUT_OF_RESOURCES
+
+        with self.lock:
+            self.metrics.merge(chunk_metrics)
+            self.metrics.count('files')
+            self.metrics.count('bytes_in', len(data))
+            self.metrics.count('bytes_out', len(output))
+        return STATUS_SUCCESS
+
+    def start(self, port: int = 11112, ae_title: str = 'DICOMANON', address: str = '0.0.0.0',
+              max_associations: int = 10, block: bool = True):
+        """
+        Starts the Storage SCP, accepting every storage SOP class and transfer syntax, and Verification (C-ECHO).
+
+        Args:
+            port (int): The TCP port.
+            ae_title (str): The AE title of the receiver.
+            address (str): The address to listen on.
+            max_associations (int): The number of associations handled at once.
+            block (bool): If True, serve until interrupted. If False, return after starting the server in the background.
+        """
+        pynetdicom = import_pynetdicom()
+        from pynetdicom.sop_class import Verification
+
+        ae = pynetdicom.AE(ae_title=ae_title)
+        ae.maximum_associations = max_associations
+        for context in pynetdicom.AllStoragePresentationContexts:
+            ae.add_supported_context(context.abstract_syntax, pynetdicom.ALL_TRANSFER_SYNTAXES)
+        ae.add_supported_context(Verification)
+
+        handlers = [(pynetdicom.evt.EVT_C_STORE, self.handle_store)]
+        self.server = ae.start_server((address, port), block=block, evt_handlers=handlers)
+        return self.server
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+        self.executor.shutdown()
+
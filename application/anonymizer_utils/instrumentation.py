@@ -0,0 +1,199 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Optional
+
+# Environment variable which overrides the profiling mode of config.py
+PROFILING_ENV = 'DICOMANON_PROFILE'
+PROFILING_MODES = ('cprofile', 'tracemalloc')
+
+
+def metrics_path(folder: str) -> str:
+    """
+    Generates the path of the metrics history (one JSON line per run), kept next to the "-Anonymized" output folder.
+
+    Args:
+        folder (str): The directory of folder with dicom files.
+
+    Returns:
+        str: The path of the metrics file.
+    """
+    folder_dir = Path(folder)
+    return str(folder_dir.parent / f'{folder_dir.name}-Anonymized.metrics.jsonl')
+
+
+def create_metrics(profiling: Optional[str] = None) -> 'Metrics':
+    """
+    Creates a Metrics with the profiling mode resolved by resolve_profiling() and, for cProfile, a temporary profile_dir.
+
+    Args:
+        profiling (str, optional): The default profiling mode (e.g. from config.py).
+
+    Returns:
+        Metrics: The new metrics.
+    """
+    mode = resolve_profiling(profiling)
+    profile_dir = tempfile.mkdtemp(prefix='dicomanon-profile-') if mode == 'cprofile' else None
+    return Metrics(profiling=mode, profile_dir=profile_dir)
+
+
+def resolve_profiling(default: Optional[str] = None) -> Optional[str]:
+    """
+    Resolves the profiling mode from the environment variable DICOMANON_PROFILE, or the default (e.g. from config.py).
+
+    Args:
+        default (str, optional): The profiling mode if the environment variable is not set.
+
+    Returns:
+        str or None: 'cprofile', 'tracemalloc' or None (disabled).
+    """
+    mode = os.environ.get(PROFILING_ENV, default)
+    if not mode or mode.lower() in ('0', 'off', 'none'):
+        return None
+    if mode.lower() not in PROFILING_MODES:
+        raise ValueError(f'Unknown profiling mode "{mode}", expected one of {PROFILING_MODES}.')
+    return mode.lower()
+
+
+class Metrics:
+    """
+    Per-stage timers (seconds), counters (e.g. files, bytes, elements visited, errors) and peak gauges
+    of a run. Metrics of worker processes are sent back with to_dict() and combined with merge().
+    """
+
+    def __init__(self, profiling: Optional[str] = None, profile_dir: Optional[str] = None):
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.peaks = defaultdict(int)
+        self.profiling = profiling
+        self.profile_dir = profile_dir
+        self.profile_report = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times a stage. Nested and repeated stages are added up.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += time.perf_counter() - start
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def peak(self, name: str, value: int):
+        self.peaks[name] = max(self.peaks[name], value)
+
+    def to_dict(self) -> dict:
+        return {'timers': dict(self.timers), 'counters': dict(self.counters), 'peaks': dict(self.peaks)}
+
+    def merge(self, other: dict):
+        """
+        Adds the timers and counters, and takes the maximum of the peaks, of another Metrics.to_dict().
+        """
+        for name, value in other.get('timers', {}).items():
+            self.timers[name] += value
+        for name, value in other.get('counters', {}).items():
+            self.counters[name] += value
+        for name, value in other.get('peaks', {}).items():
+            self.peak(name, value)
+
+    @contextmanager
+    def capture(self, label: str):
+        """
+        Captures a cProfile or tracemalloc profile of the enclosed code, depending on the profiling mode.
+        cProfile stats are dumped into profile_dir, so that the stats of worker processes can be combined.
+        """
+        if self.profiling == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                if self.profile_dir is not None:
+                    Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+                    profiler.dump_stats(str(Path(self.profile_dir) / f'{label}-{os.getpid()}-{time.monotonic_ns()}.prof'))
+        elif self.profiling == 'tracemalloc':
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                self.peak('tracemalloc_peak_bytes', tracemalloc.get_traced_memory()[1])
+                if started:
+                    tracemalloc.stop()
+        else:
+            yield
+
+    def collect_profiles(self, top: int = 30) -> Optional[str]:
+        """
+        Combines the cProfile stats dumped into profile_dir and keeps a text report of the top functions.
+        The profile_dir is removed afterwards, as the stats of a run are only collected once.
+
+        Args:
+            top (int): The number of functions in the report, sorted by cumulative time.
+
+        Returns:
+            str or None: The report, or None if no stats were captured.
+        """
+        if self.profile_dir is None:
+            return self.profile_report
+        try:
+            files = sorted(str(f) for f in Path(self.profile_dir).glob('*.prof'))
+            if files:
+                report = io.StringIO()
+                pstats.Stats(*files, stream=report).sort_stats('cumulative').print_stats(top)
+                self.profile_report = report.getvalue()
+        finally:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+        return self.profile_report
+
+    def summary(self) -> list:
+        """
+        Returns the metrics as rows of (metric, name, value), e.g. for a table.
+        """
+        rows = [('seconds', name, round(value, 4)) for name, value in self.timers.items()]
+        rows += [('count', name, value) for name, value in self.counters.items()]
+        rows += [('peak', name, value) for name, value in self.peaks.items()]
+        return rows
+
+    def export(self, path: str, **info):
+        """
+        Exports the metrics to a file to track them across runs.
+        A ".csv" file gets the rows of summary(), any other file gets one JSON line appended per run.
+
+        Args:
+            path (str): The output file.
+            **info: Additional fields of the run (e.g. folder, number of workers) for the JSON line.
+        """
+        if str(path).endswith('.csv'):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('metric,name,value\n')
+                for metric, name, value in self.summary():
+                    f.write(f'{metric},{name},{value}\n')
+        else:
+            record = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), **info, **self.to_dict()}
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+def timed(metrics: Optional[Metrics], name: str):
+    """
+    Returns metrics.stage(name), or a no-op context if metrics is None.
+    """
+    return metrics.stage(name) if metrics is not None else nullcontext()
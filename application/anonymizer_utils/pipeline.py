@@ -0,0 +1,228 @@
+import os
+import queue
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from anonymizer_utils.anonymize_dicom import open_output
+from anonymizer_utils.archive_sink import ArchiveSink
+from anonymizer_utils.instrumentation import Metrics
+from anonymizer_utils.worker import empty_result, error_message, init_worker, transform_chunk
+
+
+def read_chunk(chunk: list) -> tuple:
+    """
+    Reader stage: reads the input files of a chunk in memory. Streaming jobs are left to the transform stage,
+    which reads and writes them in pieces.
+
+    Args:
+        chunk (list): A list of (index, job) tuples.
+
+    Returns:
+        tuple: A list of (index, job, result, data) tuples, where data is None for streaming jobs and failed reads,
+        and the Metrics.to_dict() of the stage.
+    """
+    metrics = Metrics()
+    items = []
+    with metrics.stage('read'):
+        for idx, job in chunk:
+            result, data = empty_result(), None
+            try:
+                stat = os.stat(job['file_dir'])
+                result['size'], result['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+                if not job.get('streaming'):
+                    with open(job['file_dir'], 'rb') as f:
+                        data = f.read()
+                    metrics.count('bytes_in', len(data))
+            except Exception as e:
+                result['error'] = error_message(e)
+                metrics.count('errors')
+            items.append((idx, job, result, data))
+    return items, metrics.to_dict()
+
+
+def write_chunk(outputs: list, sink: Optional[ArchiveSink] = None) -> tuple:
+    """
+    Writer stage: writes the anonymized files of a chunk, as files or into the archives of the sink.
+
+    Args:
+        outputs (list): The outputs from transform_chunk().
+        sink (ArchiveSink, optional): If given, the files are added to its archives, including the files of
+            streaming jobs written into its spool folder, and the output_dir of the results is "<archive>::<member>".
+
+    Returns:
+        tuple: A list of (index, result) tuples and the Metrics.to_dict() of the stage.
+    """
+    metrics = Metrics()
+    results = []
+    with metrics.stage('write'):
+        for idx, job, result, output in outputs:
+            try:
+                if output is not None and sink is not None:
+                    result['output_dir'] = sink.write(job['output_dir'], output)
+                elif output is not None:
+                    with open_output(job['output_dir']) as f:
+                        f.write(output)
+                elif sink is not None and result['error'] is None:
+                    result['output_dir'] = sink.write_spooled(job['output_dir'])
+                if output is not None:
+                    metrics.count('files')
+                    metrics.count('bytes_out', len(output))
+            except Exception as e:
+                result['error'] = error_message(e)
+                metrics.count('errors')
+            results.append((idx, result))
+    return results, metrics.to_dict()
+
+
+def create_executor(max_workers: Optional[int] = None) -> Executor:
+    """
+    Creates the pool of the transform stage: worker processes, or a single thread when there is one worker.
+
+    Args:
+        max_workers (int, optional): The number of worker processes. If None, all CPU cores are used.
+
+    Returns:
+        Executor: The pool, to be shut down by the caller.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers > 1:
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker)
+    return ThreadPoolExecutor(max_workers=1)
+
+
+def anonymize_pipelined(jobs: list,
+                        max_workers: Optional[int] = None,
+                        chunk_size: int = 16,
+                        io_threads: int = 4,
+                        progress_callback: Optional[Callable[[int, int], None]] = None,
+                        result_callback: Optional[Callable[[list], None]] = None,
+                        hash_inputs: bool = False,
+                        metrics: Optional[Metrics] = None,
+                        max_pending: Optional[int] = None,
+                        sink: Optional[ArchiveSink] = None,
+                        executor: Optional[Executor] = None) -> list:
+    """
+    Anonymizes DICOM files in a pipeline of three overlapping stages, so that the storage and the CPU are busy at
+    the same time: reader threads load the files in memory, worker processes anonymize them from bytes to bytes and
+    writer threads write them. Like anonymize_files(), the files are processed in chunks.
+
+    The number of chunks between the reader and the end of the writer is bounded by max_pending (backpressure),
+    so at most max_pending x chunk_size files are held in memory. Files of streaming jobs are never loaded in memory.
+
+    Args:
+        jobs (list): A list of dictionaries with keyword arguments of anonymize(), one per file.
+        max_workers (int, optional): The number of worker processes. If None, all CPU cores are used.
+            With a single worker, the files are anonymized in a thread of the current process.
+        chunk_size (int): The number of files passed through the stages at once.
+        io_threads (int): The number of reader threads, and of writer threads.
+        progress_callback (callable, optional): Called as progress_callback(done, total) after each chunk.
+        result_callback (callable, optional): Called with the list of results of each chunk as soon as it is written,
+            e.g. to record them in a RunJournal.
+        hash_inputs (bool): Whether to compute the hash of each input file.
+        metrics (Metrics, optional): Collects the metrics of all stages. Its profiling mode is applied in the workers.
+        max_pending (int, optional): The number of chunks in the pipeline at once. If None, 2 chunks per worker
+            plus 1 per reader thread.
+        sink (ArchiveSink, optional): Writes the files into sharded archives instead of the "-Anonymized" folder.
+        executor (Executor, optional): A pool from create_executor() which is kept across calls (e.g. by a watcher),
+            instead of a new pool of max_workers.
+
+    Returns:
+        list: A list of dictionaries (file_dir, output_dir, size, mtime_ns, digest, error) in the same order as jobs.
+            With a sink, output_dir is "<archive>::<member>".
+    """
+    total = len(jobs)
+    results = [None] * total
+    chunks = [list(enumerate(jobs[i:i + chunk_size], start=i)) for i in range(0, total, chunk_size)]
+    if not chunks:
+        return results
+    if sink is not None:
+        # The workers write the files of streaming jobs into the spool folder of the sink
+        chunks = [
+            [(idx, {**job, 'output_dir': sink.spool_path(job['output_dir'])} if job.get('streaming') else job) for idx, job in chunk]
+            for chunk in chunks
+        ]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    workers = max(1, min(max_workers, len(chunks)))
+    if max_pending is None:
+        max_pending = 2 * workers + io_threads
+
+    profiling = metrics.profiling if metrics is not None else None
+    profile_dir = metrics.profile_dir if metrics is not None else None
+
+    # Finished chunks are collected in this thread, as the callbacks (e.g. a Streamlit progress bar) may not be thread-safe
+    finished = queue.Queue()
+
+    def fail(chunk, e):
+        finished.put(([(idx, {**empty_result(), 'error': error_message(e)}) for idx, _ in chunk], [{'counters': {'errors': len(chunk)}}]))
+
+    transformer = executor if executor is not None else create_executor(workers)
+    readers = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='reader')
+    writers = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='writer')
+
+    def submit(chunk):
+        def on_read(future):
+            try:
+                items, read_metrics = future.result()
+                transformer.submit(transform_chunk, items, hash_inputs, profiling, profile_dir).add_done_callback(
+                    lambda f: on_transform(f, read_metrics)
+                )
+            except Exception as e:
+                fail(chunk, e)
+
+        def on_transform(future, read_metrics):
+            try:
+                outputs, transform_metrics = future.result()
+                writers.submit(write_chunk, outputs, sink).add_done_callback(
+                    lambda f: on_write(f, [read_metrics, transform_metrics])
+                )
+            except Exception as e:
+                # The worker died (e.g. out of memory), mark the whole chunk as failed
+                fail(chunk, e)
+
+        def on_write(future, stage_metrics):
+            try:
+                chunk_results, write_metrics = future.result()
+                finished.put((chunk_results, stage_metrics + [write_metrics]))
+            except Exception as e:
+                fail(chunk, e)
+
+        readers.submit(read_chunk, chunk).add_done_callback(on_read)
+
+    done, in_flight = 0, 0
+    pending_chunks = iter(chunks)
+    try:
+        while True:
+            for chunk in pending_chunks:
+                submit(chunk)
+                in_flight += 1
+                if in_flight >= max_pending:
+                    break
+            if in_flight == 0:
+                break
+            if metrics is not None:
+                metrics.peak('chunks_in_flight', in_flight)
+
+            chunk_results, chunk_metrics = finished.get()
+            in_flight -= 1
+            if metrics is not None:
+                for stage_metrics in chunk_metrics:
+                    metrics.merge(stage_metrics)
+            collected = []
+            for idx, result in chunk_results:
+                results[idx] = {'file_dir': str(jobs[idx]['file_dir']), 'output_dir': str(jobs[idx]['output_dir']), **result}
+                collected.append(results[idx])
+            done += len(chunk_results)
+            if result_callback is not None:
+                result_callback(collected)
+            if progress_callback is not None:
+                progress_callback(done, total)
+    finally:
+        readers.shutdown()
+        if executor is None:
+            transformer.shutdown()
+        writers.shutdown()
+
+    return results
@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from pydicom import Dataset
+
+# Keys of a pixel mask in the config which are not DICOM tags to match
+MASK_KEYS = ('regions', 'fill')
+
+
+@dataclass(frozen=True)
+class PixelMask:
+    """
+    Rectangular regions of the pixels to be blanked, e.g. burned-in patient names, in the files of which the
+    header matches.
+
+    Attributes:
+        match (tuple): (keyword, values) pairs of the DICOM tags which must match, e.g. ('Modality', ('US',)).
+        regions (tuple): (x, y, width, height) of every region, in pixels from the top left corner.
+        fill (int): The value of the blanked pixels.
+    """
+    match: tuple
+    regions: tuple
+    fill: int = 0
+
+    def matches(self, ds: Dataset) -> bool:
+        """
+        Checks whether the original header of a dataset matches every tag of the mask.
+        """
+        return all(str(ds.get(keyword, '')).strip() in values for keyword, values in self.match)
+
+
+def build_masks(pixel_masks: Optional[list] = None) -> tuple:
+    """
+    Compiles the pixel masks of the config into PixelMask.
+
+    Args:
+        pixel_masks (list, optional): Dictionaries with the regions, an optional fill value, and DICOM keywords
+            with the values to be matched (a value or a list of values), e.g.
+            {'Modality': 'US', 'Rows': 600, 'Columns': 800, 'regions': [(0, 0, 800, 60)]}.
+
+    Returns:
+        tuple: The PixelMask, in the order of the config.
+
+    Raises:
+        ValueError: If a mask has no region or an invalid region.
+    """
+    masks = []
+    for mask in pixel_masks or []:
+        regions = tuple(tuple(int(v) for v in region) for region in mask.get('regions', ()))
+        if not regions or any(len(region) != 4 or min(region) < 0 for region in regions):
+            raise ValueError(f'Invalid pixel mask {mask}: "regions" must be a list of (x, y, width, height) with positive values.')
+        match = tuple(
+            (keyword, tuple(str(v) for v in (value if isinstance(value, (list, tuple)) else [value])))
+            for keyword, value in sorted(mask.items()) if keyword not in MASK_KEYS
+        )
+        masks.append(PixelMask(match=match, regions=regions, fill=int(mask.get('fill', 0))))
+    return tuple(masks)
+
+
+def find_mask(ds: Dataset, masks: tuple) -> Optional[PixelMask]:
+    """
+    Finds the first mask which matches a dataset with pixel data, from its header only.
+
+    Args:
+        ds (Dataset): The dataset, before its header is anonymized.
+        masks (tuple): The PixelMask of the profile.
+
+    Returns:
+        PixelMask or None: The matching mask.
+    """
+    for mask in masks:
+        if mask.matches(ds):
+            return mask
+    return None
+
+
+def apply_mask(ds: Dataset, mask: PixelMask):
+    """
+    Blanks the regions of the mask in every frame of a dataset, in place. The pixel data is decoded once and
+    the regions are blanked with a single slice assignment on the whole stack of frames. Compressed pixel data
+    is written back uncompressed (Explicit VR Little Endian).
+
+    Args:
+        ds (Dataset): The dataset with pixel data.
+        mask (PixelMask): The mask to be applied.
+    """
+    arr = ds.pixel_array
+    if not arr.flags.writeable:
+        arr = arr.copy()
+
+    # The rows and columns are the first axes of a frame: (rows, columns[, samples]) or (frames, rows, columns[, samples])
+    frames = int(ds.get('NumberOfFrames', 1) or 1)
+    frame_axes = (slice(None),) if frames > 1 else ()
+    for x, y, width, height in mask.regions:
+        arr[frame_axes + (slice(y, y + height), slice(x, x + width))] = mask.fill
+
+    # Color pixel data is decoded as RGB
+    photometric = ds.PhotometricInterpretation
+    if photometric.startswith('YBR') and ds.get('SamplesPerPixel', 1) == 3:
+        photometric = 'RGB'
+    ds.set_pixel_data(arr, photometric, ds.BitsStored, generate_instance_uid=False)
@@ -0,0 +1,478 @@
+"""
+Planning of a run before the files are anonymized: how long it takes with each number of workers, how much it
+writes and how much memory it needs, from the real anonymization of a sample of the files.
+
+The sample is stratified by subfolder (a series, of a single modality) and by file size, which drive the cost of
+a file. Each sampled file is read, anonymized with the profile of the run and written next to the output, and the
+costs are extrapolated to the files of the manifest, per stratum, in proportion to their bytes.
+"""
+import dataclasses
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pydicom
+
+from anonymizer_utils.anonymization_profile import AnonymizationProfile
+from anonymizer_utils.anonymize_dicom import anonymize, anonymize_bytes
+from anonymizer_utils.instrumentation import Metrics
+from anonymizer_utils.uid_remap import close_remappers
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+# Resident memory of a spawned worker process once init_worker() has loaded pydicom. A forked worker starts
+# with the pages of the main process instead
+WORKER_BASE_BYTES = 50 * 1024 ** 2
+# Start of a worker process per start method (a spawned one imports its modules, see bench_startup), paid once
+# per core when the pool is created
+WORKER_START_SECONDS = {'spawn': 0.4, 'forkserver': 0.4, 'fork': 0.05}
+# Throughput of sending the files to the workers and the outputs back (pickling through pipes), in the main process
+IPC_BYTES_PER_SECOND = 1024 ** 3
+# Share of the available memory a run may use
+MEMORY_BUDGET = 0.5
+# A number of workers within this margin of the fastest one is as good, and fewer workers are recommended
+SPEEDUP_MARGIN = 1.1
+
+
+@dataclass
+class RunPlan:
+    """
+    The prediction of a run, from plan_run().
+
+    Attributes:
+        files (int): The files of the manifest.
+        input_bytes (int): Their size.
+        sample_files (int): The files anonymized to measure the costs.
+        failed_samples (int): The sampled files which could not be anonymized (e.g. invalid DICOM files).
+        strata (int): The strata of the sample.
+        output_bytes (int): The predicted size of the anonymized files.
+        seconds (dict): The predicted wall time of the anonymization, per number of workers.
+        peak_memory (dict): The predicted peak memory of the run (bytes), per number of workers.
+        worker_memory (dict): The predicted peak memory of a worker process (bytes), per number of workers above 1.
+        streaming_thresholds (dict): The streaming threshold (bytes, or None) which keeps the run within the memory
+            budget, per number of workers.
+        workers (int): The recommended number of workers.
+        streaming_threshold (int, optional): The recommended streaming threshold.
+        streamed_files (int): The files anonymized in streaming mode with the recommended threshold.
+        free_bytes (int, optional): The free space of the disk of the output.
+        available_memory (int, optional): The memory available to the run.
+        modalities (pd.DataFrame): The sampled files, bytes and anonymization throughput per modality.
+        warnings (list): What may prevent the run from completing, e.g. a full disk.
+    """
+    files: int
+    input_bytes: int
+    sample_files: int
+    failed_samples: int
+    strata: int
+    output_bytes: int
+    seconds: dict
+    peak_memory: dict
+    worker_memory: dict
+    streaming_thresholds: dict
+    workers: int
+    streaming_threshold: Optional[int]
+    streamed_files: int
+    free_bytes: Optional[int]
+    available_memory: Optional[int]
+    modalities: pd.DataFrame = field(repr=False)
+    warnings: list = field(default_factory=list)
+
+    def table(self) -> pd.DataFrame:
+        """
+        Returns the predictions per number of workers, e.g. for a table.
+        """
+        return pd.DataFrame({
+            'workers': list(self.seconds),
+            'minutes': [round(seconds / 60, 1) for seconds in self.seconds.values()],
+            'peak memory MB': [round(self.peak_memory[w] / 1024 ** 2) for w in self.seconds],
+            'streaming from MB': [None if self.streaming_thresholds[w] is None else round(self.streaming_thresholds[w] / 1024 ** 2)
+                                  for w in self.seconds],
+            'recommended': [w == self.workers for w in self.seconds],
+        })
+
+    def mode(self) -> str:
+        """
+        Describes the recommended streaming mode.
+        """
+        if not self.streamed_files:
+            return 'in memory'
+        return f'streaming the {self.streamed_files} files of at least {format_bytes(self.streaming_threshold)}'
+
+    def summary(self) -> str:
+        """
+        Summarizes the recommended run in a sentence.
+        """
+        return (f'{self.files} files ({format_bytes(self.input_bytes)}): about {format_seconds(self.seconds[self.workers])} '
+                f'with {self.workers} workers, {format_bytes(self.output_bytes)} written, '
+                f'{format_bytes(self.peak_memory[self.workers])} of memory at most, {self.mode()} '
+                f'(from {self.sample_files} sampled files)')
+
+
+def format_bytes(value: float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(value) < 1024:
+            return f'{value:.0f} {unit}' if unit == 'B' else f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} TB'
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 90:
+        return f'{seconds:.0f} s'
+    if seconds < 90 * 60:
+        return f'{seconds / 60:.0f} min'
+    return f'{seconds / 3600:.1f} h'
+
+
+def available_memory() -> Optional[int]:
+    """
+    Returns the memory available to new processes (bytes), or None where it is unknown.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def start_method() -> str:
+    """
+    Returns the start method of the worker processes, without fixing the default one.
+    """
+    return multiprocessing.get_start_method(allow_none=True) or multiprocessing.get_all_start_methods()[0]
+
+
+def peak_rss(who: int) -> Optional[int]:
+    """
+    Returns the peak resident memory (bytes) of this process (resource.RUSAGE_SELF) or of the largest of its
+    terminated child processes (resource.RUSAGE_CHILDREN), or None where it is unknown.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(who).ru_maxrss * (1 if sys.platform == 'darwin' else 1024) or None
+
+
+def worker_base_memory() -> int:
+    """
+    Returns the resident memory (bytes) of an idle worker process: the pages of this process for a forked worker.
+    """
+    if start_method() == 'fork' and resource is not None:
+        return peak_rss(resource.RUSAGE_SELF) or WORKER_BASE_BYTES
+    return WORKER_BASE_BYTES
+
+
+def existing_parent(path: str) -> Path:
+    """
+    Returns the path or its nearest parent which exists, e.g. the disk of an output folder not created yet.
+    """
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def sample_manifest(manifest: pd.DataFrame, sample_size: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Draws a stratified sample of the files of the manifest. The strata are the subfolders and the size classes
+    (powers of two) of the files, or only the subfolders, or only the size classes, whichever gives at most
+    sample_size strata. Each stratum gets a share of the sample in proportion to its files, and at least one file.
+
+    Args:
+        manifest (pd.DataFrame): The file manifest from create_manifest().
+        sample_size (int): The number of files to sample, at least one per stratum.
+        seed (int): The seed of the random sample, so that a plan can be reproduced.
+
+    Returns:
+        pd.DataFrame: The files of the manifest (folder_dir, file_dir, size) with their stratum, and a "sampled" column.
+    """
+    files = pd.DataFrame({
+        'folder_dir': manifest['folder_dir'].astype(object).to_numpy(),
+        'file_dir': manifest['file_dir'].astype(object).to_numpy(),
+        'size': manifest['size'].astype('int64').to_numpy(),
+    })
+    size_class = np.log2(files['size'].clip(lower=1)).astype(int)
+    by_folder_and_size = files['folder_dir'].astype(str) + '|' + size_class.astype(str)
+    if by_folder_and_size.nunique() <= sample_size:
+        files['stratum'] = pd.factorize(by_folder_and_size)[0]
+    elif files['folder_dir'].nunique() <= sample_size:
+        files['stratum'] = pd.factorize(files['folder_dir'])[0]
+    else:
+        files['stratum'] = pd.factorize(size_class)[0]
+
+    rng = np.random.default_rng(seed)
+    files['sampled'] = False
+    for _, group in files.groupby('stratum').groups.items():
+        n = min(len(group), max(1, round(sample_size * len(group) / len(files))))
+        files.loc[rng.choice(group, n, replace=False), 'sampled'] = True
+    return files
+
+
+def measure_file(file_dir: str, profile: AnonymizationProfile, streaming: bool, tmp_dir: str) -> dict:
+    """
+    Anonymizes a sampled file like a worker does, and times its reading, its anonymization and its writing.
+    The output is written with fsync, so that the time of writing is the time of the disk and not of its cache.
+
+    Returns:
+        dict: The modality, the seconds of each step, the output bytes and the error, if any.
+    """
+    measure = {'modality': None, 'read': 0.0, 'anonymize': 0.0, 'write': 0.0, 'bytes_out': 0, 'error': None}
+    output_dir = str(Path(tmp_dir) / 'sample.dcm')
+    try:
+        if streaming:
+            # Read, anonymized and written in pieces by the worker, measured as a whole
+            start = time.perf_counter()
+            anonymize(file_dir, output_dir, profile=profile, streaming=True)
+            measure['anonymize'] = time.perf_counter() - start
+            measure['bytes_out'] = os.path.getsize(output_dir)
+            header = pydicom.dcmread(file_dir, stop_before_pixels=True, specific_tags=['Modality'])
+        else:
+            start = time.perf_counter()
+            with open(file_dir, 'rb') as f:
+                data = f.read()
+            measure['read'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            output = anonymize_bytes(data, profile=profile)
+            measure['anonymize'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with open(output_dir, 'wb') as f:
+                f.write(output)
+                f.flush()
+                os.fsync(f.fileno())
+            measure['write'] = time.perf_counter() - start
+            measure['bytes_out'] = len(output)
+            header = pydicom.dcmread(BytesIO(data), stop_before_pixels=True, specific_tags=['Modality'])
+        measure['modality'] = header.get('Modality')
+    except Exception as e:
+        measure['error'] = f'{type(e).__name__}: {e}'
+    return measure
+
+
+def working_set_ratio(file_dir: str, profile: AnonymizationProfile) -> Optional[float]:
+    """
+    Measures the memory allocated to anonymize a file in memory, including the input bytes, as a multiple of its size.
+
+    Returns:
+        float or None: The ratio, or None if it cannot be measured (the file is invalid, or tracemalloc is already
+        used by the profiling of the run).
+    """
+    if tracemalloc.is_tracing():
+        return None
+    try:
+        with open(file_dir, 'rb') as f:
+            data = f.read()
+        tracemalloc.start()
+        try:
+            anonymize_bytes(data, profile=profile)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except Exception:
+        return None
+    return (peak + len(data)) / max(len(data), 1)
+
+
+def predict_peak_memory(sizes: np.ndarray, workers: int, streaming_threshold: Optional[int], chunk_size: int,
+                        io_threads: int, output_ratio: float, working_set: float, worker_base: int) -> tuple:
+    """
+    Predicts the peak memory of a run besides the application itself: the chunks buffered by the pipeline of
+    anonymize_pipelined() (2 chunks per worker plus 1 per reader thread, their inputs and outputs) and the worker
+    processes, each holding a chunk and the working set of the largest file loaded in memory.
+    Files of the streaming threshold and above are never loaded in memory. The pages a forked worker shares with
+    the main process are counted in every worker, so the memory of the run is overestimated rather than not.
+
+    Returns:
+        tuple: The peak memory of the run and of a worker process (bytes). With a single worker, which is a thread
+        of the main process, the memory of the worker is None.
+    """
+    in_memory = sizes if streaming_threshold is None else sizes[sizes < streaming_threshold]
+    chunk_bytes, pending, largest = 0.0, 0.0, 0.0
+    if len(in_memory):
+        chunk_bytes = chunk_size * float(in_memory.mean()) * (1 + output_ratio)
+        pending = min((2 * workers + io_threads) * chunk_bytes, float(in_memory.sum()) * (1 + output_ratio))
+        largest = working_set * float(in_memory.max())
+    if workers == 1:
+        return int(pending + largest), None
+    worker = worker_base + chunk_bytes + largest
+    return int(pending + workers * worker), int(worker)
+
+
+def plan_run(manifest: pd.DataFrame,
+             profile: AnonymizationProfile,
+             output_dir: str,
+             max_workers: Optional[int] = None,
+             chunk_size: int = 16,
+             io_threads: int = 4,
+             streaming_threshold: Optional[int] = None,
+             sample_size: int = 32) -> RunPlan:
+    """
+    Plans the anonymization of the files of a manifest, from the anonymization of a stratified sample.
+
+    The run takes the longest of: the anonymization over the worker processes, the reading and writing (measured
+    one file at a time, as the threads share the disk) and the transfer of the files to the workers. The number
+    of workers recommended is the smallest one within 10% of the fastest run whose peak memory fits in half of the
+    available memory, if needed by streaming the largest files.
+
+    Args:
+        manifest (pd.DataFrame): The file manifest from create_manifest().
+        profile (AnonymizationProfile): The compiled profile of the run. The UIDs it remaps are remapped in a
+            temporary store, so that planning records nothing.
+        output_dir (str): Where the anonymized files are written, e.g. "[folder]-Anonymized". The sampled files are
+            written to a temporary folder on the same disk.
+        max_workers (int, optional): The largest number of workers planned. If None, all CPU cores.
+        chunk_size (int): The number of files passed through the stages at once.
+        io_threads (int): The number of reader threads, and of writer threads.
+        streaming_threshold (int, optional): Files of at least this size (bytes) are anonymized in streaming mode.
+        sample_size (int): The number of files anonymized, at least one per stratum.
+
+    Returns:
+        RunPlan: The predictions and recommendations.
+    """
+    cores = os.cpu_count() or 1
+    max_workers = max_workers or cores
+    files = sample_manifest(manifest, sample_size)
+    sample = files[files['sampled']]
+
+    warnings = []
+    with tempfile.TemporaryDirectory() as store_dir:
+        if profile.remap_uids:
+            profile = dataclasses.replace(profile, uid_store=str(Path(store_dir) / 'uid_map.sqlite'))
+        try:
+            tmp_dir = tempfile.TemporaryDirectory(dir=existing_parent(output_dir), prefix='.plan-')
+        except OSError:
+            warnings.append(f'The output folder is not writable, the writing is measured in {tempfile.gettempdir()}.')
+            tmp_dir = tempfile.TemporaryDirectory(prefix='dicom-plan-')
+        try:
+            with tmp_dir:
+                measures = pd.DataFrame([
+                    measure_file(row.file_dir, profile,
+                                 streaming_threshold is not None and row.size >= streaming_threshold, tmp_dir.name)
+                    for row in sample.itertuples()
+                ], index=sample.index)
+            in_memory = sample[measures['error'].isna() & (sample['size'] < (streaming_threshold or np.inf))]
+            working_set = working_set_ratio(in_memory.loc[in_memory['size'].idxmax(), 'file_dir'], profile) if len(in_memory) else None
+        finally:
+            # The remapper of the temporary store is cached by the anonymization, it is closed before the store is deleted
+            if profile.remap_uids:
+                close_remappers(profile.uid_store)
+    measures = pd.concat([sample[['stratum', 'size']], measures], axis=1)
+    measures['io'] = measures['read'] + measures['write']
+
+    # Extrapolation per stratum, in proportion to the bytes of the files
+    totals = files.groupby('stratum').agg(files=('size', 'size'), bytes=('size', 'sum'))
+    sampled = measures.groupby('stratum').agg(size=('size', 'sum'), anonymize=('anonymize', 'sum'), io=('io', 'sum'),
+                                              bytes_out=('bytes_out', 'sum'), n=('size', 'size'))
+    scale = np.where(sampled['size'] > 0, totals.loc[sampled.index, 'bytes'] / sampled['size'].clip(lower=1),
+                     totals.loc[sampled.index, 'files'] / sampled['n'])
+    cpu_seconds = float((sampled['anonymize'] * scale).sum())
+    io_seconds = float((sampled['io'] * scale).sum())
+    output_bytes = int((sampled['bytes_out'] * scale).sum())
+    input_bytes = int(files['size'].sum())
+    output_ratio = output_bytes / input_bytes if input_bytes else 1.0
+    if working_set is None:
+        working_set = 3.0
+
+    chunks = max(1, math.ceil(len(files) / chunk_size))
+    sizes = files['size'].to_numpy()
+    memory = available_memory()
+    budget = memory * MEMORY_BUDGET if memory is not None else None
+    worker_base, start_seconds = worker_base_memory(), WORKER_START_SECONDS.get(start_method(), 0.4)
+    seconds, peak_memory, worker_memory, thresholds = {}, {}, {}, {}
+    for workers in range(1, max_workers + 1):
+        parallel = min(workers, cores, chunks)
+        ipc_seconds = (input_bytes + output_bytes) / IPC_BYTES_PER_SECOND if workers > 1 else 0.0
+        pool_seconds = start_seconds * math.ceil(min(workers, chunks) / cores) if workers > 1 else 0.0
+        seconds[workers] = max(cpu_seconds / parallel, io_seconds, ipc_seconds) + pool_seconds
+        # Lower the streaming threshold by powers of two until the run fits in the memory budget
+        threshold = streaming_threshold
+        peak, worker = predict_peak_memory(sizes, workers, threshold, chunk_size, io_threads, output_ratio, working_set, worker_base)
+        while budget is not None and peak > budget and (threshold is None or threshold > 1024 ** 2):
+            threshold = 2 ** int(math.log2(threshold if threshold is not None else max(int(sizes.max()), 2)) - 1)
+            peak, worker = predict_peak_memory(sizes, workers, threshold, chunk_size, io_threads, output_ratio, working_set, worker_base)
+        peak_memory[workers], thresholds[workers] = peak, threshold
+        if worker is not None:
+            worker_memory[workers] = worker
+
+    fitting = [w for w in seconds if budget is None or peak_memory[w] <= budget] or [1]
+    fastest = min(seconds[w] for w in fitting)
+    workers = min(w for w in fitting if seconds[w] <= fastest * SPEEDUP_MARGIN)
+
+    if budget is not None and peak_memory[workers] > budget:
+        warnings.append(f'The run may need {format_bytes(peak_memory[workers])} of memory, more than half of the '
+                        f'{format_bytes(memory)} available.')
+    if thresholds[workers] != streaming_threshold and profile.output_syntax is not None:
+        warnings.append('Files re-encoded to the output encoding are loaded in memory rather than streamed: select '
+                        '"Same as the input files" to lower the memory of the run.')
+    free_bytes = shutil.disk_usage(existing_parent(output_dir)).free
+    if output_bytes > free_bytes:
+        warnings.append(f'The anonymized files need about {format_bytes(output_bytes)}, but only '
+                        f'{format_bytes(free_bytes)} are free on the disk of {output_dir}.')
+    failed = int(measures['error'].notna().sum())
+    if failed:
+        warnings.append(f'{failed} of {len(measures)} sampled files could not be anonymized, e.g. '
+                        f'{measures["error"].dropna().iloc[0]}')
+
+    valid = measures[measures['error'].isna()].fillna({'modality': 'unknown'})
+    modalities = valid.groupby('modality').agg(files=('size', 'size'), bytes=('size', 'sum'), seconds=('anonymize', 'sum'))
+    modalities['MB/s per worker'] = (modalities['bytes'] / 1024 ** 2 / modalities['seconds'].clip(lower=1e-9)).round(1)
+    modalities = modalities.drop(columns='seconds').reset_index()
+
+    return RunPlan(
+        files=len(files), input_bytes=input_bytes, sample_files=len(measures), failed_samples=failed,
+        strata=int(files['stratum'].nunique()), output_bytes=output_bytes, seconds=seconds, peak_memory=peak_memory,
+        worker_memory=worker_memory, streaming_thresholds=thresholds, workers=workers, streaming_threshold=thresholds[workers],
+        streamed_files=int((sizes >= thresholds[workers]).sum()) if thresholds[workers] is not None else 0,
+        free_bytes=free_bytes, available_memory=memory, modalities=modalities, warnings=warnings,
+    )
+
+
+def compare_plan(plan: RunPlan, metrics: Metrics, max_workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Checks the plan against the metrics of the run. The predictions are scaled to the files actually
+    anonymized, as files skipped by the run journal or as duplicates are not anonymized.
+
+    Args:
+        plan (RunPlan): The plan from plan_run().
+        metrics (Metrics): The metrics of the run.
+        max_workers (int, optional): The number of workers of the run. If None, all CPU cores.
+
+    Returns:
+        pd.DataFrame: The predicted and actual values (quantity, predicted, actual, error %).
+    """
+    workers = min(max_workers or os.cpu_count() or 1, max(plan.seconds))
+    files = metrics.counters.get('files', 0)
+    share = files / plan.files if plan.files else 0.0
+    rows = [
+        ('anonymization seconds', plan.seconds[workers] * share, metrics.timers.get('anonymize_wall')),
+        ('output MB', plan.output_bytes * share / 1024 ** 2, metrics.counters.get('bytes_out', 0) / 1024 ** 2),
+    ]
+    worker_peak = peak_rss(resource.RUSAGE_CHILDREN) if resource is not None else None
+    if files and workers in plan.worker_memory and worker_peak is not None:
+        # The largest worker process terminated so far, e.g. of this run in the command line interface
+        rows.append(('peak MB per worker', plan.worker_memory[workers] / 1024 ** 2, worker_peak / 1024 ** 2))
+    comparison = pd.DataFrame(rows, columns=['quantity', 'predicted', 'actual'])
+    comparison['error %'] = (100 * (comparison['predicted'] - comparison['actual']) / comparison['actual'].where(comparison['actual'] > 0)).round()
+    comparison[['predicted', 'actual']] = comparison[['predicted', 'actual']].astype(float).round(1)
+    return comparison
@@ -0,0 +1,278 @@
+import hashlib
+import hmac
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from anonymizer_utils.archive_sink import split_location
+from anonymizer_utils.uid_remap import store_secret
+
+
+def journal_path(folder: str, shard: Optional[tuple] = None) -> str:
+    """
+    Generates the path of the run journal, which is kept next to the "-Anonymized" output folder.
+
+    Args:
+        folder (str): The directory of folder with dicom files.
+        shard (tuple, optional): The (shard, number of shards) of a sharded run, which has a journal per shard.
+
+    Returns:
+        str: The path of the journal file.
+    """
+    folder_dir = Path(folder)
+    if shard is not None:
+        return str(folder_dir.parent / f'{folder_dir.name}-Anonymized.shard-{shard[0]:03d}-of-{shard[1]:03d}.journal.sqlite')
+    return str(folder_dir.parent / f'{folder_dir.name}-Anonymized.journal.sqlite')
+
+
+def job_key(job: dict) -> str:
+    """
+    Computes a hash of everything that determines the output of a job besides the input file itself:
+    the output path, the effective profile and the updated values.
+
+    Args:
+        job (dict): The keyword arguments of anonymize().
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    update = sorted((int(tag), str(value)) for tag, value in (job.get('update') or {}).items())
+    payload = repr((str(job['output_dir']), job['profile'].fingerprint(), update))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def journal_secret(uses_store: bool, store: Optional[str] = None, secret: Optional[str] = None) -> Optional[str]:
+    """
+    Returns the secret of the hashes of the cases recorded in the journal: the secret of the UID store when the run
+    remaps UIDs or pseudonymizes identifiers, otherwise uid_secret, so that other runs do not create a store.
+
+    Args:
+        uses_store (bool): Whether the run remaps UIDs or pseudonymizes identifiers (remap_uids or pseudonym_tags).
+        store (str, optional): The path of the UID store.
+        secret (str, optional): The uid_secret of the config.
+
+    Returns:
+        str or None: The secret, or None if the run has none and its cases cannot be recorded.
+
+    Raises:
+        ValueError: If secret differs from the secret of an existing store.
+    """
+    if uses_store:
+        return store_secret(store, secret)
+    return secret
+
+
+def journal_key(secret: str) -> bytes:
+    """
+    Derives the key of the hashes of the identifiers recorded in the journal from the secret of the UID store,
+    so that they differ from the pseudonyms derived from the same secret.
+    """
+    return hmac.digest(secret.encode('utf-8'), b'run journal', 'sha256')
+
+
+def case_digest(key: bytes, column: str, value) -> str:
+    """
+    Hashes an original identifier (or the pk of a case) for the journal, which is kept next to the anonymized files.
+    """
+    return hmac.digest(key, f'{column}\x00{value}'.encode('utf-8'), 'sha256').hex()
+
+
+def output_exists(output_dir: str, archive: Optional[str] = None) -> bool:
+    """
+    Checks whether a recorded output still exists in the current output mode.
+
+    Args:
+        output_dir (str): The recorded output, a file or "<archive>::<member>".
+        archive (str, optional): The archive format of the current run ('zip' or 'tar'), or None for files.
+
+    Returns:
+        bool: True if the output is of the current mode and its file or archive exists.
+    """
+    path, member = split_location(output_dir)
+    if archive is None:
+        return member is None and Path(path).exists()
+    return member is not None and f'.{archive}' in Path(path).name and Path(path).exists()
+
+
+class RunJournal:
+    """
+    A persistent record (SQLite) of the status of every file of an anonymization run.
+    Reruns use it to skip files which are already anonymized and to retry only the failures.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS files (
+                file_dir    TEXT PRIMARY KEY,
+                output_dir  TEXT,
+                size        INTEGER,
+                mtime_ns    INTEGER,
+                digest      TEXT,
+                job_key     TEXT,
+                status      TEXT,
+                error       TEXT,
+                updated_at  REAL
+            )
+            '''
+        )
+        self.conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS cases (
+                pk          TEXT PRIMARY KEY,
+                identifiers TEXT,
+                updates     TEXT,
+                updated_at  REAL
+            )
+            '''
+        )
+        self.conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def filter_jobs(self, jobs: list, manifest: pd.DataFrame, only_failed: bool = False, archive: Optional[str] = None) -> tuple:
+        """
+        Selects the jobs which need to be (re)run.
+
+        A job is skipped when the journal has it as done (or as a duplicate of a done file) with the same input
+        size and mtime, the same job_key and the output (file or archive) still exists.
+
+        Args:
+            jobs (list): The keyword arguments of anonymize(), one per file.
+            manifest (pd.DataFrame): The file manifest from create_manifest(), with the current size and mtime_ns.
+            only_failed (bool): If True, only the jobs of files which failed in previous runs are selected.
+            archive (str, optional): The archive format of the run, so that outputs of another mode are not reused.
+
+        Returns:
+            tuple: The selected jobs and a dictionary with the job_key of each selected file_dir for record().
+        """
+        stats = manifest.set_index('file_dir')[['size', 'mtime_ns']].to_dict('index')
+        records = {
+            row[0]: row[1:]
+            for row in self.conn.execute('SELECT file_dir, size, mtime_ns, job_key, status, output_dir FROM files')
+        }
+
+        selected, keys = [], {}
+        for job in jobs:
+            key = job_key(job)
+            record = records.get(str(job['file_dir']))
+            if only_failed:
+                if record is not None and record[3] == 'failed':
+                    selected.append(job)
+                    keys[str(job['file_dir'])] = key
+                continue
+
+            stat = stats.get(str(job['file_dir']), {})
+            if (record is not None
+                    and record[3] in ('done', 'duplicate')
+                    and (record[0], record[1]) == (stat.get('size'), stat.get('mtime_ns'))
+                    and record[2] == key
+                    and output_exists(record[4], archive)):
+                continue
+            selected.append(job)
+            keys[str(job['file_dir'])] = key
+        return selected, keys
+
+    def record(self, results: list, keys: dict):
+        """
+        Records the results of anonymize_pipelined() and commits them immediately.
+
+        Args:
+            results (list): The result dictionaries from anonymize_pipelined() or resolve_duplicates().
+            keys (dict): The job_key of each file_dir.
+        """
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    result['file_dir'], result['output_dir'], result['size'], result['mtime_ns'], result['digest'],
+                    keys.get(result['file_dir']), 'failed' if result['error'] else result.get('status', 'done'), result['error'], now
+                )
+                for result in results
+            ]
+        )
+        self.conn.commit()
+
+    def failures(self) -> pd.DataFrame:
+        """
+        Returns the files which failed in previous runs.
+
+        Returns:
+            pd.DataFrame: A dataframe with columns file_dir, output_dir and error.
+        """
+        return pd.read_sql_query("SELECT file_dir, output_dir, error FROM files WHERE status = 'failed'", self.conn)
+
+    def outputs(self) -> dict:
+        """
+        Returns the outputs of the files which are done, e.g. of the first copies of duplicates anonymized by previous runs.
+
+        Returns:
+            dict: A dictionary with file_dir as key and output_dir as value.
+        """
+        return dict(self.conn.execute("SELECT file_dir, output_dir FROM files WHERE status = 'done'"))
+
+    def record_mappings(self, edit_df: pd.DataFrame, unique_ids: list, secret: str):
+        """
+        Records the values of the "Update_" columns of every case, e.g. to check that the shards of a run
+        used the same pseudonyms. The journal is kept next to the anonymized files, so the pk and the original
+        unique_ids of the cases are only recorded as keyed hashes, which can be compared between the journals
+        recorded with the same secret.
+
+        Args:
+            edit_df (pd.DataFrame): The data editor with the "Update_" columns, indexed as dcm_info.
+            unique_ids (list): The columns which identify a case.
+            secret (str): The secret of the hashes, from uid_remap.store_secret().
+        """
+        key = journal_key(secret)
+        key_id = case_digest(key, 'key_id', '')[:16]
+        if self.key_id() != key_id:
+            # The hashes of another secret cannot be compared with the new ones
+            self.conn.execute('DELETE FROM cases')
+            self.conn.execute("INSERT OR REPLACE INTO settings VALUES ('key_id', ?)", (key_id,))
+
+        update_cols = [col for col in edit_df if col.startswith('Update_')]
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?)',
+            [
+                (case_digest(key, 'pk', pk), json.dumps({col: case_digest(key, col, row[col]) for col in unique_ids}),
+                 json.dumps({col: str(row[col]) for col in update_cols}), now)
+                for pk, row in edit_df.iterrows()
+            ]
+        )
+        self.conn.commit()
+
+    def key_id(self) -> Optional[str]:
+        """
+        Returns the fingerprint of the secret of the recorded cases, or None if no case is recorded.
+        """
+        row = self.conn.execute("SELECT value FROM settings WHERE key = 'key_id'").fetchone()
+        return row[0] if row else None
+
+    def mappings(self) -> pd.DataFrame:
+        """
+        Returns the recorded cases.
+
+        Returns:
+            pd.DataFrame: A dataframe with column pk and the unique_ids, as keyed hashes, and the "Update_" columns.
+        """
+        rows = [
+            {'pk': pk, **json.loads(identifiers), **json.loads(updates)}
+            for pk, identifiers, updates in self.conn.execute('SELECT pk, identifiers, updates FROM cases')
+        ]
+        return pd.DataFrame(rows)
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from anonymizer_utils.anonymize_dicom import MANIFEST_UID_TAGS, compact_manifest, create_dcm_df, read_manifest_uids, walk_folder
+from anonymizer_utils.instrumentation import Metrics
+
+# Default folder of the scan cache
+DEFAULT_CACHE_DIR = Path.home() / '.dicom_anonymizer' / 'scan_cache'
+
+
+def parquet_available() -> bool:
+    """
+    Checks whether a parquet engine (pyarrow, a dependency of streamlit) is installed.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def cache_key(folder: str, fformat: str, dcm_tags: list) -> str:
+    """
+    Generates the cache entry name of a scan, which depends on the folder, the file extension and the DICOM tags read
+    (of the cases and of the manifest).
+    """
+    payload = repr((str(Path(folder).resolve()), fformat, list(dcm_tags), MANIFEST_UID_TAGS))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def folder_fingerprints(walk: pd.DataFrame) -> dict:
+    """
+    Computes a fingerprint of every subfolder from the paths, sizes and mtimes of its files.
+
+    Args:
+        walk (pd.DataFrame): The dataframe from walk_folder().
+
+    Returns:
+        dict: A dictionary with folder_dir as key and the fingerprint as value.
+    """
+    if walk.empty:
+        return {}
+    rows = walk['file_dir'] + '|' + walk['size'].astype(str) + '|' + walk['mtime_ns'].astype(str)
+    return {
+        folder_dir: hashlib.sha1('\n'.join(group).encode('utf-8')).hexdigest()
+        for folder_dir, group in rows.groupby(walk['folder_dir'], sort=False)
+    }
+
+
+def normalize_values(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    Converts DICOM values (e.g. UID, IS, MultiValue) to str and keeps missing values as None,
+    so that fresh and cached scans give the same result.
+    """
+    for col in columns:
+        df[col] = df[col].map(lambda x: None if x is None or (isinstance(x, float) and pd.isna(x)) else str(x)).astype(object)
+    return df
+
+
+def evict(cache_dir: Path, max_bytes: int, keep: Optional[Path] = None):
+    """
+    Removes the least recently used cache entries until the cache is not larger than max_bytes.
+
+    Args:
+        cache_dir (Path): The folder of the scan cache.
+        max_bytes (int): The size limit of the cache.
+        keep (Path, optional): A cache entry which is never removed.
+    """
+    entries = []
+    for entry in cache_dir.iterdir():
+        if entry.is_dir():
+            size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+            entries.append((entry.stat().st_mtime, size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda x: x[0]):
+        if total <= max_bytes:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def cached_scan(folder: str,
+                fformat: str,
+                unique_ids: list,
+                ref_tags: list,
+                new_tags: list,
+                cache_dir: Optional[str] = None,
+                max_bytes: int = 512 * 1024 ** 2,
+                force: bool = False,
+                max_workers: Optional[int] = None,
+                metrics: Optional[Metrics] = None) -> tuple:
+    """
+    Scans the folder like create_manifest() and create_dcm_df(), reusing the results of previous scans.
+
+    The folder is always walked, but the file headers are only read for subfolders of which the
+    fingerprint (paths, sizes and mtimes of the files) changed. The results are stored as parquet files
+    in the cache folder, which is bounded to max_bytes by removing the least recently used scans.
+
+    Args:
+        folder (str): The directory of folder with dicom files.
+        fformat (str): The file format of the targeted files.
+        unique_ids (list): The list of columns used as primary keys.
+        ref_tags (list): The list of columns to be shown in template.
+        new_tags (list): The list of tags to be determine its existence.
+        cache_dir (str, optional): The folder of the scan cache. If None, DEFAULT_CACHE_DIR is used.
+        max_bytes (int): The size limit of the cache.
+        force (bool): If True, every subfolder is rescanned.
+        max_workers (int, optional): The number of threads reading the file headers.
+        metrics (Metrics, optional): Collects the time of each step and the number of rescanned subfolders.
+
+    Returns:
+        tuple: The manifest and the dcm_info dataframes.
+    """
+    dcm_tags = list(dict.fromkeys(unique_ids + ref_tags + new_tags))
+    walk = walk_folder(folder, fformat, metrics)
+    fingerprints = folder_fingerprints(walk)
+
+    use_cache = parquet_available()
+    entry = Path(cache_dir or DEFAULT_CACHE_DIR) / cache_key(folder, fformat, dcm_tags)
+
+    # Load the previous scan
+    cached_fingerprints, cached_manifest, cached_info = {}, None, None
+    if use_cache and not force and (entry / 'fingerprints.json').exists():
+        try:
+            cached_fingerprints = json.loads((entry / 'fingerprints.json').read_text())
+            cached_manifest = pd.read_parquet(entry / 'manifest.parquet')
+            cached_info = pd.read_parquet(entry / 'dcm_info.parquet')
+        except Exception as e:
+            print(f"{e = }")
+            cached_fingerprints, cached_manifest, cached_info = {}, None, None
+
+    unchanged = [f for f, fingerprint in fingerprints.items() if cached_fingerprints.get(f) == fingerprint]
+    changed = [f for f in fingerprints if f not in set(unchanged)]
+    if metrics is not None:
+        metrics.count('subfolders_cached', len(unchanged))
+        metrics.count('subfolders_rescanned', len(changed))
+
+    # Read the headers of the changed subfolders only
+    manifest_parts, info_parts = [], []
+    if unchanged:
+        manifest_parts.append(cached_manifest[cached_manifest['folder_dir'].isin(unchanged)])
+        info_parts.append(cached_info[cached_info['folder_dir'].isin(unchanged)])
+    if changed:
+        changed_manifest = read_manifest_uids(walk[walk['folder_dir'].isin(changed)], max_workers, metrics)
+        changed_info = create_dcm_df(
+            folder, fformat, unique_ids, ref_tags, new_tags, manifest=changed_manifest, max_workers=max_workers, metrics=metrics
+        )
+        manifest_parts.append(normalize_values(changed_manifest, MANIFEST_UID_TAGS))
+        info_parts.append(normalize_values(changed_info, dcm_tags))
+
+    # Restore the order of the directory walk
+    folder_order = {f: i for i, f in enumerate(fingerprints)}
+    manifest = pd.concat(manifest_parts) if manifest_parts else walk.assign(**{t: None for t in MANIFEST_UID_TAGS})
+    manifest = manifest.sort_values('folder_dir', key=lambda x: x.astype(object).map(folder_order), kind='stable')
+    manifest = compact_manifest(manifest.reset_index(drop=True))
+    if not info_parts:
+        return manifest, create_dcm_df(folder, fformat, unique_ids, ref_tags, new_tags, manifest=manifest)
+    dcm_info = pd.concat(info_parts).sort_values('folder_dir', key=lambda x: x.map(folder_order), kind='stable')
+
+    # Store the scan
+    if use_cache and changed:
+        try:
+            # Write to temporary files first, as several processes (e.g. shards of a run) may scan the same folder
+            entry.mkdir(parents=True, exist_ok=True)
+            tmp = f'.{os.getpid()}.tmp'
+            manifest.to_parquet(entry / f'manifest.parquet{tmp}')
+            dcm_info.to_parquet(entry / f'dcm_info.parquet{tmp}')
+            (entry / f'fingerprints.json{tmp}').write_text(json.dumps(fingerprints))
+            for name in ('manifest.parquet', 'dcm_info.parquet', 'fingerprints.json'):
+                os.replace(entry / f'{name}{tmp}', entry / name)
+            evict(entry.parent, max_bytes, keep=entry)
+        except Exception as e:
+            print(f"{e = }")
+    elif use_cache and entry.exists():
+        os.utime(entry)     # mark as recently used
+
+    return manifest, dcm_info
@@ -0,0 +1,173 @@
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+
+from anonymizer_utils.run_journal import RunJournal, journal_path
+
+# Keys of the deterministic split: all files of a patient, or of a series, go to the same shard
+SHARD_KEYS = ('patient', 'series')
+
+
+def parse_shard(text: str) -> tuple:
+    """
+    Parses a shard given as "k/N", where k counts from 0.
+
+    Args:
+        text (str): The shard, e.g. "0/4".
+
+    Returns:
+        tuple: The (shard, number of shards).
+
+    Raises:
+        ValueError: If the text is not a valid shard.
+    """
+    shard, sep, n_shards = text.partition('/')
+    if not sep or not shard.isdigit() or not n_shards.isdigit() or not 0 <= int(shard) < int(n_shards):
+        raise ValueError(f'Invalid shard "{text}", expected "k/N" with 0 <= k < N.')
+    return int(shard), int(n_shards)
+
+
+def shard_index(value: str, n_shards: int) -> int:
+    """
+    Maps a key to a shard with a stable hash, so that every machine computes the same split.
+    (The built-in hash() of str is randomized per process.)
+    """
+    digest = hashlib.sha1(str(value).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % n_shards
+
+
+def shard_manifest(manifest: pd.DataFrame, dcm_info: pd.DataFrame, shard: int, n_shards: int, key: str = 'patient') -> pd.DataFrame:
+    """
+    Selects the files of shard k of N.
+
+    Args:
+        manifest (pd.DataFrame): The file manifest from create_manifest().
+        dcm_info (pd.DataFrame): The dataframe from create_dcm_df(), with the PatientID of each folder_dir.
+        shard (int): The shard k, from 0 to n_shards - 1.
+        n_shards (int): The number of shards N.
+        key (str): 'patient' splits by PatientID, 'series' by SeriesInstanceUID. Files without the key
+            are split by subfolder, or by file.
+
+    Returns:
+        pd.DataFrame: The rows of the manifest in the shard.
+    """
+    if key not in SHARD_KEYS:
+        raise ValueError(f'Unknown shard key "{key}", expected one of {SHARD_KEYS}.')
+
+    if key == 'patient' and 'PatientID' in dcm_info:
+        patient_ids = dcm_info.set_index('folder_dir')['PatientID']
+        keys = manifest['folder_dir'].astype(object).map(patient_ids).fillna(manifest['folder_dir'].astype(object))
+    elif key == 'series' and 'SeriesInstanceUID' in manifest:
+        keys = manifest['SeriesInstanceUID'].astype(object).fillna(manifest['file_dir'].astype(object))
+    else:
+        keys = manifest['folder_dir'].astype(object)
+
+    # Hash every distinct key once
+    shards = {value: shard_index(value, n_shards) for value in keys.unique()}
+    return manifest[keys.map(shards) == shard]
+
+
+def find_conflicts(mappings: pd.DataFrame, unique_ids: list) -> pd.DataFrame:
+    """
+    Checks that the shards gave the same values to the same cases:
+    - an "Update_X" column has a single value per value of X when X is a unique_ids column (e.g. the
+      Update_PatientID of a patient), or per case otherwise ('inconsistent' otherwise);
+    - different values of a unique_ids column which is also updated do not share a pseudonym ('collision' otherwise).
+
+    Only the values which differ between shards are conflicts. Within a shard, the cases of a patient may
+    legitimately differ, e.g. the mapping sheet only updates the first case of each PatientID.
+
+    Args:
+        mappings (pd.DataFrame): The recorded cases of all shards (RunJournal.mappings()), with a column shard.
+        unique_ids (list): The columns which identify a case.
+
+    Returns:
+        pd.DataFrame: The conflicts, with columns kind, column, value, conflicting_values and shards.
+    """
+    columns = ['kind', 'column', 'value', 'conflicting_values', 'shards']
+    if mappings.empty:
+        return pd.DataFrame(columns=columns)
+
+    def across_shards(pairs, key, col):
+        # Keys with several values of col, coming from several shards
+        counts = pairs.groupby(key).agg(values=(col, 'nunique'), shards=('shard', 'nunique'))
+        for value in counts.index[(counts['values'] > 1) & (counts['shards'] > 1)]:
+            rows = pairs[pairs[key] == value]
+            yield value, sorted(rows[col].unique()), sorted(rows['shard'].unique())
+
+    conflicts = []
+    for update_col in [col for col in mappings if col.startswith('Update_')]:
+        id_col = update_col.removeprefix('Update_')
+        key = id_col if id_col in unique_ids and id_col in mappings else 'pk'
+        pairs = mappings[[key, update_col, 'shard']].drop_duplicates()
+        for value, values, shards in across_shards(pairs, key, update_col):
+            conflicts.append(('inconsistent', update_col, value, values, shards))
+
+        if key == id_col:
+            pairs = mappings[[id_col, update_col, 'shard']].drop_duplicates()
+            pairs = pairs[pairs[update_col] != '']
+            for value, values, shards in across_shards(pairs, update_col, id_col):
+                conflicts.append(('collision', update_col, value, values, shards))
+    return pd.DataFrame(conflicts, columns=columns)
+
+
+def merge_shard_journals(folder: str, n_shards: int, unique_ids: list) -> dict:
+    """
+    Combines the journals of the N shards of a run into the journal of the folder, so that later runs
+    without sharding skip the files done by any shard, and checks the consistency of the pseudonyms.
+
+    Args:
+        folder (str): The directory of folder with dicom files.
+        n_shards (int): The number of shards N.
+        unique_ids (list): The columns which identify a case.
+
+    Returns:
+        dict: The missing shard journals (missing), the number of files (files) and failures (failed) of the
+        merged journal, the conflicts of the pseudonyms (conflicts, a dataframe from find_conflicts()) and the
+        fingerprints of the secrets which hashed the identifiers of the shards (key_ids), which only compare
+        between the shards of the same secret.
+    """
+    paths = {shard: journal_path(folder, (shard, n_shards)) for shard in range(n_shards)}
+    missing = [path for path in paths.values() if not Path(path).exists()]
+
+    mappings = []
+    key_ids = set()
+    with RunJournal(journal_path(folder)) as journal:
+        for shard, path in paths.items():
+            if path in missing:
+                continue
+            with RunJournal(path) as shard_journal:
+                mappings.append(shard_journal.mappings().assign(shard=shard))
+                if shard_journal.key_id() is not None:
+                    key_ids.add(shard_journal.key_id())
+
+            # Copy the records of the shard, keeping the latest record of every file
+            journal.conn.execute('ATTACH DATABASE ? AS shard', (path,))
+            journal.conn.execute(
+                '''
+                INSERT OR REPLACE INTO files
+                SELECT s.* FROM shard.files AS s
+                LEFT JOIN files AS f ON f.file_dir = s.file_dir
+                WHERE f.file_dir IS NULL OR s.updated_at >= f.updated_at
+                '''
+            )
+            journal.conn.execute('INSERT OR REPLACE INTO cases SELECT * FROM shard.cases')
+            journal.conn.commit()
+            journal.conn.execute('DETACH DATABASE shard')
+
+        if len(key_ids) == 1:
+            journal.conn.execute("INSERT OR REPLACE INTO settings VALUES ('key_id', ?)", (*key_ids,))
+            journal.conn.commit()
+        files, failed = journal.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(status = 'failed'), 0) FROM files"
+        ).fetchone()
+
+    mappings = pd.concat(mappings, ignore_index=True) if mappings else pd.DataFrame()
+    return {
+        'missing': missing,
+        'files': files,
+        'failed': failed,
+        'conflicts': find_conflicts(mappings, unique_ids),
+        'key_ids': sorted(key_ids),
+    }
@@ -0,0 +1,145 @@
+"""
+Re-encoding of the anonymized files to another transfer syntax, e.g. to copy uncompressed CT series losslessly
+compressed to a share or over a slow link. It runs in the worker processes, right before the file is written.
+"""
+from io import BytesIO
+from typing import Optional
+
+from pydicom import Dataset
+from pydicom.uid import UID, DeflatedExplicitVRLittleEndian, JPEG2000Lossless, JPEGLSLossless, RLELossless
+
+from anonymizer_utils.instrumentation import Metrics, timed
+
+# Output transfer syntaxes of the config. Deflate compresses the whole dataset with zlib, the other ones
+# compress the pixel data losslessly with a codec.
+OUTPUT_SYNTAXES = {
+    'deflated': DeflatedExplicitVRLittleEndian,
+    'rle': RLELossless,            # encoded by pydicom itself
+    'jpegls': JPEGLSLossless,      # requires pyjpegls
+    'jpeg2000': JPEG2000Lossless,  # requires pylibjpeg and pylibjpeg-openjpeg
+}
+
+
+def missing_codec(syntax: str) -> Optional[str]:
+    """
+    Checks whether the pixel data can be encoded in a transfer syntax in this environment.
+
+    Returns:
+        str or None: The missing dependencies of the encoder, or None if it is available.
+    """
+    syntax = UID(syntax)
+    if not syntax.is_encapsulated:
+        return None
+    from pydicom.pixels import get_encoder
+    encoder = get_encoder(syntax)
+    return None if encoder.is_available else '; '.join(encoder.missing_dependencies)
+
+
+def available_syntaxes() -> list:
+    """
+    Lists the names of OUTPUT_SYNTAXES of which the encoder is installed.
+    """
+    return [name for name, syntax in OUTPUT_SYNTAXES.items() if missing_codec(syntax) is None]
+
+
+def resolve_output_syntax(name: Optional[str]) -> Optional[str]:
+    """
+    Resolves the output transfer syntax of the config.
+
+    Args:
+        name (str, optional): A name of OUTPUT_SYNTAXES, or None to keep the transfer syntax of the input files.
+
+    Returns:
+        str or None: The transfer syntax UID.
+
+    Raises:
+        ValueError: If the name is unknown, or its encoder is not installed.
+    """
+    if name is None:
+        return None
+    if name not in OUTPUT_SYNTAXES:
+        raise ValueError(f'Invalid output transfer syntax "{name}", expected None or one of {list(OUTPUT_SYNTAXES)}.')
+    missing = missing_codec(OUTPUT_SYNTAXES[name])
+    if missing is not None:
+        raise ValueError(f'The encoder of "{name}" is not installed ({missing}). '
+                         f'The encoders of {available_syntaxes()} are available.')
+    return str(OUTPUT_SYNTAXES[name])
+
+
+def needs_encoding(original: Optional[str], syntax: Optional[str]) -> bool:
+    """
+    Whether encode_dataset() changes the transfer syntax of a file, e.g. so that files which are kept in their
+    transfer syntax can still be streamed.
+
+    Args:
+        original (str, optional): The transfer syntax UID of the input file.
+        syntax (str, optional): The output transfer syntax UID, or None to keep the transfer syntax of the input.
+    """
+    if syntax is None:
+        return False
+    return original is None or (original != syntax and not UID(original).is_encapsulated)
+
+
+def encode_dataset(ds: Dataset, syntax: str, metrics: Optional[Metrics] = None) -> bytes:
+    """
+    Re-encodes an anonymized dataset to a transfer syntax, and writes it to bytes.
+
+    Files of which the pixel data is already compressed are kept in their transfer syntax: decoding them (e.g. lossy
+    JPEG) to encode them losslessly would grow them. A file which the codec cannot encode (e.g. an unsupported bit
+    depth) is kept in its transfer syntax as well, and counted as encode_fallbacks. Datasets without pixel data
+    are only deflated.
+
+    Args:
+        ds (Dataset): The anonymized dataset with its file meta information, modified in place.
+        syntax (str): The transfer syntax UID, from resolve_output_syntax().
+        metrics (Metrics, optional): Collects the time of the conversion and of the encoding ("transcode"), the
+            files encoded and the bytes of uncompressed pixel data encoded.
+
+    Returns:
+        bytes: The content of the file.
+    """
+    syntax = UID(syntax)
+    encoded, pixel_bytes = False, 0
+    with timed(metrics, 'transcode'):
+        original = ds.file_meta.get('TransferSyntaxUID')
+        if needs_encoding(original, syntax):
+            try:
+                if 'PixelData' in ds:
+                    pixel_bytes = len(ds.PixelData)
+                if not syntax.is_encapsulated:
+                    ds.file_meta.TransferSyntaxUID = syntax
+                    encoded = True
+                elif 'PixelData' in ds:
+                    ds.compress(syntax, generate_instance_uid=False)
+                    encoded = True
+            except Exception:
+                if metrics is not None:
+                    metrics.count('encode_fallbacks')
+
+        buffer = BytesIO()
+        ds.save_as(buffer)
+    if metrics is not None and encoded:
+        metrics.count('files_encoded')
+        metrics.count('bytes_encoded', pixel_bytes)
+    return buffer.getvalue()
+
+
+def encoding_summary(metrics: Metrics) -> Optional[str]:
+    """
+    Summarizes the re-encoding of a run: the bytes saved on the output and the encoding throughput.
+
+    Returns:
+        str or None: The summary, or None if no file was encoded.
+    """
+    files = metrics.counters.get('files_encoded', 0)
+    fallbacks = metrics.counters.get('encode_fallbacks', 0)
+    if not files and not fallbacks:
+        return None
+    saved = metrics.counters.get('bytes_in', 0) - metrics.counters.get('bytes_out', 0)
+    seconds = metrics.timers.get('transcode', 0.0)
+    throughput = metrics.counters.get('bytes_encoded', 0) / 1024 ** 2 / seconds if seconds else 0.0
+    summary = (f'{files} files re-encoded at {throughput:.1f} MB/s of pixel data per worker, '
+               f'{saved / 1024 ** 2:.1f} MB saved on the output')
+    if fallbacks:
+        summary += f', {fallbacks} files could not be re-encoded'
+    return summary
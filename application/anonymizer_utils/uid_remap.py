@@ -0,0 +1,328 @@
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from pydicom.multival import MultiValue
+from pydicom.uid import PYDICOM_ROOT_UID, generate_uid
+
+# Default store of the remapping table, shared by all runs of the user
+DEFAULT_UID_STORE = Path.home() / '.dicom_anonymizer' / 'uid_map.sqlite'
+
+# DICOM tags of which the UIDs identify a patient's study, series or instance, and the references to them
+DEFAULT_UID_TAGS = (
+    'StudyInstanceUID',
+    'SeriesInstanceUID',
+    'SOPInstanceUID',
+    'FrameOfReferenceUID',
+    'ReferencedSOPInstanceUID',
+    'ReferencedFrameOfReferenceUID',
+)
+
+# Remappers of this process, by (pid, store, prefix), so that forked workers open their own connection
+_remappers = {}
+_remappers_lock = threading.Lock()
+
+
+def uid_store_path(uid_store: Optional[str] = None) -> str:
+    """
+    Resolves the path of the remapping table. If None, DEFAULT_UID_STORE is used.
+    """
+    return str(Path(uid_store or DEFAULT_UID_STORE).expanduser().resolve())
+
+
+class UIDRemapper:
+    """
+    A deterministic remapping table of UIDs and identifiers (e.g. PatientID, AccessionNumber), so that repeat
+    exports of the same patient get the same new values and can be linked or deduplicated.
+
+    The new values are derived from the original values and a secret, so that every process computes the same
+    values without coordination. The pairs are recorded in a persistent store (SQLite) which is authoritative:
+    a value which is already recorded keeps its new value, even if the secret changes. Lookups are answered by an
+    in-memory LRU cache, and the new pairs are written in batches (flush()).
+    """
+
+    def __init__(self, store: Optional[str] = None, prefix: Optional[str] = None, secret: Optional[str] = None,
+                 cache_size: int = 2 ** 16, batch_size: int = 256):
+        """
+        Args:
+            store (str, optional): The path of the SQLite store. If None, DEFAULT_UID_STORE is used.
+            prefix (str, optional): The root of the new UIDs, ending with a dot. If None, the pydicom root is used.
+            secret (str, optional): The secret of the derivation, e.g. to get the same values on several machines.
+                If None, the secret of the store is used, or a random one when the store is new.
+            cache_size (int): The number of lookups kept in memory.
+            batch_size (int): The number of new pairs written to the store at once.
+
+        Raises:
+            ValueError: If secret differs from the secret of an existing store.
+        """
+        self.store = uid_store_path(store)
+        self.prefix = prefix or PYDICOM_ROOT_UID
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = []
+
+        Path(self.store).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.store, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS uids (
+                original    TEXT PRIMARY KEY,
+                new         TEXT UNIQUE
+            )
+            '''
+        )
+        self.conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS pseudonyms (
+                tag         TEXT,
+                original    TEXT,
+                pseudonym   TEXT,
+                PRIMARY KEY (tag, original),
+                UNIQUE (tag, pseudonym)
+            )
+            '''
+        )
+        self.conn.execute('INSERT OR IGNORE INTO settings VALUES (?, ?)', ('secret', secret or secrets.token_hex(32)))
+        self.conn.commit()
+        self.secret, = self.conn.execute("SELECT value FROM settings WHERE key = 'secret'").fetchone()
+        if secret is not None and secret != self.secret:
+            raise ValueError(f'The UID store "{self.store}" was created with another secret.')
+
+        self.remap = lru_cache(maxsize=cache_size)(self._remap)
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _remap(self, uid: str) -> str:
+        """
+        Looks up the new UID of a UID in the store, or derives it. Called through the LRU cache remap().
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT new FROM uids WHERE original = ?', (uid,)).fetchone()
+        if row is not None:
+            return row[0]
+
+        new_uid = generate_uid(prefix=self.prefix, entropy_srcs=[self.secret, uid])
+        with self.lock:
+            self.pending.append((uid, new_uid))
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+        return new_uid
+
+    def _flush(self):
+        # Another process may have recorded the same pair, which is identical as the values are derived
+        self.conn.executemany('INSERT OR IGNORE INTO uids VALUES (?, ?)', self.pending)
+        self.conn.commit()
+        self.pending = []
+
+    def flush(self):
+        """
+        Writes the new pairs to the store.
+        """
+        with self.lock:
+            if self.pending:
+                self._flush()
+
+    def _candidate(self, tag: str, value: str, prefix: str, length: int, counter: int) -> str:
+        """
+        Derives the pseudonym candidate of a value, the next counter is taken on a collision.
+        """
+        message = f'{tag}\x00{value}\x00{counter}'.encode('utf-8')
+        digest = hmac.digest(self.secret.encode('utf-8'), message, 'sha256').hex()
+        return f'{prefix}{digest[:length].upper()}'
+
+    def pseudonym(self, tag: str, value: str, prefix: str = '', length: int = 12) -> str:
+        """
+        Gets the pseudonym of an identifier, e.g. of a PatientID. Pseudonyms are unique per tag: on a collision
+        of the derived value, the next candidate is taken.
+
+        Args:
+            tag (str): The DICOM keyword of the identifier.
+            value (str): The original value. Empty values stay empty.
+            prefix (str): Prepended to the pseudonym.
+            length (int): The number of hexadecimal characters after the prefix.
+
+        Returns:
+            str: The pseudonym.
+        """
+        value = str(value)
+        if not value:
+            return ''
+        with self.lock:
+            row = self.conn.execute('SELECT pseudonym FROM pseudonyms WHERE tag = ? AND original = ?', (tag, value)).fetchone()
+            if row is not None:
+                return row[0]
+
+            for counter in range(1000):
+                pseudonym = self._candidate(tag, value, prefix, length, counter)
+                self.conn.execute('INSERT OR IGNORE INTO pseudonyms VALUES (?, ?, ?)', (tag, value, pseudonym))
+                self.conn.commit()
+                row = self.conn.execute('SELECT pseudonym FROM pseudonyms WHERE tag = ? AND original = ?', (tag, value)).fetchone()
+                if row is not None:
+                    return row[0]
+        raise RuntimeError(f'Unable to find a unique pseudonym of {tag}, increase its length.')
+
+    def pseudonyms(self, tag: str, values: list, prefix: str = '', length: int = 12) -> list:
+        """
+        Gets the pseudonyms of many identifiers at once, e.g. of every case of the template: the recorded
+        pseudonyms are looked up and the new ones are written in a single transaction. The values of which
+        the first candidate collides fall back to pseudonym().
+
+        Args:
+            tag (str): The DICOM keyword of the identifiers.
+            values (list): The original values. Empty values stay empty.
+            prefix (str): Prepended to the pseudonyms.
+            length (int): The number of hexadecimal characters after the prefix.
+
+        Returns:
+            list: The pseudonyms, in the order of values.
+        """
+        values = [str(value) for value in values]
+        originals = [value for value in dict.fromkeys(values) if value]
+
+        def lookup(originals):
+            found = {}
+            # SQLite limits the number of parameters of a query
+            for i in range(0, len(originals), 500):
+                chunk = originals[i:i + 500]
+                found.update(self.conn.execute(
+                    f'SELECT original, pseudonym FROM pseudonyms WHERE tag = ? AND original IN ({", ".join("?" * len(chunk))})',
+                    (tag, *chunk)
+                ))
+            return found
+
+        with self.lock:
+            found = lookup(originals)
+            new = [value for value in originals if value not in found]
+            self.conn.executemany('INSERT OR IGNORE INTO pseudonyms VALUES (?, ?, ?)', [
+                (tag, value, self._candidate(tag, value, prefix, length, 0)) for value in new
+            ])
+            self.conn.commit()
+            found.update(lookup(new))
+
+        for value in originals:
+            if value not in found:
+                found[value] = self.pseudonym(tag, value, prefix, length)
+        return [found.get(value, '') for value in values]
+
+
+def check_uid_store(store: Optional[str] = None, secret: Optional[str] = None):
+    """
+    Creates the store with its secret, or checks the secret of an existing store, before the workers open it.
+
+    Raises:
+        ValueError: If secret differs from the secret of an existing store.
+    """
+    UIDRemapper(store, secret=secret).close()
+
+
+def store_secret(store: Optional[str] = None, secret: Optional[str] = None) -> str:
+    """
+    Returns the secret of the store, creating the store when it is new, e.g. to key the hashes of the identifiers
+    recorded in the run journal.
+
+    Raises:
+        ValueError: If secret differs from the secret of an existing store.
+    """
+    with UIDRemapper(store, secret=secret) as remapper:
+        return remapper.secret
+
+
+def get_remapper(store: Optional[str] = None, prefix: Optional[str] = None) -> UIDRemapper:
+    """
+    Gets the remapper of the current process, which is opened once and shared by its threads.
+
+    Args:
+        store (str, optional): The path of the SQLite store. If None, DEFAULT_UID_STORE is used.
+        prefix (str, optional): The root of the new UIDs.
+
+    Returns:
+        UIDRemapper: The remapper.
+    """
+    key = (os.getpid(), uid_store_path(store), prefix)
+    with _remappers_lock:
+        if key not in _remappers:
+            _remappers[key] = UIDRemapper(store, prefix)
+        return _remappers[key]
+
+
+def flush_remappers():
+    """
+    Writes the new pairs of the remappers of the current process to their stores, e.g. at the end of a chunk.
+    """
+    pid = os.getpid()
+    for key, remapper in list(_remappers.items()):
+        if key[0] == pid:
+            remapper.flush()
+
+
+def close_remappers(store: Optional[str] = None):
+    """
+    Closes the remappers of a store in the current process, e.g. before a temporary store is deleted.
+    """
+    pid, path = os.getpid(), uid_store_path(store)
+    with _remappers_lock:
+        for key in [key for key in _remappers if key[:2] == (pid, path)]:
+            _remappers.pop(key).close()
+
+
+def remap_value(value, store: Optional[str] = None, prefix: Optional[str] = None):
+    """
+    Remaps a UID, or each UID of a multi-valued element.
+    """
+    remapper = get_remapper(store, prefix)
+    if isinstance(value, (list, tuple, MultiValue)):
+        return [remapper.remap(str(uid)) if uid else uid for uid in value]
+    return remapper.remap(str(value))
+
+
+def with_pseudonyms(update_tags: dict, pseudonym_tags: dict, store: Optional[str] = None,
+                    secret: Optional[str] = None) -> dict:
+    """
+    Replaces the default rules of update_tags by deterministic pseudonyms of the original values,
+    e.g. to pre-fill "Update_PatientID" in the template, and sets the store of the "pseudonym" rules
+    of update_tags which do not set their own.
+
+    Args:
+        update_tags (dict): The DICOM tags to be updated, with their default rules.
+        pseudonym_tags (dict): The DICOM tags of update_tags to be pseudonymized, with the prefix of their pseudonyms.
+        store (str, optional): The path of the SQLite store. If None, DEFAULT_UID_STORE is used.
+        secret (str, optional): The secret of the store.
+
+    Returns:
+        dict: A copy of update_tags with the "pseudonym" rules of the pseudonymized tags.
+
+    Raises:
+        ValueError: If a tag of pseudonym_tags is not in update_tags.
+    """
+    pseudonym_tags = pseudonym_tags or {}
+    unknown_tags = [tag for tag in pseudonym_tags if tag not in update_tags]
+    if unknown_tags:
+        raise ValueError(f'The pseudonym tags {unknown_tags} must be in update_tags.')
+
+    def resolve(rule):
+        if isinstance(rule, list):
+            return [resolve(step) for step in rule]
+        if isinstance(rule, dict) and rule.get('rule') == 'pseudonym':
+            return {'store': store, 'secret': secret, **rule}
+        return rule
+
+    rules = {tag: resolve(rule) for tag, rule in update_tags.items()}
+    for tag, prefix in pseudonym_tags.items():
+        rules[tag] = resolve({'rule': 'pseudonym', 'prefix': prefix})
+    return rules
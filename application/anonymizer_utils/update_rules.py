@@ -0,0 +1,250 @@
+"""
+Default values of the "Update_" columns of the template, from the rules of config.update_tags.
+
+A rule is either:
+    - a constant, e.g. '19700101',
+    - a declarative rule, a dictionary with the name of the rule and its parameters, e.g.
+      {'rule': 'strip_prefix', 'prefix': 'PXH'}, or a list of them applied one after the other,
+    - a callable of the original value, only kept as a fallback for what the declarative rules cannot express.
+
+Declarative rules are compiled to operations over the whole column of original values (pandas string methods,
+vectorized date arithmetic). The rules which need Python code per value (pseudonyms, formatting, callables) are
+only evaluated once per distinct value.
+"""
+import string
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from anonymizer_utils.uid_remap import UIDRemapper, uid_store_path
+
+# name: (required parameters, optional parameters with their default values)
+RULES = {
+    # The same value for every case, e.g. {'rule': 'constant', 'value': '19700101'}
+    'constant':      (('value',), {}),
+    # re.sub() of the value, e.g. {'rule': 'regex_replace', 'pattern': r'^[a-zA-Z]+', 'repl': ''}
+    'regex_replace': (('pattern',), {'repl': '', 'count': 0}),
+    # The value without a leading prefix, e.g. {'rule': 'strip_prefix', 'prefix': 'PXH'}
+    'strip_prefix':  (('prefix',), {}),
+    # A date moved by a number of days, e.g. {'rule': 'date_shift', 'days': -365}. Invalid dates become empty.
+    'date_shift':    (('days',), {'format': '%Y%m%d'}),
+    # The pseudonym of the value in the remapping table, e.g. {'rule': 'pseudonym', 'prefix': 'PAT'}
+    'pseudonym':     ((), {'prefix': '', 'length': 12, 'store': None, 'secret': None}),
+    # str.format() with the value, the other columns of the template and the number of the case,
+    # e.g. {'rule': 'format', 'format': 'CASE{index:05d}'} or {'rule': 'format', 'format': '{PatientSex}-{value}'}
+    'format':        (('format',), {}),
+}
+
+
+class CompiledRule:
+    """
+    A rule of update_tags compiled to a list of steps, each computing the new values of the column from the
+    previous ones.
+    """
+
+    def __init__(self, tag: str, steps: list):
+        """
+        Args:
+            tag (str): The DICOM tag of the original values.
+            steps (list): Callables as step(values, frame), returning the new values (pd.Series of str).
+        """
+        self.tag = tag
+        self.steps = steps
+
+    def __call__(self, frame: pd.DataFrame) -> pd.Series:
+        """
+        Computes the new values of the cases.
+
+        Args:
+            frame (pd.DataFrame): The cases, with a column of the original values of the tag. Without the
+                column, as for a tag which is not in the files, the original values are empty.
+
+        Returns:
+            pd.Series: The new values, as str objects.
+        """
+        if self.tag in frame:
+            values = as_strings(frame[self.tag])
+        else:
+            values = pd.Series('', index=frame.index, dtype=object)
+        for step in self.steps:
+            values = step(values, frame)
+        return values.astype(object)
+
+
+def on_distinct(values: pd.Series, func: Callable[[pd.Series], list]) -> pd.Series:
+    """
+    Applies a function to the distinct values only, e.g. the few birth dates or the cases of the same patient.
+
+    Args:
+        values (pd.Series): The values.
+        func (callable): Called with the distinct values, returns their new values in the same order.
+
+    Returns:
+        pd.Series: The new values, with the index of values.
+    """
+    codes, uniques = pd.factorize(values)
+    new_values = np.asarray(func(pd.Series(uniques, dtype=object)), dtype=object)
+    return pd.Series(new_values[codes], index=values.index)
+
+
+def as_strings(values: pd.Series) -> pd.Series:
+    """
+    Converts the values to str, as Arrow strings when pyarrow is installed, of which the string methods run
+    in C++. Missing values become empty.
+    """
+    try:
+        return values.astype(pd.StringDtype('pyarrow')).fillna('')
+    except ImportError:
+        return values.fillna('').astype(str)
+
+
+def regex_replace(pattern: str, repl: str, count: int):
+    """
+    Step of the "regex_replace" rule, run by Arrow when the pattern allows it.
+    """
+    def step(values, frame):
+        try:
+            return as_strings(values).str.replace(pattern, repl, n=count or -1, regex=True)
+        except ValueError:
+            # A pattern which is not supported by the regular expressions of Arrow (RE2), e.g. a lookahead
+            return values.astype(object).str.replace(pattern, repl, n=count or -1, regex=True)
+    return step
+
+
+def strip_prefix(prefix: str):
+    """
+    Step of the "strip_prefix" rule.
+    """
+    return lambda values, frame: as_strings(values).str.removeprefix(prefix)
+
+
+def date_shift(days: int, format: str):
+    """
+    Step of the "date_shift" rule, computed once per distinct date.
+    """
+    def shift(dates):
+        shifted = pd.to_datetime(dates, format=format, errors='coerce') + pd.Timedelta(days=days)
+        return shifted.dt.strftime(format).fillna('').tolist()
+    return lambda values, frame: on_distinct(values, shift)
+
+
+def pseudonym(tag: str, remapper: UIDRemapper, prefix: str, length: int):
+    """
+    Step of the "pseudonym" rule, looked up and recorded in batches in the remapping table.
+    """
+    return lambda values, frame: on_distinct(values, lambda uniques: remapper.pseudonyms(tag, uniques, prefix, length))
+
+
+def format_values(template: str):
+    """
+    Step of the "format" rule, concatenating whole columns. Only the fields with a format spec are
+    formatted per distinct value.
+
+    Raises:
+        ValueError: If the format is invalid.
+    """
+    try:
+        fields = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise ValueError(f'Invalid format "{template}": {e}')
+
+    def step(values, frame):
+        result = as_strings(pd.Series('', index=values.index))
+        for literal, field, spec, conversion in fields:
+            result = result + literal
+            if field is None:
+                continue
+            if field == 'value':
+                column = values
+            elif field == 'index':
+                column = pd.Series(np.arange(1, len(values) + 1), index=values.index)
+            elif field in frame:
+                column = frame[field].fillna('')
+            else:
+                raise ValueError(f'The format "{template}" refers to "{field}", which is not a column of the template.')
+            if spec or conversion:
+                convert = {'s': str, 'r': repr, 'a': ascii}.get(conversion, lambda value: value)
+                column = on_distinct(column, lambda uniques: [format(convert(value), spec) for value in uniques])
+            result = result + as_strings(column)
+        return result
+    return step
+
+
+def compile_step(tag: str, rule: dict, remappers: dict) -> Callable[[pd.Series, pd.DataFrame], pd.Series]:
+    """
+    Compiles a declarative rule to a step of a CompiledRule.
+
+    Raises:
+        ValueError: If the rule is unknown, or a parameter is missing or unexpected.
+    """
+    if not isinstance(rule, dict) or rule.get('rule') not in RULES:
+        name = rule.get('rule') if isinstance(rule, dict) else rule
+        raise ValueError(f'Invalid rule of {tag}: unknown rule {name!r}, expected one of {list(RULES)}.')
+    required, optional = RULES[rule['rule']]
+    params = {key: value for key, value in rule.items() if key != 'rule'}
+    missing = [key for key in required if key not in params]
+    unexpected = [key for key in params if key not in required and key not in optional]
+    if missing or unexpected:
+        raise ValueError(f'Invalid rule of {tag}: "{rule["rule"]}" requires {list(required)} and accepts '
+                         f'{list(optional)}, got {list(params)}.')
+    params = {**optional, **params}
+
+    if rule['rule'] == 'constant':
+        return lambda values, frame: pd.Series(params['value'], index=values.index, dtype=object)
+    if rule['rule'] == 'regex_replace':
+        return regex_replace(params['pattern'], params['repl'], params['count'])
+    if rule['rule'] == 'strip_prefix':
+        return strip_prefix(params['prefix'])
+    if rule['rule'] == 'date_shift':
+        return date_shift(params['days'], params['format'])
+    if rule['rule'] == 'pseudonym':
+        # One remapper per store, shared by the rules of the same update_tags
+        key = (uid_store_path(params['store']), params['secret'])
+        if key not in remappers:
+            remappers[key] = UIDRemapper(params['store'], secret=params['secret'])
+        return pseudonym(tag, remappers[key], params['prefix'], params['length'])
+    return format_values(params['format'])
+
+
+def compile_rules(update_tags: dict) -> dict:
+    """
+    Compiles the rules of update_tags.
+
+    Args:
+        update_tags (dict): The DICOM tags to be updated, with their rules. Rules which are already compiled are kept.
+
+    Returns:
+        dict: The DICOM tags with their constant or CompiledRule.
+
+    Raises:
+        ValueError: If a rule is invalid.
+    """
+    rules, remappers = {}, {}
+    for tag, rule in update_tags.items():
+        if isinstance(rule, CompiledRule):
+            rules[tag] = rule
+        elif isinstance(rule, (dict, list)):
+            steps = rule if isinstance(rule, list) else [rule]
+            rules[tag] = CompiledRule(tag, [compile_step(tag, step, remappers) for step in steps])
+        elif callable(rule):
+            # Fallback of arbitrary Python code, called once per distinct value
+            rules[tag] = CompiledRule(tag, [lambda values, frame, rule=rule: on_distinct(values, lambda uniques: [rule(value) for value in uniques])])
+        else:
+            rules[tag] = rule
+    return rules
+
+
+def default_values(frame: pd.DataFrame, rules: dict) -> dict:
+    """
+    Computes the default values of the cases.
+
+    Args:
+        frame (pd.DataFrame): The cases, with the original values of the DICOM tags.
+        rules (dict): The rules from compile_rules(), or the rules of update_tags.
+
+    Returns:
+        dict: The DICOM tags with the new value of each case (pd.Series), or the constant of every case.
+    """
+    return {tag: rule(frame) if isinstance(rule, CompiledRule) else rule for tag, rule in compile_rules(rules).items()}
+
@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+import os
+import re
+import tarfile
+import zipfile
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+import pydicom
+from pydicom.datadict import dictionary_VR
+from pydicom.dataelem import RawDataElement
+from pydicom.multival import MultiValue
+from pydicom.tag import Tag
+
+from anonymizer_utils.anonymize_dicom import scan_files
+from anonymizer_utils.archive_sink import MEMBER_SEPARATOR, split_location
+from anonymizer_utils.instrumentation import Metrics, timed
+from anonymizer_utils.worker import init_worker
+
+# The workers of verify_chunk() only match bytes, pandas is imported where the reports are built
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Value representations (VR) of which the values are checked
+TEXT_VRS = frozenset(('AE', 'AS', 'CS', 'DA', 'DS', 'DT', 'IS', 'LO', 'LT', 'PN', 'SH', 'ST', 'TM', 'UC', 'UR', 'UT'))
+
+# Value representations of which short values are checked as well, e.g. private tags of implicit VR files (UN)
+BINARY_VRS = frozenset(('OB', 'UN'))
+
+# Values above this size (bytes) are neither loaded nor checked, e.g. the pixel data
+DEFER_SIZE = 64 * 1024
+
+# Columns of the leak report
+REPORT_COLUMNS = ['output_dir', 'location', 'tag', 'VR', 'value', 'identifier', 'column', 'PK']
+
+
+def leak_report_path(folder: str, shard: Optional[tuple] = None) -> str:
+    """
+    Generates the path of the leak report, which is kept next to the "-Anonymized" output folder.
+
+    Args:
+        folder (str): The directory of folder with dicom files.
+        shard (tuple, optional): The (shard, number of shards) of a sharded run, which has a report per shard.
+
+    Returns:
+        str: The path of the leak report.
+    """
+    folder_dir = Path(folder)
+    if shard is not None:
+        return str(folder_dir.parent / f'{folder_dir.name}-Anonymized.shard-{shard[0]:03d}-of-{shard[1]:03d}.leaks.csv')
+    return str(folder_dir.parent / f'{folder_dir.name}-Anonymized.leaks.csv')
+
+
+def collect_identifiers(dcm_info: pd.DataFrame, columns: list, min_length: int = 3) -> pd.DataFrame:
+    """
+    Collects the original identifiers of every case from the dataframe of create_dcm_df(). Person names
+    are also split into their components (e.g. "Doe^John" gives "Doe" and "John").
+
+    Args:
+        dcm_info (pd.DataFrame): The dataframe from create_dcm_df(), indexed by PK.
+        columns (list): The columns of the identifiers, e.g. the unique_ids.
+        min_length (int): Shorter identifiers are left out, as they would match everywhere.
+
+    Returns:
+        pd.DataFrame: A dataframe with columns identifier (lower case), column and PK.
+    """
+    import pandas as pd
+    rows = []
+    for col in columns:
+        if col not in dcm_info:
+            continue
+        for pk, value in dcm_info[col].items():
+            if value is None or pd.isna(value):
+                continue
+            value = str(value).strip()
+            values = {value}
+            if col == 'PatientName' or '^' in value:
+                values.update(part.strip() for part in re.split(r'[\^=]', value))
+            rows.extend((v.lower(), col, pk) for v in values if len(v) >= min_length)
+    return pd.DataFrame(rows, columns=['identifier', 'column', 'PK']).drop_duplicates()
+
+
+def trie_pattern(words: list) -> str:
+    """
+    Builds a regular expression which matches any of the words, as a trie of their common prefixes, so that
+    the matching cost depends on the length of the words and not on their number.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node) -> str:
+        end = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else f'(?:{"|".join(branches)})'
+        return f'(?:{pattern})?' if end else pattern
+
+    return build(trie)
+
+
+def build_matcher(identifiers: list) -> Optional[re.Pattern]:
+    """
+    Compiles the identifiers into a single matcher of encoded values, so that the values of the elements are
+    matched without being decoded. Matches must not be surrounded by letters or digits, so that e.g. a numeric
+    PatientID does not match inside a UID.
+
+    Args:
+        identifiers (list): The identifiers, in lower case.
+
+    Returns:
+        re.Pattern or None: The matcher, to be applied to lower-case bytes, or None without identifiers.
+    """
+    # Identifiers are matched in UTF-8 and in Latin-1 (ISO_IR 100), the most common character sets
+    encoded = set()
+    for identifier in identifiers:
+        encoded.add(identifier.encode('utf-8'))
+        encoded.add(identifier.encode('latin-1', errors='ignore'))
+    words = sorted(word.decode('latin-1') for word in encoded if word)
+    if not words:
+        return None
+    pattern = rf'(?<![0-9a-z])(?:{trie_pattern(words)})(?![0-9a-z])'
+    return re.compile(pattern.encode('latin-1'))
+
+
+def element_vr(tag: int) -> str:
+    try:
+        return dictionary_VR(tag)
+    except KeyError:
+        return 'UN'
+
+
+def raw_values(ds: pydicom.Dataset, prefix: str = ''):
+    """
+    Yields the encoded values of every element of a dataset, including private tags and nested sequences.
+    The elements are not converted, only the sequences are parsed.
+
+    Args:
+        ds (pydicom.Dataset): The dataset, read with defer_size so that large values are not loaded.
+        prefix (str): The location of the dataset in its parent.
+
+    Yields:
+        tuple: The location (e.g. "(0008,1140)[0].(0008,1150)"), the tag, the VR and the value (bytes).
+    """
+    for tag in list(ds.keys()):
+        raw = ds.get_item(tag)
+        if isinstance(raw, RawDataElement):
+            if raw.value is None:
+                continue  # empty, or deferred (e.g. the pixel data)
+            vr = raw.VR or element_vr(tag)
+            if vr != 'SQ':
+                if vr in TEXT_VRS or (vr in BINARY_VRS and len(raw.value) <= DEFER_SIZE):
+                    yield f'{prefix}{Tag(tag)}', Tag(tag), vr, raw.value
+                continue
+
+        element = ds[tag]
+        location = f'{prefix}{element.tag}'
+        if element.VR == 'SQ':
+            for i, item in enumerate(element.value):
+                yield from raw_values(item, f'{location}[{i}].')
+        elif element.VR in TEXT_VRS and element.value is not None:
+            values = element.value if isinstance(element.value, (list, tuple, MultiValue)) else [element.value]
+            yield location, element.tag, element.VR, '\\'.join(str(value) for value in values).encode('utf-8')
+
+
+def decode_value(value: bytes) -> str:
+    """
+    Decodes a value in UTF-8, or in Latin-1 (ISO_IR 100) if it is not valid UTF-8, as matched by build_matcher().
+    """
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('latin-1')
+
+
+def scan_dataset(ds: pydicom.Dataset, matcher: re.Pattern) -> list:
+    """
+    Finds the identifiers in the values of a dataset.
+
+    Returns:
+        list: A list of (location, tag, VR, value, identifier) tuples, with the value and identifier decoded.
+    """
+    leaks = []
+    for location, tag, vr, value in raw_values(ds):
+        for match in matcher.finditer(value.lower()):
+            leaks.append((location, str(tag), vr, decode_value(value)[:200], decode_value(match.group())))
+    return leaks
+
+
+def read_outputs(locations: list):
+    """
+    Reads the members of the output archives. Output files are left to pydicom, which only reads their headers.
+
+    Yields:
+        tuple: The location and the path of a file, the content (bytes) of a member, or the exception if it cannot be read.
+    """
+    by_archive = defaultdict(list)
+    for location in locations:
+        archive, member = split_location(location)
+        by_archive[archive if member is not None else None].append((location, member))
+
+    for archive, members in by_archive.items():
+        try:
+            if archive is None:
+                for location, _ in members:
+                    yield location, location
+            elif zipfile.is_zipfile(archive):
+                with zipfile.ZipFile(archive) as zf:
+                    for location, member in members:
+                        try:
+                            yield location, zf.read(member)
+                        except KeyError as e:
+                            yield location, e
+            else:
+                # Members of a tar archive are read in a single pass, as compressed archives cannot seek
+                wanted = {member: location for location, member in members}
+                with tarfile.open(archive) as tf:
+                    for info in tf:
+                        if info.name in wanted:
+                            yield wanted.pop(info.name), tf.extractfile(info).read()
+                for location in wanted.values():
+                    yield location, KeyError(f'{location} is not in the archive')
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            for location, _ in members:
+                yield location, e
+
+
+def verify_chunk(locations: list, matcher: re.Pattern) -> tuple:
+    """
+    Checks a chunk of output files inside a worker process, reading their headers only.
+
+    Args:
+        locations (list): The output files, or "<archive>::<member>" locations.
+        matcher (re.Pattern): The matcher from build_matcher().
+
+    Returns:
+        tuple: A list of (output_dir, location, tag, VR, value, identifier) leaks, a list of (output_dir, error)
+        of the files which cannot be read, and the Metrics.to_dict() of the chunk.
+    """
+    metrics = Metrics()
+    leaks, errors = [], []
+    for output_dir, source in read_outputs(locations):
+        if isinstance(source, Exception):
+            errors.append((output_dir, f'{type(source).__name__}: {source}'))
+            continue
+        try:
+            with timed(metrics, 'verify_read'):
+                ds = pydicom.dcmread(source if isinstance(source, str) else BytesIO(source), defer_size=DEFER_SIZE)
+            with timed(metrics, 'verify_match'):
+                leaks.extend((output_dir, *leak) for leak in scan_dataset(ds, matcher))
+            metrics.count('files_verified')
+        except Exception as e:
+            errors.append((output_dir, f'{type(e).__name__}: {e}'))
+    return leaks, errors, metrics.to_dict()
+
+
+def list_outputs(output: str, fformat: str = 'dcm') -> list:
+    """
+    Lists the output files of a folder, or the members of an archive.
+
+    Args:
+        output (str): The "-Anonymized" folder, or a zip or tar archive.
+        fformat (str): The file format of the targeted files.
+
+    Returns:
+        list: The output files, or "<archive>::<member>" locations.
+    """
+    if Path(output).is_dir():
+        return sorted(entry.path for entry in scan_files(output, fformat))
+    if zipfile.is_zipfile(output):
+        with zipfile.ZipFile(output) as zf:
+            names = zf.namelist()
+    else:
+        with tarfile.open(output) as tf:
+            names = tf.getnames()
+    return [f'{output}{MEMBER_SEPARATOR}{name}' for name in names if name.endswith(f'.{fformat}')]
+
+
+def verify_outputs(locations: list,
+                   identifiers: pd.DataFrame,
+                   max_workers: Optional[int] = None,
+                   chunk_size: int = 64,
+                   progress_callback: Optional[Callable[[int, int], None]] = None,
+                   metrics: Optional[Metrics] = None) -> tuple:
+    """
+    Checks that the anonymized files contain none of the original identifiers, in any text element,
+    including private tags, nested sequences and VRs which are not anonymized. The headers are read in
+    parallel by worker processes and matched with a single precompiled matcher.
+
+    Args:
+        locations (list): The output files, or "<archive>::<member>" locations (e.g. the output_dir of the results).
+        identifiers (pd.DataFrame): The identifiers from collect_identifiers().
+        max_workers (int, optional): The number of worker processes. If None, all CPU cores are used.
+            With a single worker, the files are checked in the current process.
+        chunk_size (int): The number of files checked by a worker at once.
+        progress_callback (callable, optional): Called as progress_callback(done, total) after each chunk.
+        metrics (Metrics, optional): Collects the time of reading and matching.
+
+    Returns:
+        tuple: The leak report, a dataframe with columns REPORT_COLUMNS, and a dataframe of the files which
+        cannot be read, with columns output_dir and error.
+    """
+    import pandas as pd
+    matcher = build_matcher(identifiers['identifier'].tolist())
+    errors_df = pd.DataFrame(columns=['output_dir', 'error'])
+    if matcher is None or not locations:
+        return pd.DataFrame(columns=REPORT_COLUMNS), errors_df
+
+    groups = defaultdict(list)
+    for location in sorted(locations, key=split_location):
+        archive, member = split_location(location)
+        groups[archive if member is not None else None].append(location)
+    chunks = []
+    for archive, group in groups.items():
+        # The members of a tar archive are checked by a single worker, in a single pass
+        size = len(group) if archive is not None and not zipfile.is_zipfile(archive) else chunk_size
+        chunks.extend(group[i:i + size] for i in range(0, len(group), size))
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    workers = max(1, min(max_workers, len(chunks)))
+
+    leaks, errors, done = [], [], 0
+
+    def collect(chunk_leaks, chunk_errors, chunk_metrics, n_files):
+        nonlocal done
+        leaks.extend(chunk_leaks)
+        errors.extend(chunk_errors)
+        if metrics is not None:
+            metrics.merge(chunk_metrics)
+        done += n_files
+        if progress_callback is not None:
+            progress_callback(done, len(locations))
+
+    with timed(metrics, 'verify_wall'):
+        if workers == 1:
+            for chunk in chunks:
+                collect(*verify_chunk(chunk, matcher), len(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+                pending = {executor.submit(verify_chunk, chunk, matcher): chunk for chunk in chunks}
+                while pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        chunk = pending.pop(future)
+                        try:
+                            collect(*future.result(), len(chunk))
+                        except Exception as e:
+                            collect([], [(location, f'{type(e).__name__}: {e}') for location in chunk], {}, len(chunk))
+
+    report = pd.DataFrame(leaks, columns=['output_dir', 'location', 'tag', 'VR', 'value', 'identifier'])
+    report = report.merge(identifiers, on='identifier', how='left')[REPORT_COLUMNS]
+    if metrics is not None:
+        metrics.count('leaks', len(report))
+    return report, pd.DataFrame(errors, columns=['output_dir', 'error'])
@@ -0,0 +1,105 @@
+import time
+from typing import Optional
+
+from anonymizer_utils.anonymize_dicom import walk_folder
+from anonymizer_utils.instrumentation import Metrics
+from anonymizer_utils.scan_cache import folder_fingerprints
+
+
+class FolderWatcher:
+    """
+    Detects the subfolders of a drop folder which are new or changed and completely copied, by polling.
+
+    A subfolder is ready when its fingerprint (paths, sizes and mtimes of its files) has not changed for
+    settle_seconds, so that series which are still being copied are left for a later poll. Polling only
+    stats the files, the headers are read for the ready subfolders only.
+    """
+
+    def __init__(self, folder: str, fformat: str, settle_seconds: float = 30.0):
+        """
+        Args:
+            folder (str): The directory of the drop folder.
+            fformat (str): The file format of the targeted files.
+            settle_seconds (float): The time a subfolder must stay unchanged before it is ready.
+        """
+        self.folder = folder
+        self.fformat = fformat
+        self.settle_seconds = settle_seconds
+        self.seen = {}          # folder_dir: (fingerprint, time it was first seen with this fingerprint)
+        self.processed = {}     # folder_dir: fingerprint when it was processed
+        self.failures = {}      # folder_dir: (fingerprint, number of failed attempts with this fingerprint)
+
+    def poll(self, metrics: Optional[Metrics] = None) -> tuple:
+        """
+        Walks the drop folder once.
+
+        Args:
+            metrics (Metrics, optional): Collects the time of the walk and the number of files.
+
+        Returns:
+            tuple: The walk_folder() rows of the ready subfolders, and the number of subfolders which are
+            changed but not settled yet.
+        """
+        walk = walk_folder(self.folder, self.fformat, metrics)
+        fingerprints = folder_fingerprints(walk)
+        now = time.monotonic()
+
+        ready, settling = [], 0
+        for folder_dir, fingerprint in fingerprints.items():
+            if self.processed.get(folder_dir) == fingerprint:
+                continue
+            seen = self.seen.get(folder_dir)
+            if seen is None or seen[0] != fingerprint:
+                self.seen[folder_dir] = (fingerprint, now)
+                seen = self.seen[folder_dir]
+            if now - seen[1] >= self.settle_seconds:
+                ready.append(folder_dir)
+            else:
+                settling += 1
+
+        # Forget the subfolders which were removed
+        for folder_dir in set(self.seen) - set(fingerprints):
+            del self.seen[folder_dir]
+            self.processed.pop(folder_dir, None)
+            self.failures.pop(folder_dir, None)
+
+        return walk[walk['folder_dir'].isin(ready)].reset_index(drop=True), settling
+
+    def mark_processed(self, folder_dirs: list):
+        """
+        Marks subfolders as processed, so that they are only ready again once they change.
+        """
+        for folder_dir in folder_dirs:
+            if folder_dir in self.seen:
+                self.processed[folder_dir] = self.seen[folder_dir][0]
+                self.failures.pop(folder_dir, None)
+
+    def mark_failed(self, folder_dirs: list, max_attempts: int) -> list:
+        """
+        Counts a failed attempt of subfolders, which stay ready to be retried at the next poll. A subfolder which
+        failed max_attempts times without changing is marked as processed, so that it is only ready again once it
+        changes.
+
+        Returns:
+            list: The subfolders which reached max_attempts at this attempt.
+        """
+        given_up = []
+        for folder_dir in folder_dirs:
+            if folder_dir not in self.seen:
+                continue
+            fingerprint = self.seen[folder_dir][0]
+            previous, attempts = self.failures.get(folder_dir, (None, 0))
+            attempts = attempts + 1 if previous == fingerprint else 1
+            self.failures[folder_dir] = (fingerprint, attempts)
+            if attempts >= max_attempts:
+                given_up.append(folder_dir)
+        for folder_dir in given_up:
+            self.processed[folder_dir] = self.seen[folder_dir][0]
+        return given_up
+
+    def forget(self, folder_dirs: list):
+        """
+        Makes processed subfolders ready again, e.g. when the mapping sheet changed.
+        """
+        for folder_dir in folder_dirs:
+            self.processed.pop(folder_dir, None)
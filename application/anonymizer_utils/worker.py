@@ -0,0 +1,138 @@
+"""
+Entry points of the worker processes. Workers started with "spawn" (Windows, macOS, the executable) import
+the module of the function they run, so this module only imports what anonymize() needs: pydicom and the
+anonymization rules, but not pandas or streamlit.
+"""
+import hashlib
+import os
+from typing import Optional
+
+from anonymizer_utils.anonymization_profile import AnonymizationProfile
+from anonymizer_utils.anonymize_dicom import anonymize, anonymize_bytes
+from anonymizer_utils.instrumentation import Metrics
+from anonymizer_utils.uid_remap import flush_remappers
+
+
+def init_worker():
+    """
+    Warms up a worker process by loading the pydicom modules and data dictionary used by anonymize().
+    """
+    import pydicom.filewriter
+    from pydicom.datadict import dictionary_keyword
+
+    dictionary_keyword(0x00100010)
+
+
+def empty_result() -> dict:
+    return {'size': None, 'mtime_ns': None, 'digest': None, 'error': None}
+
+
+def error_message(e: Exception) -> str:
+    return f'{type(e).__name__}: {e}'
+
+
+def file_digest(file_dir: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Computes the BLAKE2b hash of a file.
+
+    Args:
+        file_dir (str): The file path.
+        block_size (int): The number of bytes read at once.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_dir, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def anonymize_chunk(chunk: list, hash_inputs: bool = False,
+                    profiling: Optional[str] = None, profile_dir: Optional[str] = None) -> tuple:
+    """
+    Anonymizes a chunk of files inside a worker process.
+
+    Args:
+        chunk (list): A list of (index, job) tuples, where job is a dictionary of keyword arguments of anonymize().
+        hash_inputs (bool): Whether to compute the hash of each input file.
+        profiling (str, optional): The profiling mode of Metrics ('cprofile' or 'tracemalloc').
+        profile_dir (str, optional): The folder to dump the cProfile stats into.
+
+    Returns:
+        tuple: A list of (index, result) tuples and the Metrics.to_dict() of the chunk. result is a dictionary with
+        the size, mtime_ns and digest of the input file and the error, which is None when the file is anonymized successfully.
+    """
+    metrics = Metrics(profiling=profiling, profile_dir=profile_dir)
+    results = []
+    with metrics.capture('worker'):
+        for idx, job in chunk:
+            result = empty_result()
+            try:
+                stat = os.stat(job['file_dir'])
+                result['size'], result['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+                anonymize(**job, metrics=metrics)
+                if hash_inputs:
+                    with metrics.stage('hash'):
+                        result['digest'] = file_digest(job['file_dir'])
+            except Exception as e:
+                result['error'] = error_message(e)
+                metrics.count('errors')
+            results.append((idx, result))
+        flush_remappers()
+    return results, metrics.to_dict()
+
+
+def transform_chunk(items: list, hash_inputs: bool = False,
+                    profiling: Optional[str] = None, profile_dir: Optional[str] = None) -> tuple:
+    """
+    Transform stage of anonymize_pipelined(), inside a worker process: anonymizes the files of a chunk from bytes
+    to bytes. Streaming jobs are anonymized from disk to disk by anonymize().
+
+    Args:
+        items (list): The items from read_chunk().
+        hash_inputs (bool): Whether to compute the hash of each input file.
+        profiling (str, optional): The profiling mode of Metrics ('cprofile' or 'tracemalloc').
+        profile_dir (str, optional): The folder to dump the cProfile stats into.
+
+    Returns:
+        tuple: A list of (index, job, result, output) tuples, where output is None when nothing is left to write,
+        and the Metrics.to_dict() of the stage.
+    """
+    metrics = Metrics(profiling=profiling, profile_dir=profile_dir)
+    outputs = []
+    with metrics.capture('worker'):
+        for idx, job, result, data in items:
+            output = None
+            if result['error'] is None:
+                try:
+                    if job.get('streaming'):
+                        anonymize(**job, metrics=metrics)
+                        if hash_inputs:
+                            with metrics.stage('hash'):
+                                result['digest'] = file_digest(job['file_dir'])
+                    else:
+                        output = anonymize_bytes(data, update=job.get('update'), profile=job.get('profile'), metrics=metrics)
+                        if hash_inputs:
+                            with metrics.stage('hash'):
+                                result['digest'] = hashlib.blake2b(data, digest_size=20).hexdigest()
+                except Exception as e:
+                    result['error'] = error_message(e)
+                    metrics.count('errors')
+            outputs.append((idx, job, result, output))
+        flush_remappers()
+    return outputs, metrics.to_dict()
+
+
+def anonymize_received(data: bytes, update: dict, profile: AnonymizationProfile) -> tuple:
+    """
+    Anonymizes a dataset received by the StoreReceiver inside a worker process.
+
+    Returns:
+        tuple: The anonymized file and the Metrics.to_dict() of the worker.
+    """
+    metrics = Metrics()
+    output = anonymize_bytes(data, update=update, profile=profile, metrics=metrics)
+    flush_remappers()
+    return output, metrics.to_dict()
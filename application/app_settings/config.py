@@ -1,4 +1,3 @@
-import re
 # Inititalize pre-defined values
 # DICOM tags: used as Unique identifiers (list)
 unique_ids = [
@@ -15,13 +14,17 @@ ref_tags = [
     'StudyDate', 
 ]
 
-# DICOM tags: to be Anonymized default values or user's inputs (dict)
+# DICOM tags: to be Anonymized default values or user's inputs (dict: 'TagName': constant, rule, list of rules or callable)
+# >> Rules: {'rule': 'regex_replace', 'pattern': r'^PXH', 'repl': ''}, {'rule': 'strip_prefix', 'prefix': 'PXH'},
+# >>        {'rule': 'constant', 'value': 'ANON'}, {'rule': 'date_shift', 'days': -30}, {'rule': 'pseudonym', 'prefix': 'PAT'},
+# >>        {'rule': 'format', 'format': 'CASE{index:05d}'} (fields: value, index, or a column of the template)
+# >> Rules are applied to whole columns at once, a callable (e.g. lambda x: x[3:]) is only a slower fallback
 update_tags = {
-    'PatientName':      '',                                     # for user's inputs
-    'PatientID':        '',                                     # for user's inputs
-    'InstitutionName':  '',                                     # for user's inputs
-    'PatientBirthDate': '19700101',                             # reset patient's birth date to 0
-    'AccessionNumber':  lambda x: re.sub(r'^[a-zA-Z]+', '', x)  # remove the first 3 characters        
+    'PatientName':      '',                                                              # for user's inputs
+    'PatientID':        '',                                                              # for user's inputs
+    'InstitutionName':  '',                                                              # for user's inputs
+    'PatientBirthDate': '19700101',                                                      # reset patient's birth date to 0
+    'AccessionNumber':  {'rule': 'regex_replace', 'pattern': r'^[a-zA-Z]+', 'repl': ''}, # remove the leading letters
 }
 
 # DICOM tag: used as identifier in user-uploaded file (str)
@@ -38,3 +41,81 @@ tags_2_spare = []
 new_tags = {
     'BodyPartExamined': ('Head', 'Thorax', 'Chest'),
 }
+
+# Pixel masking: regions of the pixels blanked in every frame, e.g. burned-in patient names, for the files of which the header matches (list of dict)
+# >> Example: pixel_masks = [{'Modality': 'US', 'Manufacturer': ['ACME', 'ACME Medical'], 'Rows': 600, 'Columns': 800, 'regions': [(0, 0, 800, 60)]}]
+# >> Each region is (x, y, width, height) in pixels from the top left corner, the other keys are DICOM tags which must match (any value if omitted)
+pixel_masks = []
+
+# UID remapping: DICOM tags of which the UIDs are replaced by new UIDs, the same in every run (None-disabled, True-DEFAULT_UID_TAGS of uid_remap.py or list)
+# >> Example: remap_uids = ['StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'FrameOfReferenceUID', 'ReferencedSOPInstanceUID']
+remap_uids = None
+
+# UID remapping: root of the new UIDs, ending with a dot (None-pydicom root or str)
+uid_prefix = None
+
+# Pseudonyms: DICOM tags of update_tags of which the default value is a pseudonym of the original value, the same in every run (dict: 'TagName': 'prefix')
+# >> Example: pseudonym_tags = {'PatientID': 'PAT', 'AccessionNumber': 'ACC'}
+pseudonym_tags = {}
+
+# UID remapping and pseudonyms: remapping table, keep it to link later exports (None-"~/.dicom_anonymizer/uid_map.sqlite" or str)
+uid_store = None
+
+# UID remapping and pseudonyms: secret of a new remapping table, e.g. to get the same values on several machines (None-random or str)
+uid_secret = None
+
+# Parallel anonymization: number of worker processes (None-all CPU cores or int)
+max_workers = None
+
+# Parallel anonymization: number of files submitted to a worker at once (int)
+chunk_size = 16
+
+# Parallel anonymization: number of threads reading input files, and of threads writing output files, which overlap with the worker processes (int)
+io_threads = 4
+
+# Archive output: write the anonymized files into sharded archives "[folder]-Anonymized-000.zip" instead of a folder (None-folder, 'zip' or 'tar')
+output_archive = None
+
+# Archive output: size limit of each archive (MB, uncompressed) (int)
+archive_shard_mb = 2048
+
+# Archive output: compress the archives (deflate for zip, gzip for tar) (bool)
+archive_compress = True
+
+# Fetching files: number of threads reading file headers (None-min(32, 4 x CPU cores) or int)
+scan_workers = None
+
+# Run journal: compute the hash of every input file for the record (bool)
+journal_hash = True
+
+# Streaming mode: files of at least this size (bytes) are anonymized without loading the pixel data in memory (None-disabled or int)
+streaming_threshold = 64 * 1024 ** 2
+
+# Output encoding: re-encode the anonymized files in the worker processes, to write less data, e.g. to a share or over a slow link (None-transfer syntax of the input files, 'deflated', 'rle', 'jpegls' or 'jpeg2000')
+# >> 'deflated' (zlib) and 'rle' need no codec (rle is faster with pylibjpeg-rle), 'jpegls' requires pyjpegls and 'jpeg2000' requires pylibjpeg-openjpeg. All of them are lossless.
+# >> Files to be re-encoded are loaded in memory, whatever streaming_threshold; files with compressed pixel data are kept in their transfer syntax and still streamed.
+output_transfer_syntax = None
+
+# Verification: check after every run that the anonymized files contain none of the original unique_ids, in any text element (bool)
+verify_output = True
+
+# Duplicates: files with the same SOPInstanceUID and content (e.g. exported twice) are anonymized once, and their copies are not written ('skip') or hard-linked to the anonymized file ('link') (None-disabled, 'skip' or 'link')
+duplicate_mode = None
+
+# Instrumentation: capture a profile of every run (None, 'cprofile' or 'tracemalloc'), overridden by the environment variable DICOMANON_PROFILE
+profiling = None
+
+# Scan cache: reuse the results of fetching files across sessions, only rescanning changed subfolders (bool)
+scan_cache = True
+
+# Scan cache: folder of the cache (None-"~/.dicom_anonymizer/scan_cache" or str)
+scan_cache_dir = None
+
+# Scan cache: size limit (MB), the least recently used scans are removed (int)
+scan_cache_max_mb = 512
+
+# Large folders: number of cases shown per page of the table, larger templates are only converted to CSV when requested (int)
+page_size = 1000
+
+# Run planning: number of files anonymized to predict the time, output size and memory of a run, at least one per subfolder and file size class (int)
+plan_sample_files = 32
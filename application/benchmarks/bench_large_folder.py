@@ -0,0 +1,82 @@
+"""
+Benchmark of the memory of the scan results and of the work of a rerun of the user interface on large folders.
+
+Builds synthetic manifests (a row per file, as from create_manifest()) of increasing size, and reports the
+memory of the manifest with object columns and with compact_manifest(), and the time of the work done on every
+rerun of the page: copying the template, applying the mapping sheet and selecting the page of cases shown.
+
+Usage (from the application folder):
+    python -m benchmarks.bench_large_folder --instances 10000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from anonymizer_utils.anonymize_dicom import compact_manifest
+from app_settings.config import page_size, update_tags
+from ui_utils.ui_logic import create_update_cols, page_of, update_data_editor
+
+
+def create_manifest(instances: int, slices: int, series: int) -> pd.DataFrame:
+    """
+    Creates a manifest with object columns, of patients with several series of several slices.
+    """
+    idx = np.arange(instances)
+    series_idx, slice_idx = idx // slices, idx % slices
+    patient_idx = series_idx // series
+    folder_dir = [f'D:/dicom/export/PAT{p:07d}/SERIES{s:07d}' for p, s in zip(patient_idx, series_idx)]
+    return pd.DataFrame({
+        'folder_dir': folder_dir,
+        'file_dir': [f'{folder}/IMG{i:05d}.dcm' for folder, i in zip(folder_dir, slice_idx)],
+        'size': np.full(instances, 526 * 1024),
+        'mtime_ns': np.full(instances, 1_700_000_000_000_000_000),
+        'StudyInstanceUID': [f'1.2.826.0.1.3680043.8.498.1.{p}' for p in patient_idx],
+        'SeriesInstanceUID': [f'1.2.826.0.1.3680043.8.498.2.{s}' for s in series_idx],
+        'SOPInstanceUID': [f'1.2.826.0.1.3680043.8.498.3.{i}' for i in idx],
+    })
+
+
+def rerun_seconds(cases: int, repeat: int = 5) -> float:
+    """
+    Times the work of a rerun of the page on a template of cases, with a mapping sheet uploaded.
+    """
+    uids = pd.DataFrame({
+        'PatientName': [f'Doe^John{i}' for i in range(cases)],
+        'PatientID': [f'ID{i:07d}' for i in range(cases)],
+        'AccessionNumber': [f'ACC{i:08d}' for i in range(cases)],
+    })
+    template = create_update_cols(uids, {tag: '' for tag in update_tags})
+    upload_df = template.copy()
+    for tag in update_tags:
+        upload_df[f'Update_{tag}'] = [f'{tag}{i}' for i in range(cases)]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        edit_df = update_data_editor(template.copy(), upload_df, update_tags)
+        page_of(edit_df, 1, page_size)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', type=int, nargs='+', default=[10000, 100000, 1000000], help='files of each manifest')
+    parser.add_argument('--slices', type=int, default=200, help='files per series')
+    parser.add_argument('--series', type=int, default=2, help='series per patient')
+    args = parser.parse_args()
+
+    print(f"{'instances':>10}{'cases':>8}{'object MB':>12}{'compact MB':>12}{'compact s':>11}{'rerun ms':>10}")
+    for instances in args.instances:
+        manifest = create_manifest(instances, args.slices, args.series)
+        before = manifest.memory_usage(deep=True).sum() / 1024 ** 2
+        start = time.perf_counter()
+        compact = compact_manifest(manifest)
+        seconds = time.perf_counter() - start
+        after = compact.memory_usage(deep=True).sum() / 1024 ** 2
+        cases = -(-instances // (args.slices * args.series))
+        print(f'{instances:>10}{cases:>8}{before:>12.1f}{after:>12.1f}{seconds:>11.2f}{rerun_seconds(cases) * 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
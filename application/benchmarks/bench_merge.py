@@ -0,0 +1,106 @@
+"""
+Regression benchmark of the upload merge (update_data_editor, check_unmatched_rows and check_empty_cols).
+
+Compares the indexed-join implementation with the previous row-by-row implementation on a synthetic mapping,
+asserts that both give identical results and reports the time of each. The equivalence on edge cases (duplicated,
+missing and unmatched keys) is tested by tests/test_ui_logic.py.
+
+Usage (from the application folder):
+    python -m benchmarks.bench_merge --rows 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app_settings.config import update_tags, upload_df_id
+from ui_utils.ui_logic import check_empty_cols, check_unmatched_rows, update_data_editor
+
+
+def legacy_update_data_editor(edit_df: pd.DataFrame, upload_df: pd.DataFrame, update_tags: dict) -> pd.DataFrame:
+    """
+    The row-by-row update_data_editor() before the indexed join, kept as baseline.
+    """
+    for _, row_udf in upload_df.iterrows():
+        matching_row = edit_df[(edit_df['PatientID'] == row_udf['PatientID'])]
+        if not matching_row.empty:
+            idx = matching_row.index[0]
+            for tag, _ in update_tags.items():
+                col = f'Update_{tag}'
+                edit_df.at[idx, col] = row_udf[col]
+    return edit_df
+
+
+def legacy_check_unmatched_rows(upload_df: pd.DataFrame, edit_df: pd.DataFrame, upload_df_id: str) -> list:
+    unmatched_patient_ids = edit_df[~edit_df[f'{upload_df_id}'].isin(upload_df[f'{upload_df_id}']) &
+                                    ~edit_df[f'{upload_df_id}'].isin(upload_df[f'Update_{upload_df_id}'])]
+    return unmatched_patient_ids[f'{upload_df_id}'].unique().tolist()
+
+
+def legacy_check_empty_cols(edit_df: pd.DataFrame, update_tags: dict) -> list:
+    empty_col = []
+    for tag, _ in update_tags.items():
+        if edit_df[f'Update_{tag}'].isnull().any() or (edit_df[f'Update_{tag}'] == '').any():
+            empty_col.append(f'Update_{tag}')
+    return empty_col
+
+
+def create_mapping(rows: int, seed: int = 0) -> tuple:
+    """
+    Creates a data editor and an uploaded mapping sheet with duplicated, conflicting, missing and unmatched keys.
+
+    Returns:
+        tuple: The edit_df and the upload_df.
+    """
+    rng = np.random.default_rng(seed)
+    # About 5% of the patients have several studies (duplicated PatientID in edit_df)
+    patient_ids = rng.integers(0, int(rows * 0.95), size=rows)
+    edit_df = pd.DataFrame({
+        'PatientName': [f'Name{i}' for i in patient_ids],
+        'PatientID': [f'ID{i:07d}' for i in patient_ids],
+        'AccessionNumber': [f'ACC{i:08d}' for i in range(rows)],
+    }, index=[f'PK{i}' for i in range(rows)])
+    for tag in update_tags:
+        edit_df[f'Update_{tag}'] = ''
+
+    # The mapping misses 1% of the rows, has 2% duplicated rows with conflicting values and is shuffled
+    upload_df = edit_df.sample(frac=0.99, random_state=seed).reset_index(drop=True)
+    upload_df = pd.concat([upload_df, upload_df.sample(frac=0.02, random_state=seed + 1)], ignore_index=True)
+    for tag in update_tags:
+        upload_df[f'Update_{tag}'] = [f'{tag}{i}' for i in range(len(upload_df))]
+    upload_df = upload_df.sample(frac=1.0, random_state=seed + 2).reset_index(drop=True)
+    return edit_df, upload_df.fillna('').astype(str)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='number of rows of the data editor and mapping')
+    args = parser.parse_args()
+
+    edit_df, upload_df = create_mapping(args.rows)
+
+    start = time.perf_counter()
+    expected = legacy_update_data_editor(edit_df.copy(), upload_df, update_tags)
+    expected_unmatched = legacy_check_unmatched_rows(upload_df, expected, upload_df_id)
+    expected_empty = legacy_check_empty_cols(expected, update_tags)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = update_data_editor(edit_df.copy(), upload_df, update_tags)
+    unmatched = check_unmatched_rows(upload_df, result, upload_df_id)
+    empty = check_empty_cols(result, update_tags)
+    after = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert unmatched == expected_unmatched, 'check_unmatched_rows() differs'
+    assert empty == expected_empty, 'check_empty_cols() differs'
+
+    print(f'rows: {args.rows}, identical results: yes')
+    print(f'before: {before:.2f} s')
+    print(f'after:  {after:.3f} s')
+    print(f'speed-up: {before / after:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Microbenchmark of the per-dataset cost of the tag rules in anonymize().
+
+Compares the previous per-element rule evaluation with the compiled AnonymizationProfile on a
+header-heavy dataset, e.g. an enhanced multi-frame MR with thousands of nested sequence items.
+
+Usage (from the application folder):
+    python -m benchmarks.bench_profile --frames 2000 --repeat 5
+"""
+import argparse
+import copy
+import time
+from functools import partial
+
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+from pydicom.tag import Tag
+
+from anonymizer_utils.anonymization_profile import DEFAULT_TAGS, build_profile
+from anonymizer_utils.anonymize_dicom import remove_info
+
+
+def create_multiframe_header(frames: int) -> Dataset:
+    """
+    Creates an enhanced multi-frame MR like header with nested per-frame functional groups.
+
+    Args:
+        frames (int): The number of items in PerFrameFunctionalGroupsSequence.
+
+    Returns:
+        Dataset: The header-only dataset.
+    """
+    ds = Dataset()
+    ds.PatientName = 'Doe^John'
+    ds.PatientID = 'ID0001'
+    ds.AccessionNumber = 'PXH12345'
+    ds.PatientBirthDate = '19800101'
+    ds.InstitutionName = 'Hospital'
+    ds.StudyDate = '20240101'
+    ds.NumberOfFrames = frames
+
+    items = []
+    for i in range(frames):
+        frame_content = Dataset()
+        frame_content.FrameAcquisitionDateTime = '20240101120000'
+        frame_content.StackID = '1'
+        frame_content.InStackPositionNumber = i + 1
+        plane_position = Dataset()
+        plane_position.ImagePositionPatient = [0.0, 0.0, float(i)]
+        mr_echo = Dataset()
+        mr_echo.EffectiveEchoTime = 4.5
+        item = Dataset()
+        item.FrameContentSequence = Sequence([frame_content])
+        item.PlanePositionSequence = Sequence([plane_position])
+        item.MREchoSequence = Sequence([mr_echo])
+        items.append(item)
+    ds.PerFrameFunctionalGroupsSequence = Sequence(items)
+    return ds
+
+
+def legacy_remove_info(dataset, data_element, va_type, tags, update, tags_2_spare):
+    """
+    The per-element rule evaluation of remove_info() before the compiled profile, kept as baseline.
+    """
+    va_type = ["PN", "LO", "SH", "AE", "DT", "DA"]
+    if data_element.tag in tags_2_spare:
+        return
+    if data_element.VR.strip() in [v.strip() for v in va_type]:
+        try:
+            data_element.value = "Anonymized"
+        except:
+            data_element.value = ""
+    if data_element.tag in tags:
+        data_element.value = ""
+    if not update is None:
+        keylist = list(update.keys())
+        if data_element.tag in list(update.keys()):
+            data_element.value = update[data_element.tag]
+
+
+def time_walk(ds: Dataset, callback, repeat: int) -> float:
+    """
+    Returns the best wall time (in seconds) of walking a fresh copy of ds with callback.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        f = copy.deepcopy(ds)
+        start = time.perf_counter()
+        f.walk(callback)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=2000, help='number of per-frame functional group items')
+    parser.add_argument('--repeat', type=int, default=5, help='number of repetitions (best time is reported)')
+    args = parser.parse_args()
+
+    ds = create_multiframe_header(args.frames)
+    update = {Tag('PatientName'): 'Case001', Tag('PatientID'): 'Case001'}
+    tags = list(DEFAULT_TAGS)
+
+    before = time_walk(
+        ds, lambda x1, x2: legacy_remove_info(x1, x2, tags=tags, va_type=[], update=update, tags_2_spare=[]), args.repeat
+    )
+    profile = build_profile(tags=tags)
+    after = time_walk(ds, partial(remove_info, profile=profile, update=update), args.repeat)
+
+    print(f'frames: {args.frames}')
+    print(f'before: {before * 1000:.1f} ms per dataset')
+    print(f'after:  {after * 1000:.1f} ms per dataset')
+    print(f'speed-up: {before / after:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Startup benchmark of the user interface and of the worker processes, with a time budget.
+
+Runs each target in a fresh interpreter with "python -X importtime", reports the median import time and
+the heaviest modules, and fails (exit code 1) when a target exceeds its budget or imports a module it must
+not load: the page is drawn before pandas and pydicom are imported, and the workers never import pandas
+or streamlit.
+
+Usage (from the application folder):
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --ui-budget 1.5 --worker-budget 1.0 --repeat 10
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Runs the page of DicomAnonymizer.py without a streamlit server, up to the tips, which are drawn before
+# the anonymization modules are imported
+UI_STATEMENT = '''
+import streamlit as st
+import DicomAnonymizer
+
+class PageDrawn(Exception):
+    pass
+
+def markdown(*args, **kwargs):
+    raise PageDrawn
+
+st.markdown = markdown
+try:
+    DicomAnonymizer.streamlit_app()
+except PageDrawn:
+    pass
+else:
+    raise RuntimeError('The tips of the page were not drawn.')
+'''
+
+# name: (statement run by the interpreter, modules which must not be imported)
+TARGETS = {
+    # The imports of the page until its first elements are drawn
+    'ui': (UI_STATEMENT, ('pandas', 'pydicom')),
+    # Cold start of a worker process: the module of the chunk functions and init_worker()
+    'worker': ('from anonymizer_utils.worker import init_worker; init_worker()', ('pandas', 'streamlit')),
+}
+
+
+def parse_importtime(stderr: str) -> list:
+    """
+    Parses the output of "python -X importtime".
+
+    Args:
+        stderr (str): The standard error of the interpreter.
+
+    Returns:
+        list: A (depth, module, cumulative seconds) tuple per import, where depth 0 are the top-level imports.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Nested imports are indented by two spaces per level
+        imports.append(((len(name) - len(name.lstrip()) - 1) // 2, name.strip(), int(cumulative) / 1e6))
+    return imports
+
+
+def measure(statement: str) -> tuple:
+    """
+    Runs a statement in a fresh interpreter.
+
+    Returns:
+        tuple: The wall time (seconds) of the interpreter, and the imports from parse_importtime().
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f'"{statement}" failed:\n{process.stderr[-2000:]}')
+    return seconds, parse_importtime(process.stderr)
+
+
+def imported_modules(statement: str) -> set:
+    """
+    Lists every module (including nested imports) loaded by a statement in a fresh interpreter.
+    """
+    process = subprocess.run(
+        [sys.executable, '-c', f'{statement}\nimport sys\nprint("\\n".join(sys.modules))'],
+        capture_output=True, text=True, check=True
+    )
+    return set(process.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ui-budget', type=float, default=1.5, help='seconds of imports before the page is drawn')
+    parser.add_argument('--worker-budget', type=float, default=1.0, help='seconds of imports of a worker cold start')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each target, the median is reported')
+    parser.add_argument('--top', type=int, default=5, help='number of heaviest modules listed')
+    args = parser.parse_args()
+    budgets = {'ui': args.ui_budget, 'worker': args.worker_budget}
+
+    failed = False
+    for name, (statement, forbidden) in TARGETS.items():
+        # The first run warms up the bytecode cache
+        measure(statement)
+        runs = [measure(statement) for _ in range(args.repeat)]
+        wall = statistics.median(seconds for seconds, _ in runs)
+        imports = statistics.median(sum(seconds for depth, _, seconds in modules if depth == 0) for _, modules in runs)
+        # The modules imported by the target itself
+        heaviest = sorted(((module, seconds) for depth, module, seconds in runs[-1][1] if depth == 1),
+                          key=lambda item: item[1], reverse=True)[:args.top]
+        loaded = sorted(imported_modules(statement) & set(forbidden))
+
+        within_budget = imports <= budgets[name]
+        failed |= not within_budget or bool(loaded)
+        print(f'{name}: imports {imports:.3f} s (budget {budgets[name]:.3f} s), interpreter {wall:.3f} s '
+              f'-> {"ok" if within_budget else "OVER BUDGET"}')
+        print('  heaviest: ' + ', '.join(f'{module} {seconds:.3f} s' for module, seconds in heaviest))
+        if loaded:
+            print(f'  imports {", ".join(loaded)}, which must not be loaded')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the default values of the template, computed by the compiled rules of update_tags and row by row.
+
+Builds synthetic cases (as from create_dcm_df()) and times each kind of rule over the whole column against
+Series.apply() of the equivalent Python function, which is how every callable rule used to be applied.
+
+Usage (from the application folder):
+    python -m benchmarks.bench_template --cases 500000
+"""
+import argparse
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from anonymizer_utils.uid_remap import UIDRemapper
+from anonymizer_utils.update_rules import compile_rules
+
+
+def create_cases(cases: int) -> pd.DataFrame:
+    """
+    Creates unique cases with the original values of the DICOM tags, of patients born in the same few years.
+    """
+    idx = np.arange(cases)
+    return pd.DataFrame({
+        'PatientName': [f'Doe^John{i}' for i in idx],
+        'PatientID': [f'ID{i:08d}' for i in idx],
+        'PatientSex': np.where(idx % 2, 'F', 'M'),
+        'PatientBirthDate': [f'19{40 + i % 60:02d}{1 + i % 12:02d}{1 + i % 28:02d}' for i in idx],
+        'AccessionNumber': [f'PXH{i:09d}' for i in idx],
+    })
+
+
+def shift_date(value: str) -> str:
+    """
+    Shifts a DICOM date by 30 days back, as the "date_shift" rule of RULES.
+    """
+    try:
+        return (datetime.strptime(value, '%Y%m%d') - timedelta(days=30)).strftime('%Y%m%d')
+    except ValueError:
+        return ''
+
+
+# name: (DICOM tag, rule, the equivalent computation row by row)
+RULES = {
+    'regex_replace': ('AccessionNumber', {'rule': 'regex_replace', 'pattern': r'^[a-zA-Z]+', 'repl': ''},
+                      lambda cases: cases['AccessionNumber'].apply(lambda x: re.sub(r'^[a-zA-Z]+', '', x))),
+    'strip_prefix': ('AccessionNumber', {'rule': 'strip_prefix', 'prefix': 'PXH'},
+                     lambda cases: cases['AccessionNumber'].apply(lambda x: x.removeprefix('PXH'))),
+    'date_shift': ('PatientBirthDate', {'rule': 'date_shift', 'days': -30},
+                   lambda cases: cases['PatientBirthDate'].apply(shift_date)),
+    'format': ('PatientName', {'rule': 'format', 'format': 'CASE-{PatientSex}-{value}'},
+               lambda cases: cases.apply(lambda row: f'CASE-{row["PatientSex"]}-{row["PatientName"]}', axis=1)),
+    # Row by row: a lookup and a transaction per pseudonym, set in main() with a new remapping table
+    'pseudonym': ('PatientID', {'rule': 'pseudonym', 'prefix': 'PAT'}, None),
+    'callable': ('AccessionNumber', lambda x: x[3:], lambda cases: cases['AccessionNumber'].apply(lambda x: x[3:])),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=500000, help='unique cases of the template')
+    args = parser.parse_args()
+
+    cases = create_cases(args.cases)
+    print(f"{'rule':<15}{'compiled s':>12}{'row by row s':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (tag, rule, row_by_row) in RULES.items():
+            if name == 'pseudonym':
+                # New remapping tables, so that every pseudonym is derived and recorded
+                rule = {**rule, 'store': str(Path(tmp) / 'compiled.sqlite')}
+                remapper = UIDRemapper(str(Path(tmp) / 'row_by_row.sqlite'))
+                row_by_row = lambda cases: cases[tag].apply(lambda x: remapper.pseudonym(tag, x, 'PAT'))
+            start = time.perf_counter()
+            compiled = compile_rules({tag: rule})[tag]
+            compiled(cases)
+            seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            row_by_row(cases)
+            print(f'{name:<15}{seconds:>12.2f}{time.perf_counter() - start:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Benchmark of the scan, template, upload-merge and anonymize stages on a synthetic (or existing) corpus.
+
+Reports files/s and MB/s of every stage and the peak RSS of the process and of its workers as JSON, which can be
+compared between runs. The anonymized files are written to a temporary folder, which is deleted afterwards.
+
+Usage (from the application folder):
+    python -m benchmarks.run --out results.json --patients 20 --slices 100
+    python -m benchmarks.run --corpus D:/dicom --fformat dcm --out results.json
+    python -m benchmarks.run --out new.json --compare results.json
+    python -m benchmarks.run --corpus D:/dicom --fformat dcm --output-syntax rle
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.anonymize_dicom import create_dcm_df, create_jobs, create_manifest
+from anonymizer_utils.anonymize_parallel import anonymize_files
+from anonymizer_utils.pipeline import anonymize_pipelined
+from app_settings.config import new_tags, ref_tags, unique_ids, update_tags
+from benchmarks.synthetic import add_corpus_arguments, corpus_kwargs, generate_corpus
+from ui_utils.ui_logic import create_update_cols, update_data_editor
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+
+def peak_rss_mb() -> dict:
+    """
+    Returns the peak resident set size (MB) of this process and of its terminated child processes (workers).
+    """
+    if resource is None:
+        return {'self': None, 'children': None}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def stage_metrics(seconds: float, files: int, total_bytes: int) -> dict:
+    """
+    Summarizes the throughput of a stage. The peak RSS is only known for the whole process (peak_rss_mb()).
+    """
+    return {
+        'seconds': seconds,
+        'files': files,
+        'bytes': total_bytes,
+        'files_per_s': files / seconds if seconds else None,
+        'mb_per_s': total_bytes / 1024 ** 2 / seconds if seconds else None,
+    }
+
+
+def run_benchmark(folder: str, fformat: str, max_workers=None, chunk_size: int = 16, streaming_threshold=None,
+                  engine: str = 'pipeline', io_threads: int = 4, output_syntax=None) -> dict:
+    """
+    Times the stages of the application on a folder.
+
+    Args:
+        folder (str): The directory of folder with dicom files.
+        fformat (str): The file format of the targeted files.
+        max_workers (int, optional): The number of worker processes of the anonymize stage.
+        chunk_size (int): The number of files submitted to a worker at once.
+        streaming_threshold (int, optional): Files of at least this size (bytes) are anonymized in streaming mode.
+        engine (str): 'pipeline' (anonymize_pipelined) or 'pool' (anonymize_files).
+        io_threads (int): The number of reader and writer threads of the pipeline.
+        output_syntax (str, optional): The output transfer syntax of the anonymize stage (e.g. 'rle').
+
+    Returns:
+        dict: The metrics of each stage. The anonymize stage also has the files (output_files) and bytes
+        (output_bytes) written, which are written to a temporary folder rather than next to the folder.
+    """
+    stages = {}
+
+    start = time.perf_counter()
+    manifest = create_manifest(folder, fformat)
+    total_bytes = int(manifest['size'].sum())
+    stages['scan'] = stage_metrics(time.perf_counter() - start, len(manifest), total_bytes)
+
+    start = time.perf_counter()
+    dcm_info = create_dcm_df(folder, fformat, unique_ids, ref_tags, list(new_tags.keys()), manifest=manifest)
+    uids = dcm_info[(unique_ids + ref_tags)].drop_duplicates()
+    edit_df = create_update_cols(uids, update_tags)
+    stages['template'] = stage_metrics(time.perf_counter() - start, len(dcm_info), 0)
+
+    # A mapping sheet as a user would upload it, with a value in every "Update_" column
+    upload_df = edit_df.reset_index(drop=True).copy()
+    for tag in update_tags:
+        upload_df[f'Update_{tag}'] = [f'{tag}{i:07d}' for i in range(len(upload_df))]
+    upload_df = upload_df.fillna('').astype(str)
+    start = time.perf_counter()
+    edit_df = update_data_editor(edit_df, upload_df, update_tags)
+    stages['upload_merge'] = stage_metrics(time.perf_counter() - start, len(upload_df), 0)
+
+    # The outputs are never written next to the folder, which may be a real export with its own "-Anonymized" folder
+    output_dir = Path(tempfile.mkdtemp(prefix='dicomanon-bench-out-')) / f'{Path(folder).name}-Anonymized'
+    dcm_info['output_dir'] = [str(output_dir / Path(folder_dir).relative_to(folder)) for folder_dir in dcm_info['folder_dir']]
+    tags_2_create = {dcm_tag: options[0] for dcm_tag, options in new_tags.items()}
+    profile = build_profile(tags_2_create=tags_2_create, output_syntax=output_syntax)
+    try:
+        start = time.perf_counter()
+        jobs = create_jobs(dcm_info, edit_df, manifest, update_tags, profile, streaming_threshold)
+        if engine == 'pipeline':
+            results = anonymize_pipelined(jobs, max_workers=max_workers, chunk_size=chunk_size, io_threads=io_threads)
+        else:
+            results = anonymize_files(jobs, max_workers=max_workers, chunk_size=chunk_size)
+        stages['anonymize'] = stage_metrics(time.perf_counter() - start, len(jobs), total_bytes)
+        stages['anonymize']['errors'] = sum(result['error'] is not None for result in results)
+        outputs = [path for path in output_dir.rglob('*') if path.is_file()]
+        stages['anonymize']['output_files'] = len(outputs)
+        stages['anonymize']['output_bytes'] = sum(path.stat().st_size for path in outputs)
+    finally:
+        shutil.rmtree(output_dir.parent, ignore_errors=True)
+
+    return stages
+
+
+def compare(current: dict, baseline: dict):
+    """
+    Prints the change of throughput of every stage against a baseline result.
+    """
+    print(f"{'stage':<14}{'baseline files/s':>18}{'current files/s':>18}{'change':>10}")
+    for stage, metrics in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage, {}).get('files_per_s')
+        after = metrics['files_per_s']
+        change = f'{after / before - 1:+.1%}' if before and after else 'n/a'
+        print(f"{stage:<14}{before or 0:>18.1f}{after or 0:>18.1f}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='an existing folder to benchmark; if omitted, a synthetic corpus is generated')
+    parser.add_argument('--fformat', default='dcm', help='file extension of the corpus')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes of the anonymize stage')
+    parser.add_argument('--chunk-size', type=int, default=16)
+    parser.add_argument('--engine', choices=['pipeline', 'pool'], default='pipeline', help='anonymize stage engine')
+    parser.add_argument('--io-threads', type=int, default=4, help='reader and writer threads of the pipeline')
+    parser.add_argument('--streaming-threshold', type=int, default=None, help='bytes; streaming mode for larger files')
+    parser.add_argument('--output-syntax', choices=['deflated', 'rle', 'jpegls', 'jpeg2000'], default=None,
+                        help='re-encode the anonymized files (the synthetic pixel data is uniform, use --corpus for real ratios)')
+    parser.add_argument('--out', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='a previous JSON result to compare with')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    tmp_dir = None
+    corpus = None
+    folder = args.corpus
+    if folder is None:
+        tmp_dir = tempfile.mkdtemp(prefix='dicomanon-bench-')
+        folder = os.path.join(tmp_dir, 'corpus')
+        start = time.perf_counter()
+        corpus = generate_corpus(folder, **corpus_kwargs(args))
+        corpus['generate_seconds'] = time.perf_counter() - start
+
+    try:
+        stages = run_benchmark(
+            folder, args.fformat, args.workers, args.chunk_size, args.streaming_threshold, args.engine, args.io_threads,
+            args.output_syntax
+        )
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'engine': args.engine,
+        'output_syntax': args.output_syntax,
+        'corpus': corpus if corpus is not None else {'folder': folder},
+        'stages': stages,
+        # ru_maxrss is the peak of the whole process, not of a stage
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    output = json.dumps(result, indent=2)
+    if args.out:
+        Path(args.out).write_text(output)
+    print(output)
+
+    if args.compare:
+        compare(result, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Generator of synthetic DICOM corpora for the benchmarks.
+
+The files are laid out as the application expects, with one subfolder per study:
+    <root>/<PatientID>_<AccessionNumber>/SE<SeriesNumber>/IM<InstanceNumber>.dcm
+As in scanner exports, the series of a study repeat the same file names.
+
+Usage (from the application folder):
+    python -m benchmarks.synthetic <root> --patients 10 --studies 1 --series 2 --slices 50
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+
+def create_instance(patient: int, study: int, series: int, instance: int, uids: dict,
+                    sequence_items: int, private_tags: int, rows: int, columns: int, frames: int) -> Dataset:
+    """
+    Creates one synthetic CT instance.
+
+    Args:
+        patient (int), study (int), series (int), instance (int): The numbers of the instance in the corpus.
+        uids (dict): The StudyInstanceUID and SeriesInstanceUID of the instance.
+        sequence_items (int): The number of nested items in a ReferencedImageSequence.
+        private_tags (int): The number of private tags.
+        rows (int), columns (int), frames (int): The geometry of the 16-bit pixel data.
+
+    Returns:
+        Dataset: The DICOM dataset with file meta information.
+    """
+    sop_instance_uid = generate_uid()
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = CTImageStorage
+    file_meta.MediaStorageSOPInstanceUID = sop_instance_uid
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = sop_instance_uid
+    ds.StudyInstanceUID = uids['StudyInstanceUID']
+    ds.SeriesInstanceUID = uids['SeriesInstanceUID']
+    ds.Modality = 'CT'
+    ds.PatientName = f'Synthetic^Patient{patient:05d}'
+    ds.PatientID = f'P{patient:07d}'
+    ds.PatientBirthDate = '19700101'
+    ds.PatientSex = 'O'
+    ds.PatientAge = '050Y'
+    ds.AccessionNumber = f'SYN{patient:05d}{study:02d}'
+    ds.StudyDate = '20240101'
+    ds.InstitutionName = 'Synthetic Hospital'
+    ds.ReferringPhysicianName = 'Doctor^Referring'
+    ds.StudyID = f'{study}'
+    ds.SeriesNumber = series
+    ds.InstanceNumber = instance
+
+    if sequence_items:
+        items = []
+        for i in range(sequence_items):
+            item = Dataset()
+            item.ReferencedSOPClassUID = CTImageStorage
+            item.ReferencedSOPInstanceUID = generate_uid()
+            item.ReferencedFrameNumber = i + 1
+            items.append(item)
+        ds.ReferencedImageSequence = Sequence(items)
+
+    if private_tags:
+        block = ds.private_block(0x0009, 'SYNTHETIC', create=True)
+        for i in range(min(private_tags, 0xFF)):
+            block.add_new(i, 'LO', f'private value {i}')
+
+    ds.Rows = rows
+    ds.Columns = columns
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    if frames > 1:
+        ds.NumberOfFrames = frames
+    ds.PixelData = np.full((frames, rows, columns), instance % 4096, dtype=np.uint16).tobytes()
+    return ds
+
+
+def generate_corpus(root: str, patients: int = 10, studies: int = 1, series: int = 2, slices: int = 50,
+                    sequence_items: int = 0, private_tags: int = 0,
+                    rows: int = 256, columns: int = 256, frames: int = 1) -> dict:
+    """
+    Writes a synthetic corpus of DICOM files.
+
+    Args:
+        root (str): The folder to write the corpus into.
+        patients (int): The number of patients.
+        studies (int): The number of studies per patient.
+        series (int): The number of series per study.
+        slices (int): The number of instances per series.
+        sequence_items (int): The number of nested sequence items per instance (header complexity).
+        private_tags (int): The number of private tags per instance (header complexity).
+        rows (int), columns (int), frames (int): The pixel geometry of each instance.
+
+    Returns:
+        dict: The parameters of the corpus, with the total number of files and bytes.
+    """
+    root_dir = Path(root)
+    files, total_bytes = 0, 0
+    for patient in range(patients):
+        for study in range(studies):
+            study_uids = {'StudyInstanceUID': generate_uid()}
+            for series_number in range(1, series + 1):
+                uids = {**study_uids, 'SeriesInstanceUID': generate_uid()}
+                series_dir = root_dir / f'P{patient:07d}_SYN{patient:05d}{study:02d}' / f'SE{series_number:03d}'
+                series_dir.mkdir(parents=True, exist_ok=True)
+                for instance in range(1, slices + 1):
+                    ds = create_instance(
+                        patient, study, series_number, instance, uids,
+                        sequence_items, private_tags, rows, columns, frames
+                    )
+                    file_dir = series_dir / f'IM{instance:05d}.dcm'
+                    ds.save_as(file_dir, enforce_file_format=True)
+                    files += 1
+                    total_bytes += file_dir.stat().st_size
+
+    return {
+        'patients': patients, 'studies': studies, 'series': series, 'slices': slices,
+        'sequence_items': sequence_items, 'private_tags': private_tags,
+        'rows': rows, 'columns': columns, 'frames': frames,
+        'files': files, 'bytes': total_bytes,
+    }
+
+
+def add_corpus_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the parameters of generate_corpus() to an argument parser.
+    """
+    parser.add_argument('--patients', type=int, default=10)
+    parser.add_argument('--studies', type=int, default=1, help='studies per patient')
+    parser.add_argument('--series', type=int, default=2, help='series per study')
+    parser.add_argument('--slices', type=int, default=50, help='instances per series')
+    parser.add_argument('--sequence-items', type=int, default=0, help='nested sequence items per instance')
+    parser.add_argument('--private-tags', type=int, default=0, help='private tags per instance')
+    parser.add_argument('--rows', type=int, default=256)
+    parser.add_argument('--columns', type=int, default=256)
+    parser.add_argument('--frames', type=int, default=1, help='frames per instance')
+
+
+def corpus_kwargs(args: argparse.Namespace) -> dict:
+    """
+    Extracts the keyword arguments of generate_corpus() from parsed arguments.
+    """
+    return {
+        'patients': args.patients, 'studies': args.studies, 'series': args.series, 'slices': args.slices,
+        'sequence_items': args.sequence_items, 'private_tags': args.private_tags,
+        'rows': args.rows, 'columns': args.columns, 'frames': args.frames,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='folder to write the corpus into')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+    print(generate_corpus(args.root, **corpus_kwargs(args)))
+
+
+if __name__ == '__main__':
+    main()
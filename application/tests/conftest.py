@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The modules are imported from the application folder, as by "streamlit run user_interface.py"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path_factory, monkeypatch):
+    """
+    Keeps the default UID store and scan cache (~/.dicom_anonymizer) of the tests out of the real home folder,
+    also in the worker processes.
+    """
+    from anonymizer_utils import scan_cache, uid_remap
+    home = tmp_path_factory.mktemp('home')
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setenv('USERPROFILE', str(home))
+    monkeypatch.setattr(uid_remap, 'DEFAULT_UID_STORE', home / '.dicom_anonymizer' / 'uid_map.sqlite')
+    monkeypatch.setattr(scan_cache, 'DEFAULT_CACHE_DIR', home / '.dicom_anonymizer' / 'scan_cache')
+    return home
+
+
+def pytest_addoption(parser):
+    parser.addoption('--runslow', action='store_true', help='also run the tests marked as slow')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'slow: a test of minutes, only run with --runslow')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--runslow'):
+        return
+    skip_slow = pytest.mark.skip(reason='slow, run with --runslow')
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip_slow)
@@ -0,0 +1,20 @@
+"""
+Tests of the errors of the command line interface, which exit with EXIT_INVALID instead of a traceback.
+"""
+import pytest
+
+import anonymize_cli
+
+
+@pytest.mark.parametrize('scan_cache', [False, True])
+def test_folder_without_matching_files(tmp_path, capsys, scan_cache):
+    folder = tmp_path / 'empty'
+    (folder / 'P1').mkdir(parents=True)
+    (folder / 'P1' / 'notes.txt').write_text('no dicom files')
+    config = tmp_path / 'config.py'
+    config.write_text(f'scan_cache = {scan_cache}\nscan_cache_dir = {str(tmp_path / "cache")!r}\n')
+
+    code = anonymize_cli.main(['template', str(folder), '--fformat', 'dcm', '--config', str(config),
+                               '--out', str(tmp_path / 'template.csv')])
+    assert code == anonymize_cli.EXIT_INVALID
+    assert 'Cannot find any files with extension "dcm"' in capsys.readouterr().err
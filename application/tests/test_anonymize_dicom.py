@@ -0,0 +1,60 @@
+"""
+Tests of the anonymization jobs and of their outputs: series of a case with the same file names, and atomic writes.
+"""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import anonymize_cli
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.anonymize_dicom import create_dcm_df, create_jobs, create_manifest, open_output
+from app_settings.config import ref_tags, unique_ids, update_tags
+from benchmarks.synthetic import generate_corpus
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    # The series SE001 and SE002 of a case have the same file names
+    folder = tmp_path / 'corpus'
+    generate_corpus(str(folder), patients=2, studies=1, series=2, slices=3, rows=8, columns=8)
+    return folder
+
+
+def test_outputs_keep_the_path_in_the_case_folder(corpus):
+    manifest = create_manifest(str(corpus), 'dcm', max_workers=1)
+    dcm_info = create_dcm_df(str(corpus), 'dcm', unique_ids, ref_tags, [], manifest=manifest, max_workers=1)
+    edit_df = dcm_info[[]].assign(**{f'Update_{tag}': 'X' for tag in update_tags})
+    jobs = create_jobs(dcm_info, edit_df, manifest, update_tags, build_profile())
+
+    outputs = [job['output_dir'] for job in jobs]
+    assert len(outputs) == len(set(outputs)) == 12
+    for job in jobs:
+        relative = Path(job['file_dir']).relative_to(corpus)
+        assert Path(job['output_dir']) == corpus.parent / 'corpus-Anonymized' / relative
+
+
+def test_run_writes_every_file(corpus, tmp_path):
+    config = tmp_path / 'config.py'
+    config.write_text(f'scan_cache = False\nuid_store = {str(tmp_path / "uid_map.sqlite")!r}\n')
+    scan_args = [str(corpus), '--fformat', 'dcm', '--config', str(config), '--quiet']
+    assert anonymize_cli.main(['template', *scan_args, '--out', str(tmp_path / 'mapping.csv')]) == anonymize_cli.EXIT_OK
+    mapping = pd.read_csv(tmp_path / 'mapping.csv', dtype=str).fillna('')
+    for tag in update_tags:
+        mapping[f'Update_{tag}'] = 'X'
+    mapping.to_csv(tmp_path / 'mapping.csv', index=False)
+
+    assert anonymize_cli.main(['run', *scan_args, '--mapping', str(tmp_path / 'mapping.csv')]) == anonymize_cli.EXIT_OK
+    assert len(list((tmp_path / 'corpus-Anonymized').rglob('*.dcm'))) == 12
+
+
+def test_failed_write_keeps_the_previous_output(tmp_path):
+    output = tmp_path / 'out' / 'IM00001.dcm'
+    with open_output(str(output)) as f:
+        f.write(b'first')
+    with pytest.raises(RuntimeError):
+        with open_output(str(output)) as f:
+            f.write(b'partial')
+            raise RuntimeError
+    assert output.read_bytes() == b'first'
+    assert [path.name for path in output.parent.iterdir()] == ['IM00001.dcm']
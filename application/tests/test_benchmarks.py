@@ -0,0 +1,33 @@
+"""
+Tests of the benchmark of the stages, on a small synthetic corpus, and of the targets of the startup benchmark.
+"""
+from pathlib import Path
+
+import pytest
+
+from benchmarks.bench_startup import TARGETS, imported_modules
+from benchmarks.run import run_benchmark
+from benchmarks.synthetic import generate_corpus
+
+
+def test_benchmark_writes_every_file_outside_the_corpus(tmp_path):
+    folder = tmp_path / 'corpus'
+    corpus = generate_corpus(str(folder), patients=2, studies=1, series=2, slices=3, rows=8, columns=8)
+    # The "-Anonymized" folder of a real export is left untouched
+    existing = tmp_path / 'corpus-Anonymized' / 'keep.dcm'
+    existing.parent.mkdir()
+    existing.write_bytes(b'real output')
+
+    stages = run_benchmark(str(folder), 'dcm', max_workers=1)
+    assert stages['anonymize']['errors'] == 0
+    assert stages['anonymize']['output_files'] == stages['anonymize']['files'] == corpus['files'] == 12
+    assert existing.read_bytes() == b'real output'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['corpus', 'corpus-Anonymized']
+
+
+@pytest.mark.parametrize('name', sorted(TARGETS))
+def test_startup_targets_do_not_load_forbidden_modules(name, monkeypatch):
+    # The targets are run from the application folder
+    monkeypatch.chdir(Path(__file__).resolve().parents[1])
+    statement, forbidden = TARGETS[name]
+    assert not imported_modules(statement) & set(forbidden)
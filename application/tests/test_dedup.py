@@ -0,0 +1,54 @@
+"""
+Tests of the duplicates: they are completed from the output of their first copy, which is never removed.
+"""
+import os
+
+import pytest
+
+from anonymizer_utils.dedup import resolve_duplicates
+
+
+@pytest.fixture
+def duplicate(tmp_path):
+    # Two copies of a file, of which the first one is anonymized
+    for name in ('first.dcm', 'copy.dcm'):
+        (tmp_path / name).write_bytes(b'original')
+    first_output = tmp_path / 'out' / 'SE001' / 'IM00001.dcm'
+    first_output.parent.mkdir(parents=True)
+    first_output.write_bytes(b'anonymized')
+    first_copy = {'file_dir': str(tmp_path / 'first.dcm'), 'output_dir': str(first_output)}
+    job = {'file_dir': str(tmp_path / 'copy.dcm'), 'output_dir': str(tmp_path / 'out' / 'SE002' / 'IM00001.dcm')}
+    return job, first_copy, {first_copy['file_dir']: str(first_output)}
+
+
+def test_skip_records_the_first_copy(duplicate):
+    job, first_copy, outputs = duplicate
+    [result] = resolve_duplicates([(job, first_copy)], outputs, 'skip')
+    assert result['error'] is None and result['status'] == 'duplicate'
+    assert result['output_dir'] == first_copy['output_dir']
+    assert not os.path.exists(job['output_dir'])
+
+
+def test_link_creates_the_output_of_the_duplicate(duplicate):
+    job, first_copy, outputs = duplicate
+    for _ in range(2):  # the second run finds the link in place
+        [result] = resolve_duplicates([(job, first_copy)], outputs, 'link')
+        assert result['error'] is None and result['output_dir'] == job['output_dir']
+    assert os.path.samefile(job['output_dir'], first_copy['output_dir'])
+    with open(first_copy['output_dir'], 'rb') as f:
+        assert f.read() == b'anonymized'
+
+
+def test_link_keeps_a_first_copy_at_the_same_path(duplicate):
+    job, first_copy, outputs = duplicate
+    job['output_dir'] = first_copy['output_dir']
+    [result] = resolve_duplicates([(job, first_copy)], outputs, 'link')
+    assert result['error'] is None and result['output_dir'] == first_copy['output_dir']
+    with open(first_copy['output_dir'], 'rb') as f:
+        assert f.read() == b'anonymized'
+
+
+def test_missing_first_copy_is_a_failure(duplicate):
+    job, first_copy, _ = duplicate
+    [result] = resolve_duplicates([(job, first_copy)], {}, 'link')
+    assert result['status'] == 'failed' and 'was not anonymized' in result['error']
@@ -0,0 +1,54 @@
+"""
+Tests of the C-STORE receiver with a live association: mapped datasets are anonymized and written, the others refused.
+"""
+import pandas as pd
+import pydicom
+import pytest
+
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.dicom_receiver import STATUS_CANNOT_UNDERSTAND, STATUS_SUCCESS, StoreReceiver, create_mapping
+from benchmarks.synthetic import create_instance
+
+pynetdicom = pytest.importorskip('pynetdicom')
+
+UPDATE_TAGS = {'PatientName': '', 'PatientID': ''}
+
+
+@pytest.fixture
+def receiver(tmp_path):
+    upload_df = pd.DataFrame({'PatientID': ['P0000000'], 'Update_PatientName': ['CASE0'], 'Update_PatientID': ['CASE0']})
+    receiver = StoreReceiver(str(tmp_path / 'received'), build_profile(), UPDATE_TAGS,
+                             create_mapping(upload_df, UPDATE_TAGS), max_workers=1, log=lambda message: None)
+    receiver.start(port=0, address='127.0.0.1', block=False)
+    yield receiver
+    receiver.shutdown()
+
+
+def send(port: int, datasets: list) -> list:
+    """
+    Sends the datasets in one association, and returns the statuses of the responses.
+    """
+    ae = pynetdicom.AE(ae_title='TESTSCU')
+    ae.add_requested_context(pydicom.uid.CTImageStorage, pydicom.uid.ExplicitVRLittleEndian)
+    assoc = ae.associate('127.0.0.1', port, ae_title='DICOMANON')
+    assert assoc.is_established
+    try:
+        return [assoc.send_c_store(ds).Status for ds in datasets]
+    finally:
+        assoc.release()
+
+
+def test_mapped_dataset_is_written_and_unmapped_one_refused(receiver, tmp_path):
+    uids = {'StudyInstanceUID': pydicom.uid.generate_uid(), 'SeriesInstanceUID': pydicom.uid.generate_uid()}
+    mapped, unmapped = (create_instance(patient, 0, 1, 1, uids, 0, 0, 8, 8, 1) for patient in (0, 1))
+
+    statuses = send(receiver.server.server_address[1], [mapped, unmapped])
+    assert statuses == [STATUS_SUCCESS, STATUS_CANNOT_UNDERSTAND]
+
+    written = list((tmp_path / 'received').rglob('*.dcm'))
+    assert len(written) == 1
+    ds = pydicom.dcmread(written[0])
+    assert (ds.PatientID, str(ds.PatientName), ds.SOPInstanceUID) == ('CASE0', 'CASE0', mapped.SOPInstanceUID)
+    assert written[0].relative_to(tmp_path / 'received').parts[0] == 'CASE0'
+    assert ds.PixelData == mapped.PixelData
+    assert receiver.metrics.counters['refused'] == 1
@@ -0,0 +1,28 @@
+"""
+Tests of the metrics of a run and of the cProfile hook.
+"""
+from pathlib import Path
+
+from anonymizer_utils.instrumentation import create_metrics
+
+
+def test_cprofile_stats_are_collected_once_and_removed(monkeypatch):
+    monkeypatch.setenv('DICOMANON_PROFILE', 'cprofile')
+    metrics = create_metrics()
+    profile_dir = metrics.profile_dir
+    with metrics.capture('anonymize'):
+        sorted(range(1000), key=str)
+
+    report = metrics.collect_profiles()
+    assert 'function calls' in report
+    assert not Path(profile_dir).exists()
+    assert metrics.collect_profiles() == report
+
+
+def test_metrics_without_profiling_have_no_profile_dir(monkeypatch):
+    monkeypatch.delenv('DICOMANON_PROFILE', raising=False)
+    metrics = create_metrics()
+    with metrics.stage('scan'):
+        metrics.count('files', 2)
+    assert metrics.profile_dir is None and metrics.collect_profiles() is None
+    assert metrics.counters['files'] == 2 and metrics.timers['scan'] >= 0
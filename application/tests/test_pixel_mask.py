@@ -0,0 +1,51 @@
+"""
+Tests of the pixel masks: the regions are blanked in every frame, and the other pixels are kept.
+"""
+import numpy as np
+import pydicom
+import pytest
+
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.anonymize_dicom import anonymize
+from benchmarks.synthetic import generate_corpus
+
+# (x, y, width, height) of the blanked region
+REGION = (2, 1, 3, 2)
+
+
+def masked_pixels(tmp_path, frames: int, streaming: bool, modality: str = 'CT') -> np.ndarray:
+    """
+    Anonymizes the first file of a synthetic corpus with a mask of REGION, and reads back its pixels.
+    """
+    generate_corpus(str(tmp_path / 'corpus'), patients=1, studies=1, series=1, slices=1, rows=8, columns=8, frames=frames)
+    file_dir = next((tmp_path / 'corpus').rglob('*.dcm'))
+    profile = build_profile(pixel_masks=[{'Modality': modality, 'Rows': 8, 'regions': [REGION], 'fill': 7}])
+    output_dir = tmp_path / 'out.dcm'
+    anonymize(str(file_dir), str(output_dir), update={}, profile=profile, streaming=streaming)
+    ds = pydicom.dcmread(output_dir)
+    assert int(ds.get('NumberOfFrames', 1) or 1) == frames
+    # Every frame is read as (frames, rows, columns)
+    return ds.pixel_array.reshape(frames, 8, 8)
+
+
+def expected_pixels(frames: int) -> np.ndarray:
+    # The synthetic pixels of the first instance are all 1
+    expected = np.ones((frames, 8, 8), dtype=np.uint16)
+    x, y, width, height = REGION
+    expected[:, y:y + height, x:x + width] = 7
+    return expected
+
+
+@pytest.mark.parametrize('frames', [1, 3])
+def test_regions_are_blanked_in_every_frame(tmp_path, frames):
+    np.testing.assert_array_equal(masked_pixels(tmp_path, frames, streaming=False), expected_pixels(frames))
+
+
+@pytest.mark.parametrize('frames', [1, 3])
+def test_streamed_files_matching_a_mask_are_masked_in_memory(tmp_path, frames):
+    np.testing.assert_array_equal(masked_pixels(tmp_path, frames, streaming=True), expected_pixels(frames))
+
+
+def test_files_not_matching_a_mask_are_kept(tmp_path):
+    pixels = masked_pixels(tmp_path, 1, streaming=True, modality='US')
+    np.testing.assert_array_equal(pixels, np.ones((1, 8, 8), dtype=np.uint16))
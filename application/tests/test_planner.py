@@ -0,0 +1,23 @@
+"""
+Tests of the planning of a run from a sample of the files.
+"""
+from anonymizer_utils import uid_remap
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.anonymize_dicom import create_manifest
+from anonymizer_utils.planner import plan_run
+from benchmarks.synthetic import generate_corpus
+
+
+def test_plan_with_remapped_uids_closes_its_store(tmp_path):
+    folder = tmp_path / 'corpus'
+    generate_corpus(str(folder), patients=2, studies=1, series=1, slices=2, rows=8, columns=8)
+    manifest = create_manifest(str(folder), 'dcm', max_workers=1)
+    profile = build_profile(remap_uids=['StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID'],
+                            uid_store=str(tmp_path / 'uid_map.sqlite'))
+
+    remappers = set(uid_remap._remappers)
+    plan = plan_run(manifest, profile, str(tmp_path / 'corpus-Anonymized'), max_workers=2)
+    assert (plan.sample_files, plan.failed_samples) == (4, 0)
+    # The temporary store is neither left open nor created in the store of the run
+    assert set(uid_remap._remappers) == remappers
+    assert not (tmp_path / 'uid_map.sqlite').exists()
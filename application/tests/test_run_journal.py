@@ -0,0 +1,79 @@
+"""
+Tests of the run journal: the files skipped by a rerun, and the cases recorded for the check of the shards.
+"""
+import os
+
+import pandas as pd
+
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.run_journal import RunJournal
+
+
+def run(tmp_path, names: list) -> tuple:
+    """
+    Creates input files with their jobs and manifest, and the results of their anonymization.
+    """
+    profile = build_profile()
+    jobs, manifest, results = [], [], []
+    for name in names:
+        file_dir, output_dir = tmp_path / f'{name}.dcm', tmp_path / 'out' / f'{name}.dcm'
+        if not file_dir.exists():
+            file_dir.write_bytes(name.encode())
+        stat = os.stat(file_dir)
+        jobs.append({'file_dir': str(file_dir), 'output_dir': str(output_dir), 'profile': profile, 'update': {}})
+        manifest.append({'file_dir': str(file_dir), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+        results.append({'file_dir': str(file_dir), 'output_dir': str(output_dir), 'size': stat.st_size,
+                        'mtime_ns': stat.st_mtime_ns, 'digest': None, 'error': None})
+    return jobs, pd.DataFrame(manifest), results
+
+
+def write_outputs(results: list):
+    for result in results:
+        if result['error'] is None:
+            os.makedirs(os.path.dirname(result['output_dir']), exist_ok=True)
+            open(result['output_dir'], 'wb').close()
+
+
+def test_rerun_skips_done_files(tmp_path):
+    jobs, manifest, results = run(tmp_path, ['a', 'b', 'c'])
+    results[2]['error'] = 'InvalidDicomError'
+    write_outputs(results)
+    with RunJournal(str(tmp_path / 'journal.sqlite')) as journal:
+        selected, keys = journal.filter_jobs(jobs, manifest)
+        journal.record(results, keys)
+
+        selected, _ = journal.filter_jobs(jobs, manifest)
+        assert [job['file_dir'] for job in selected] == [results[2]['file_dir']]
+        selected, _ = journal.filter_jobs(jobs, manifest, only_failed=True)
+        assert [job['file_dir'] for job in selected] == [results[2]['file_dir']]
+        # Archives do not reuse the outputs written as files
+        selected, _ = journal.filter_jobs(jobs, manifest, archive='zip')
+        assert len(selected) == 3
+
+
+def test_changed_inputs_and_missing_outputs_are_rerun(tmp_path):
+    jobs, manifest, results = run(tmp_path, ['a', 'b', 'c'])
+    write_outputs(results)
+    with RunJournal(str(tmp_path / 'journal.sqlite')) as journal:
+        journal.record(results, journal.filter_jobs(jobs, manifest)[1])
+
+        (tmp_path / 'a.dcm').write_bytes(b'changed')
+        os.remove(results[1]['output_dir'])
+        jobs, manifest, _ = run(tmp_path, ['a', 'b', 'c'])
+        jobs[2]['update'] = {0x00100020: 'CASE1'}
+        selected, _ = journal.filter_jobs(jobs, manifest)
+        assert len(selected) == 3
+
+
+def test_recorded_cases_are_keyed_by_the_secret(tmp_path):
+    edit_df = pd.DataFrame({'PatientID': ['P1', 'P2'], 'Update_PatientID': ['CASE1', 'CASE2']}, index=['P1_1', 'P2_1'])
+    with RunJournal(str(tmp_path / 'journal.sqlite')) as journal:
+        journal.record_mappings(edit_df, ['PatientID'], 'secret')
+        cases = journal.mappings()
+        assert cases['Update_PatientID'].tolist() == ['CASE1', 'CASE2']
+        assert not cases[['pk', 'PatientID']].isin(['P1', 'P2', 'P1_1', 'P2_1']).any().any()
+
+        # The hashes of another secret replace the recorded cases, as they cannot be compared
+        journal.record_mappings(edit_df.iloc[:1], ['PatientID'], 'another secret')
+        assert journal.mappings()['PatientID'].tolist() != cases['PatientID'].tolist()[:1]
+        assert len(journal.mappings()) == 1
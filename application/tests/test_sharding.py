@@ -0,0 +1,124 @@
+"""
+Tests of sharded runs: the check of the pseudonyms of the shard journals, and a sharded run of the command line
+interface on a synthetic corpus of patients with several studies.
+"""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import anonymize_cli
+from anonymizer_utils.run_journal import journal_path
+from anonymizer_utils.sharding import find_conflicts
+from benchmarks.synthetic import generate_corpus
+
+UNIQUE_IDS = ['PatientName', 'PatientID', 'AccessionNumber']
+
+
+def mappings(rows: list) -> pd.DataFrame:
+    """
+    Creates the recorded cases of the shards from (shard, PatientID, AccessionNumber, Update_PatientID, Update_AccessionNumber).
+    """
+    return pd.DataFrame([
+        {'pk': f'{patient}_{accession}', 'PatientID': patient, 'AccessionNumber': accession,
+         'Update_PatientID': new_patient, 'Update_AccessionNumber': new_accession, 'shard': shard}
+        for shard, patient, accession, new_patient, new_accession in rows
+    ])
+
+
+def test_studies_of_a_patient_are_not_conflicts():
+    # Every study has its own accession number, and only the first study of a patient is mapped
+    conflicts = find_conflicts(mappings([
+        (0, 'P0', 'A0', 'CASE0', 'ACC0'),
+        (0, 'P0', 'A1', '', 'ACC1'),
+        (1, 'P1', 'A2', 'CASE1', 'ACC2'),
+        (1, 'P1', 'A3', '', 'ACC3'),
+    ]), UNIQUE_IDS)
+    assert conflicts.empty
+
+
+def test_values_differing_between_shards_are_inconsistent():
+    # The studies of a patient split over shards (e.g. --shard-key series) with different pseudonyms
+    conflicts = find_conflicts(mappings([
+        (0, 'P0', 'A0', 'CASE0', 'ACC0'),
+        (1, 'P0', 'A1', 'CASE9', 'ACC1'),
+    ]), UNIQUE_IDS)
+    assert conflicts[['kind', 'column', 'value']].values.tolist() == [['inconsistent', 'Update_PatientID', 'P0']]
+    assert conflicts.loc[0, 'conflicting_values'] == ['CASE0', 'CASE9']
+    assert conflicts.loc[0, 'shards'] == [0, 1]
+
+
+def test_pseudonym_shared_between_shards_is_a_collision():
+    conflicts = find_conflicts(mappings([
+        (0, 'P0', 'A0', 'CASE0', 'ACC0'),
+        (1, 'P1', 'A1', 'CASE0', 'ACC1'),
+    ]), UNIQUE_IDS)
+    assert conflicts[['kind', 'column', 'value']].values.tolist() == [['collision', 'Update_PatientID', 'CASE0']]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    folder = tmp_path / 'corpus'
+    generate_corpus(str(folder), patients=4, studies=2, series=1, slices=2, rows=8, columns=8)
+    config = tmp_path / 'config.py'
+    config.write_text(f'scan_cache = False\nuid_store = {str(tmp_path / "uid_map.sqlite")!r}\nuid_secret = "shared"\n')
+    return folder, config
+
+
+def write_mapping(folder, config, tmp_path) -> pd.DataFrame:
+    """
+    Writes the mapping sheet of the corpus, with a pseudonym per patient.
+    """
+    template = tmp_path / 'template.csv'
+    scan_args = [str(folder), '--fformat', 'dcm', '--config', str(config), '--quiet']
+    assert anonymize_cli.main(['template', *scan_args, '--out', str(template)]) == anonymize_cli.EXIT_OK
+
+    mapping = pd.read_csv(template, dtype=str).fillna('')
+    patients = {patient: i for i, patient in enumerate(mapping['PatientID'].unique())}
+    mapping['Update_PatientName'] = mapping['PatientID'].map(lambda patient: f'CASE{patients[patient]}')
+    mapping['Update_PatientID'] = mapping['Update_PatientName']
+    mapping['Update_InstitutionName'] = 'XX'
+    mapping.to_csv(tmp_path / 'mapping.csv', index=False)
+    return mapping
+
+
+def test_sharded_run_of_patients_with_several_studies(corpus, tmp_path):
+    folder, config = corpus
+    scan_args = [str(folder), '--fformat', 'dcm', '--config', str(config), '--quiet']
+    mapping = write_mapping(folder, config, tmp_path)
+    assert len(mapping) == 8
+
+    for shard in ['0/2', '1/2']:
+        assert anonymize_cli.main(['run', *scan_args, '--mapping', str(tmp_path / 'mapping.csv'), '--shard', shard]) == anonymize_cli.EXIT_OK
+    assert anonymize_cli.main(['merge', str(folder), '--shards', '2', '--config', str(config), '--quiet']) == anonymize_cli.EXIT_OK
+    assert not (tmp_path / 'corpus-Anonymized.conflicts.csv').exists()
+
+    # The journals are kept next to the anonymized files, so the cases are recorded without the original identifiers
+    identifiers = set(mapping[UNIQUE_IDS].values.ravel()) - {''}
+    for path in [journal_path(str(folder)), journal_path(str(folder), (0, 2)), journal_path(str(folder), (1, 2))]:
+        with sqlite3.connect(path) as conn:
+            cases = conn.execute('SELECT * FROM cases').fetchall()
+        recorded = repr(cases)
+        assert len(cases) == (8 if path == journal_path(str(folder)) else 4)
+        assert not [identifier for identifier in identifiers if identifier in recorded]
+    # Without remapped UIDs and pseudonyms, the cases are hashed with uid_secret and no UID store is created
+    assert not (tmp_path / 'uid_map.sqlite').exists()
+
+
+def test_sharded_run_needs_a_secret(corpus, tmp_path):
+    folder, config = corpus
+    config.write_text('scan_cache = False\n')
+    write_mapping(folder, config, tmp_path)
+    args = [str(folder), '--fformat', 'dcm', '--config', str(config), '--quiet', '--mapping', str(tmp_path / 'mapping.csv')]
+    assert anonymize_cli.main(['run', *args, '--shard', '0/2']) == anonymize_cli.EXIT_INVALID
+
+
+def test_shards_of_different_secrets_fail_the_merge(corpus, tmp_path, capsys):
+    folder, config = corpus
+    write_mapping(folder, config, tmp_path)
+    for shard, secret in [('0/2', 'machine 0'), ('1/2', 'machine 1')]:
+        config.write_text(f'scan_cache = False\nuid_secret = {secret!r}\n')
+        args = [str(folder), '--fformat', 'dcm', '--config', str(config), '--quiet', '--mapping', str(tmp_path / 'mapping.csv')]
+        assert anonymize_cli.main(['run', *args, '--shard', shard]) == anonymize_cli.EXIT_OK
+    assert anonymize_cli.main(['merge', str(folder), '--shards', '2', '--config', str(config), '--quiet']) == anonymize_cli.EXIT_FAILURES
+    assert 'different secrets' in capsys.readouterr().err
@@ -0,0 +1,49 @@
+"""
+Tests of the output encoding with the streaming mode: files which are kept in their transfer syntax are still streamed.
+"""
+import pydicom
+import pytest
+from pydicom.uid import DeflatedExplicitVRLittleEndian, ExplicitVRLittleEndian, RLELossless
+
+from anonymizer_utils import anonymize_dicom
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.transcode import needs_encoding
+from benchmarks.synthetic import generate_corpus
+
+
+@pytest.fixture
+def rle_file(tmp_path):
+    generate_corpus(str(tmp_path / 'corpus'), patients=1, studies=1, series=1, slices=1, rows=8, columns=8)
+    path = next((tmp_path / 'corpus').rglob('*.dcm'))
+    ds = pydicom.dcmread(path)
+    ds.compress(RLELossless, generate_instance_uid=False)
+    ds.save_as(path)
+    return path
+
+
+def test_needs_encoding():
+    assert needs_encoding(ExplicitVRLittleEndian, RLELossless)
+    assert needs_encoding(None, RLELossless)
+    assert not needs_encoding(ExplicitVRLittleEndian, None)
+    assert not needs_encoding(RLELossless, RLELossless)
+    assert not needs_encoding(RLELossless, DeflatedExplicitVRLittleEndian)
+
+
+def test_compressed_files_are_streamed_with_an_output_encoding(rle_file, tmp_path, monkeypatch):
+    calls = []
+    anonymize = anonymize_dicom.anonymize
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs.get('streaming', False))
+        return anonymize(*args, **kwargs)
+
+    monkeypatch.setattr(anonymize_dicom, 'anonymize', spy)
+    output = tmp_path / 'out.dcm'
+    profile = build_profile(output_syntax='deflated')
+    anonymize_dicom.anonymize(str(rle_file), str(output), profile=profile, streaming=True)
+
+    # The file is not re-encoded, so it is not loaded in memory by a second call without streaming
+    assert calls == [True]
+    ds = pydicom.dcmread(output)
+    assert ds.file_meta.TransferSyntaxUID == RLELossless
+    assert ds.PixelData == pydicom.dcmread(rle_file).PixelData
@@ -0,0 +1,88 @@
+"""
+Tests of the upload merge: the indexed join of update_data_editor() against the row-by-row implementation it
+replaced (legacy_update_data_editor() of benchmarks.bench_merge), and of the pages of the table of cases.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app_settings.config import update_tags
+from benchmarks.bench_merge import (create_mapping, legacy_check_empty_cols, legacy_check_unmatched_rows,
+                                    legacy_update_data_editor)
+from ui_utils.ui_logic import check_empty_cols, check_unmatched_rows, find_conflicting_keys, page_of, update_data_editor
+
+UPDATE_TAGS = {'PatientName': '', 'PatientID': '', 'AccessionNumber': ''}
+
+
+def editor(patient_ids: list) -> pd.DataFrame:
+    edit_df = pd.DataFrame({
+        'PatientName': [f'Name{i}' for i in range(len(patient_ids))],
+        'PatientID': patient_ids,
+        'AccessionNumber': [f'ACC{i}' for i in range(len(patient_ids))],
+    }, index=[f'PK{i}' for i in range(len(patient_ids))])
+    for tag in UPDATE_TAGS:
+        edit_df[f'Update_{tag}'] = ''
+    return edit_df
+
+
+def upload(patient_ids: list, suffix: str = '') -> pd.DataFrame:
+    upload_df = pd.DataFrame({'PatientID': patient_ids})
+    for tag in UPDATE_TAGS:
+        upload_df[f'Update_{tag}'] = [f'{tag}{i}{suffix}' for i in range(len(patient_ids))]
+    return upload_df
+
+
+def assert_same_merge(edit_df: pd.DataFrame, upload_df: pd.DataFrame):
+    expected = legacy_update_data_editor(edit_df.copy(), upload_df, UPDATE_TAGS)
+    result = update_data_editor(edit_df.copy(), upload_df, UPDATE_TAGS)
+    pd.testing.assert_frame_equal(result, expected)
+    return result
+
+
+def test_merge_matches_every_row():
+    result = assert_same_merge(editor(['A', 'B', 'C']), upload(['C', 'A', 'B']))
+    assert result['Update_PatientID'].tolist() == ['PatientID1', 'PatientID2', 'PatientID0']
+
+
+def test_duplicated_key_in_editor_updates_first_row_only():
+    # A patient with several studies: only the first case gets the values, as before
+    result = assert_same_merge(editor(['A', 'A', 'B']), upload(['A', 'B']))
+    assert result['Update_PatientID'].tolist() == ['PatientID0', '', 'PatientID1']
+
+
+def test_duplicated_key_in_upload_applies_last_row():
+    result = assert_same_merge(editor(['A', 'B']), upload(['A', 'B', 'A']))
+    assert result.loc['PK0', 'Update_PatientID'] == 'PatientID2'
+    assert find_conflicting_keys(upload(['A', 'B', 'A']), UPDATE_TAGS) == ['A']
+
+
+def test_nan_keys_are_never_matched():
+    result = assert_same_merge(editor(['A', np.nan, 'B']), upload([np.nan, 'B', 'A']))
+    assert result['Update_PatientID'].tolist() == ['PatientID2', '', 'PatientID1']
+
+
+def test_no_match_leaves_editor_unchanged():
+    edit_df = editor(['A', 'B'])
+    result = assert_same_merge(edit_df, upload(['X', 'Y']))
+    pd.testing.assert_frame_equal(result, edit_df)
+
+
+# The row-by-row baseline is quadratic (about 20 minutes at 100k rows), so the 100k-row mapping is only run with --runslow
+@pytest.mark.parametrize('rows, seed', [(2000, 0), (2000, 1), pytest.param(100_000, 0, marks=pytest.mark.slow)])
+def test_synthetic_mapping_matches_legacy(rows, seed):
+    # Duplicated, conflicting, missing and unmatched keys, with the update_tags of the config
+    edit_df, upload_df = create_mapping(rows, seed=seed)
+    expected = legacy_update_data_editor(edit_df.copy(), upload_df, update_tags)
+    result = update_data_editor(edit_df.copy(), upload_df, update_tags)
+    pd.testing.assert_frame_equal(result, expected)
+    assert check_unmatched_rows(upload_df, result, 'PatientID') == legacy_check_unmatched_rows(upload_df, result, 'PatientID')
+    assert check_empty_cols(result, update_tags) == legacy_check_empty_cols(result, update_tags)
+
+
+def test_pages_cover_every_row_once():
+    edit_df = editor([f'P{i}' for i in range(25)])
+    pages = [page_of(edit_df, page, 10) for page in range(1, 4)]
+    assert [len(page) for page in pages] == [10, 10, 5]
+    pd.testing.assert_frame_equal(pd.concat(pages), edit_df)
+    assert pages[1].index[0] == 'PK10'
+    assert page_of(edit_df, 4, 10).empty
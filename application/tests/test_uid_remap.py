@@ -0,0 +1,38 @@
+"""
+Tests of the remapping of the UIDs and of the pseudonyms of the identifiers.
+"""
+import pytest
+from pydicom.tag import Tag
+
+from anonymizer_utils.anonymization_profile import build_profile
+from anonymizer_utils.uid_remap import DEFAULT_UID_TAGS, UIDRemapper, store_secret
+
+
+def test_same_secret_gives_same_values(tmp_path):
+    with UIDRemapper(str(tmp_path / 'a.sqlite'), secret='s') as a, UIDRemapper(str(tmp_path / 'b.sqlite'), secret='s') as b:
+        assert a.remap('1.2.3') == b.remap('1.2.3') != '1.2.3'
+        assert a.pseudonym('PatientID', 'P1') == b.pseudonym('PatientID', 'P1')
+        assert a.pseudonym('PatientID', '') == ''
+
+
+def test_recorded_values_are_kept(tmp_path):
+    store = str(tmp_path / 'uid_map.sqlite')
+    with UIDRemapper(store) as remapper:
+        uid = remapper.remap('1.2.3')
+        assert remapper.remap('1.2.4') != uid
+    with UIDRemapper(store) as remapper:
+        assert remapper.remap('1.2.3') == uid
+
+
+def test_store_keeps_its_secret(tmp_path):
+    store = str(tmp_path / 'uid_map.sqlite')
+    secret = store_secret(store)
+    assert store_secret(store) == store_secret(store, secret) == secret
+    with pytest.raises(ValueError):
+        store_secret(store, 'another secret')
+
+
+def test_true_remaps_the_default_tags(tmp_path):
+    profile = build_profile(remap_uids=True, uid_store=str(tmp_path / 'uid_map.sqlite'))
+    assert profile.remap_uids == frozenset(Tag(t) for t in DEFAULT_UID_TAGS)
+    assert build_profile().remap_uids == frozenset()
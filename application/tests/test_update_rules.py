@@ -0,0 +1,81 @@
+"""
+Tests of the rules of update_tags: the column operations of every rule against the Python code per value they
+replaced, with missing values and invalid dates.
+"""
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from anonymizer_utils.uid_remap import UIDRemapper
+from anonymizer_utils.update_rules import default_values
+
+IDS = ['PXH12345', 'ab-12', np.nan, '', '12345', 'PXH12345', 'pxh9']
+DATES = ['19700101', '20240229', '20230229', '20241301', 'not a date', np.nan, '', '19700101']
+
+
+def new_values(rule, values: list, **columns) -> list:
+    frame = pd.DataFrame({'Tag': values, **columns})
+    return default_values(frame, {'Tag': rule})['Tag'].tolist()
+
+
+def original(value) -> str:
+    return '' if pd.isna(value) else value
+
+
+@pytest.mark.parametrize('pattern, repl, count', [
+    (r'^[a-zA-Z]+', '', 0),
+    (r'\d', '#', 2),
+    # A lookahead is not supported by Arrow, the values are replaced by Python
+    (r'\d(?=\d{3})', '*', 0),
+])
+def test_regex_replace_is_re_sub(pattern, repl, count):
+    rule = {'rule': 'regex_replace', 'pattern': pattern, 'repl': repl, 'count': count}
+    assert new_values(rule, IDS) == [re.sub(pattern, repl, original(value), count=count) for value in IDS]
+
+
+def test_strip_prefix_is_removeprefix():
+    rule = {'rule': 'strip_prefix', 'prefix': 'PXH'}
+    assert new_values(rule, IDS) == [original(value).removeprefix('PXH') for value in IDS]
+
+
+@pytest.mark.parametrize('days', [-365, 0, 30])
+def test_date_shift_is_timedelta(days):
+    def shift(value):
+        try:
+            return (datetime.strptime(original(value), '%Y%m%d') + timedelta(days=days)).strftime('%Y%m%d')
+        except ValueError:
+            return ''
+
+    assert new_values({'rule': 'date_shift', 'days': days}, DATES) == [shift(value) for value in DATES]
+
+
+def test_steps_are_applied_in_order():
+    rules = [{'rule': 'strip_prefix', 'prefix': 'PXH'}, {'rule': 'regex_replace', 'pattern': r'^\d', 'repl': 'X'}]
+    assert new_values(rules, IDS) == [re.sub(r'^\d', 'X', original(value).removeprefix('PXH')) for value in IDS]
+
+
+def test_format_is_str_format():
+    sexes = ['F', 'M', 'O', np.nan, 'F', 'M', 'O']
+    assert new_values({'rule': 'format', 'format': '{PatientSex}-{value}'}, IDS, PatientSex=sexes) == [
+        f'{original(sex)}-{original(value)}' for sex, value in zip(sexes, IDS)
+    ]
+    assert new_values({'rule': 'format', 'format': 'CASE{index:05d}'}, IDS) == [
+        'CASE{:05d}'.format(i) for i in range(1, len(IDS) + 1)
+    ]
+
+
+def test_pseudonyms_are_recorded_in_the_store(tmp_path):
+    store = str(tmp_path / 'uid_map.sqlite')
+    rule = {'rule': 'pseudonym', 'prefix': 'PAT', 'length': 8, 'store': store}
+    values = new_values(rule, IDS)
+
+    with UIDRemapper(store) as remapper:
+        assert values == [remapper.pseudonym('Tag', original(value), 'PAT', 8) for value in IDS]
+    assert values[2] == values[3] == ''
+    assert values[0] == values[5] and len(set(values)) == 5
+    assert all(re.fullmatch('PAT[0-9A-F]{8}', value, re.IGNORECASE) for value in values if value)
+    # The next template gets the same pseudonyms
+    assert new_values(rule, IDS) == values
@@ -0,0 +1,109 @@
+"""
+Tests of the verification of the anonymized files: the matcher of the identifiers, the scan of the datasets,
+the reading of the archive members and the log of the command line interface.
+"""
+import shutil
+import tarfile
+import zipfile
+from io import BytesIO
+
+import pydicom
+import pytest
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+
+import anonymize_cli
+from anonymizer_utils.archive_sink import MEMBER_SEPARATOR
+from anonymizer_utils.verify import build_matcher, read_outputs, scan_dataset
+from benchmarks.synthetic import generate_corpus
+
+
+def encode(ds: Dataset) -> Dataset:
+    """
+    Writes and reads back a dataset, so that its elements are raw as in the output files.
+    """
+    buffer = BytesIO()
+    pydicom.dcmwrite(buffer, ds, implicit_vr=True, little_endian=True)
+    buffer.seek(0)
+    return pydicom.dcmread(buffer, force=True, defer_size=1024)
+
+
+def leaked_tags(ds: Dataset, identifiers: list) -> dict:
+    return {location: identifier for location, _, _, _, identifier in scan_dataset(encode(ds), build_matcher(identifiers))}
+
+
+def test_private_tags_are_checked():
+    ds = Dataset()
+    ds.PatientID = 'CASE1'
+    block = ds.private_block(0x0011, 'ACME', create=True)
+    block.add_new(0x01, 'LO', 'Doe^John')
+    # The private tag is read as UN in implicit VR
+    assert leaked_tags(ds, ['doe']) == {'(0011,1001)': 'doe'}
+
+
+def test_nested_sequences_are_checked():
+    reference = Dataset()
+    reference.ReferencedSOPInstanceUID = '1.2.3'
+    reference.PatientID = 'P0000042'
+    item = Dataset()
+    item.ReferencedImageSequence = Sequence([reference])
+    ds = Dataset()
+    ds.SourceImageSequence = Sequence([Dataset(), item])
+    assert leaked_tags(ds, ['p0000042']) == {'(0008,2112)[1].(0008,1140)[0].(0010,0020)': 'p0000042'}
+
+
+def test_latin1_values_are_matched():
+    ds = Dataset()
+    ds.SpecificCharacterSet = 'ISO_IR 100'
+    ds.PatientComments = 'Patient Müller'
+    ds.StudyDescription = 'Muller'
+    assert leaked_tags(ds, ['müller']) == {'(0010,4000)': 'müller'}
+
+
+def test_identifiers_do_not_match_inside_uids_or_words():
+    ds = Dataset()
+    ds.StudyInstanceUID = '1.2.840.12345.6'
+    ds.SeriesInstanceUID = '1.2.12345'
+    ds.StudyDescription = 'CT12345X'
+    ds.PatientID = '12345'
+    assert leaked_tags(ds, ['12345']) == {'(0010,0020)': '12345'}
+    assert build_matcher([]) is None
+
+
+@pytest.mark.parametrize('suffix', ['.zip', '.tar', '.tar.gz'])
+def test_archive_members_are_read(tmp_path, suffix):
+    archive = tmp_path / f'folder-Anonymized-000{suffix}'
+    members = {'P1/SE001/IM00001.dcm': b'first', 'P1/SE001/IM00002.dcm': b'second'}
+    if suffix == '.zip':
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for name, content in members.items():
+                zf.writestr(name, content)
+    else:
+        with tarfile.open(archive, 'w:gz' if suffix == '.tar.gz' else 'w') as tf:
+            for name, content in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tf.addfile(info, BytesIO(content))
+
+    plain = str(tmp_path / 'IM00003.dcm')
+    locations = [f'{archive}{MEMBER_SEPARATOR}{name}' for name in [*members, 'P1/SE001/missing.dcm']] + [plain]
+    outputs = dict(read_outputs(locations))
+    assert outputs[locations[0]] == b'first'
+    assert outputs[locations[1]] == b'second'
+    assert isinstance(outputs[locations[2]], KeyError)
+    assert outputs[plain] == plain
+
+
+def test_leak_lines_leave_out_the_identifiers(tmp_path, capsys):
+    folder = tmp_path / 'folder'
+    generate_corpus(str(folder), patients=1, studies=1, series=1, slices=2, rows=8, columns=8)
+    # The original files are left as they are
+    shutil.copytree(folder, tmp_path / 'folder-Anonymized')
+    config = tmp_path / 'config.py'
+    config.write_text('scan_cache = False\n')
+
+    code = anonymize_cli.main(['verify', str(folder), '--fformat', 'dcm', '--config', str(config), '--quiet'])
+    assert code == anonymize_cli.EXIT_FAILURES
+    lines = [line for line in capsys.readouterr().err.splitlines() if line.startswith('LEAK ')]
+    assert lines and not any('"' in line for line in lines)
+    assert not any('synthetic' in line.lower() or 'patient00000' in line.lower() for line in lines)
@@ -0,0 +1,92 @@
+"""
+Tests of the watch command of the command line interface on a synthetic drop folder, polled a few times.
+"""
+import pandas as pd
+import pytest
+
+import anonymize_cli
+from benchmarks.synthetic import generate_corpus
+
+
+@pytest.fixture
+def drop_folder(tmp_path):
+    folder = tmp_path / 'drop'
+    generate_corpus(str(folder), patients=3, studies=1, series=1, slices=2, rows=8, columns=8)
+    config = tmp_path / 'config.py'
+    config.write_text(f'scan_cache_dir = {str(tmp_path / "cache")!r}\nuid_store = {str(tmp_path / "uid_map.sqlite")!r}\n'
+                      f'verify_output = False\n')
+    scan_args = [str(folder), '--fformat', 'dcm', '--config', str(config), '--quiet']
+    assert anonymize_cli.main(['template', *scan_args, '--out', str(tmp_path / 'mapping.csv')]) == anonymize_cli.EXIT_OK
+    mapping = pd.read_csv(tmp_path / 'mapping.csv', dtype=str).fillna('')
+    mapping['Update_PatientName'] = [f'CASE{i}' for i in range(len(mapping))]
+    mapping['Update_PatientID'] = mapping['Update_PatientName']
+    mapping['Update_InstitutionName'] = 'XX'
+    return folder, scan_args, mapping
+
+
+def watch(monkeypatch, args: list, between_polls: list) -> tuple:
+    """
+    Runs the watch command, calling the functions of between_polls after the polls, and stops after the last one.
+
+    Returns:
+        tuple: The exit code, and the numbers of files given to anonymize_batch() at every poll.
+    """
+    batches = []
+    anonymize_batch = anonymize_cli.anonymize_batch
+
+    def count_batch(folder, manifest, *batch_args, **kwargs):
+        batches.append(len(manifest))
+        return anonymize_batch(folder, manifest, *batch_args, **kwargs)
+
+    steps = iter(between_polls)
+
+    def sleep(seconds):
+        step = next(steps, None)
+        if step is None:
+            raise KeyboardInterrupt
+        step()
+
+    monkeypatch.setattr(anonymize_cli, 'anonymize_batch', count_batch)
+    monkeypatch.setattr(anonymize_cli.time, 'sleep', sleep)
+    return anonymize_cli.main(['watch', *args, '--settle', '0', '--interval', '0']), batches
+
+
+def test_invalid_mapping_keeps_the_previous_one(drop_folder, monkeypatch, tmp_path, capsys):
+    folder, scan_args, mapping = drop_folder
+    path = tmp_path / 'mapping.csv'
+    mapping.iloc[:2].to_csv(path, index=False)
+
+    code, batches = watch(monkeypatch, [*scan_args, '--mapping', str(path)], [
+        lambda: path.write_text('PatientID\nP1\n'),          # columns are missing
+        lambda: mapping.to_csv(path, index=False),            # the third case is added
+    ])
+    assert code == anonymize_cli.EXIT_OK
+    assert 'The previous mapping sheet is kept.' in capsys.readouterr().err
+    # The third case waits for a valid sheet with its row
+    assert batches == [4, 2]
+
+
+def test_folders_with_failed_files_are_retried(drop_folder, monkeypatch, tmp_path, capsys):
+    folder, scan_args, mapping = drop_folder
+    mapping.to_csv(tmp_path / 'mapping.csv', index=False)
+    series = sorted(folder.glob('*/SE001'))[0]
+    (series / 'junk.dcm').write_bytes(b'not a dicom file')
+
+    polls = [lambda: None] * 4 + [lambda: (series / 'junk.dcm').write_bytes(b'still not a dicom file')]
+    code, batches = watch(monkeypatch, [*scan_args, '--mapping', str(tmp_path / 'mapping.csv'), '--max-attempts', '2'], polls)
+    assert code == anonymize_cli.EXIT_FAILURES
+    # The folder of the junk file is retried once (the journal skips its other files), then only after it changed
+    assert batches == [7, 3, 3]
+    assert capsys.readouterr().err.count('GAVE UP') == 1
+
+
+def test_empty_values_of_matched_cases_are_errors(drop_folder, monkeypatch, tmp_path, capsys):
+    folder, scan_args, mapping = drop_folder
+    # The third case has no row yet, and the second one has an empty pseudonym
+    mapping.loc[1, 'Update_PatientName'] = ''
+    mapping.iloc[:2].to_csv(tmp_path / 'mapping.csv', index=False)
+
+    code, batches = watch(monkeypatch, [*scan_args, '--mapping', str(tmp_path / 'mapping.csv')], [])
+    assert code == anonymize_cli.EXIT_OK
+    assert batches == []
+    assert 'empty values in the following columns: Update_PatientName' in capsys.readouterr().err
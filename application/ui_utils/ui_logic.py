@@ -1,50 +1,104 @@
+import numpy as np
 import pandas as pd
 
+from anonymizer_utils.update_rules import default_values
+
 def create_update_cols(udf: pd.DataFrame, update_tags: dict) -> pd.DataFrame: 
     """
     Create new columns in udf for updating values of the defined DICOM tags. 
     
     Args:
         udf (pd.DataFrame): DataFrame of uniquely identified cases.
-        update_tags (dict): Keys represent the DICOM tags to be updated, values represent the rules of creating default values. 
+        update_tags (dict): Keys represent the DICOM tags to be updated, values represent the rules of creating default values 
+            (see anonymizer_utils.update_rules). 
     
     Returns: 
         pd.DataFrame: The modified udf with columns in default values.
+    
+    Raises: 
+        ValueError: If a rule of update_tags is invalid.
     """
-    for tag, rule in update_tags.items():
-        if callable(rule): 
-            udf[f'Update_{tag}'] = udf[tag].apply(rule)
-        else: 
-            udf[f'Update_{tag}'] = rule
+    for tag, values in default_values(udf, update_tags).items():
+        udf[f'Update_{tag}'] = values
     return udf
             
 
-def update_data_editor(edit_df: pd.DataFrame, upload_df: pd.DataFrame, update_tags: dict) -> pd.DataFrame:
+def template_csv(edit_df: pd.DataFrame) -> bytes: 
+    """
+    Converts the data editor into the CSV template to be downloaded. 
+    
+    Args:
+        edit_df (pd.DataFrame): The data editor with the "Update_" columns.
+    
+    Returns: 
+        bytes: The CSV file, encoded in UTF-8.
+    """
+    return edit_df.reset_index(drop=True).to_csv(index=False).encode('utf-8')
+
+def page_of(df: pd.DataFrame, page: int, page_size: int) -> pd.DataFrame: 
+    """
+    Selects a page of rows, so that only the rows shown are sent to the browser. 
+    
+    Args:
+        df (pd.DataFrame): The DataFrame to be shown.
+        page (int): The page number, from 1.
+        page_size (int): The number of rows per page.
+    
+    Returns: 
+        pd.DataFrame: The rows of the page.
+    """
+    return df.iloc[(page - 1) * page_size:page * page_size]
+
+def update_data_editor(edit_df: pd.DataFrame, upload_df: pd.DataFrame, update_tags: dict, key: str = 'PatientID') -> pd.DataFrame:
     """
     Updates the specified columns in an existing DataFrame (edit_df) with values from an uploaded DataFrame (upload_df). 
+    
+    The rows are matched by an indexed join on key. As before, when key is duplicated in upload_df the last row is applied, 
+    and when key is duplicated in edit_df only the first matching row is updated.
 
     Args:
         edit_df (pd.DataFrame): DataFrame containing the original data to be updated.
         upload_df (pd.DataFrame): DataFrame with new values to apply to matching rows.
         update_tags (dict): Column tags to update in the edit_df.
+        key (str): The column used to match the rows of both DataFrames.
 
     Returns:
         pd.DataFrame: The modified edit_df with updated values where matches were found.
     """
-    for _, row_udf in upload_df.iterrows():
-    # Check if the current row_udf matches the edit_df
-        matching_row = edit_df[(edit_df['PatientID'] == row_udf['PatientID'])]
+    cols = [f'Update_{tag}' for tag in update_tags]
+    latest = upload_df.drop_duplicates(subset=key, keep='last').set_index(key)[cols]
     
-        # Update only if row_udf matches
-        if not matching_row.empty:
-            idx = matching_row.index[0]  # Get the index of the matching row_udf
-            
-            for tag, _ in update_tags.items(): 
-                col = f'Update_{tag}'   
-                edit_df.at[idx, col] = row_udf[col]
-        
+    # Positions of the first row of each key in edit_df which has a match in upload_df
+    first_rows = edit_df[key].notna() & ~edit_df[key].duplicated(keep='first')
+    positions = np.flatnonzero(first_rows & edit_df[key].isin(latest.index))
+    if len(positions) == 0: 
+        return edit_df
+
+    values = latest.loc[edit_df[key].iloc[positions]]
+    for col in cols: 
+        edit_df.iloc[positions, edit_df.columns.get_loc(col)] = values[col].to_numpy()
     return edit_df
 
+def find_conflicting_keys(upload_df: pd.DataFrame, update_tags: dict, key: str = 'PatientID') -> list:
+    """
+    Finds the keys which appear in several rows of upload_df with different values in the "Update_" columns. 
+    Only the last of these rows is applied by update_data_editor().
+
+    Args:
+        upload_df (pd.DataFrame): The DataFrame uploaded by the user.
+        update_tags (dict): The dictionary of DICOM tags to be updated.
+        key (str): The column used to match the rows.
+
+    Returns:
+        list: A list of conflicting keys.
+    """
+    cols = [col for col in (f'Update_{tag}' for tag in update_tags) if col in upload_df]
+    duplicated = upload_df[upload_df[key].duplicated(keep=False)]
+    if duplicated.empty: 
+        return []
+    n_values = duplicated[[key] + cols].drop_duplicates().groupby(key, sort=False).size()
+    return n_values[n_values > 1].index.tolist()
+
 def check_unmatched_rows(upload_df: pd.DataFrame, edit_df: pd.DataFrame, upload_df_id: str) -> list:
     """
     Checks for identifier in the edit_df that are not present in the upload_df.
@@ -57,8 +111,8 @@ def check_unmatched_rows(upload_df: pd.DataFrame, edit_df: pd.DataFrame, upload_
     Returns:
         list: A list of unmatched PatientIDs.
     """
-    unmatched_patient_ids = edit_df[~edit_df[f'{upload_df_id}'].isin(upload_df[f'{upload_df_id}']) & 
-                                      ~edit_df[f'{upload_df_id}'].isin(upload_df[f'Update_{upload_df_id}'])]
+    known_ids = pd.Index(upload_df[f'{upload_df_id}']).union(pd.Index(upload_df[f'Update_{upload_df_id}']))
+    unmatched_patient_ids = edit_df[~edit_df[f'{upload_df_id}'].isin(known_ids)]
     return unmatched_patient_ids[f'{upload_df_id}'].unique().tolist()
 
 def check_empty_cols(edit_df: pd.DataFrame, update_tags: dict) -> list:
@@ -73,11 +127,10 @@ def check_empty_cols(edit_df: pd.DataFrame, update_tags: dict) -> list:
         list: A list of string, representing the name of empty columns. 
 
     """
-    empty_col = []
-    for tag, _ in update_tags.items():
-        if edit_df[f'Update_{tag}'].isnull().any() or (edit_df[f'Update_{tag}'] == '').any(): 
-            empty_col.append(f'Update_{tag}')
-    return empty_col
+    cols = [f'Update_{tag}' for tag in update_tags]
+    update_df = edit_df[cols]
+    is_empty = update_df.isnull().any() | update_df.eq('').any()
+    return is_empty[is_empty].index.tolist()
 
 def validate_upload(edit_df: pd.DataFrame, upload_df: pd.DataFrame, update_tags: dict, upload_df_id: str):
     """
@@ -1,10 +1,44 @@
 import streamlit as st
 import json
-import pandas as pd
+from pathlib import Path
 
-from anonymizer_utils.anonymize_dicom import *
-from ui_utils.ui_logic import *
-from app_settings.config import unique_ids, ref_tags, update_tags, upload_df_id, tags_2_anon, tags_2_spare, new_tags
+from anonymizer_utils.instrumentation import Metrics, create_metrics, metrics_path
+from app_settings.config import unique_ids, ref_tags, update_tags, upload_df_id, tags_2_anon, tags_2_spare, new_tags, max_workers, chunk_size, io_threads, output_archive, archive_shard_mb, archive_compress, scan_workers, journal_hash, streaming_threshold, verify_output, duplicate_mode, page_size, plan_sample_files, pixel_masks, output_transfer_syntax, profiling, scan_cache, scan_cache_dir, scan_cache_max_mb, remap_uids, uid_prefix, pseudonym_tags, uid_store, uid_secret
+
+def display_metrics(metrics: Metrics): 
+    """
+    Displays a summary panel of the metrics of a run, with the profile report and a CSV download.
+    
+    Args:
+        metrics (Metrics): The metrics of the run.
+    """
+    with st.expander(':stopwatch: **Run metrics**'): 
+        import pandas as pd
+        summary = pd.DataFrame(metrics.summary(), columns=['metric', 'name', 'value'])
+        st.dataframe(summary, use_container_width=True, hide_index=True)
+        if metrics.profile_report: 
+            st.code(metrics.profile_report)
+        st.download_button(
+            label='Download metrics as CSV', 
+            data=summary.to_csv(index=False).encode('utf-8'), 
+            file_name='metrics.csv'
+        )
+
+def display_plan(plan): 
+    """
+    Displays the predictions of a run, with the warnings and the details per number of workers and per modality.
+    
+    Args:
+        plan (RunPlan): The plan from plan_run().
+    """
+    st.info(f':crystal_ball: Plan: {plan.summary()}.')
+    for warning in plan.warnings: 
+        st.warning(f':warning: {warning}')
+    with st.expander(':crystal_ball: **Run plan**'): 
+        st.dataframe(plan.table(), use_container_width=True, hide_index=True)
+        st.dataframe(plan.modalities, use_container_width=True, hide_index=True)
+        st.caption(f'Extrapolated from {plan.sample_files} files in {plan.strata} strata (subfolders and file sizes). '
+                   f'Set `max_workers` and `streaming_threshold` in `app_settings/config.py` to follow the recommendation.')
 
 def streamlit_app(): 
     # Initialize session states
@@ -16,6 +50,8 @@ def streamlit_app():
         st.session_state['user_fformat'] = ''
     if 'fformat' not in st.session_state:           # file extension to glob
         st.session_state['fformat'] = ''
+    if 'manifest' not in st.session_state:          # all files found in the folder
+        st.session_state['manifest'] = None 
     if 'dcm_info' not in st.session_state:          # all dcm files
         st.session_state['dcm_info'] = None 
     if 'uids' not in st.session_state:              # list of unique IDs
@@ -24,6 +60,16 @@ def streamlit_app():
         st.session_state['edit_df'] = None
     if 'uploader_key' not in st.session_state:      # key (instance) of file_uploader
         st.session_state['uploader_key'] = 0
+    if 'template' not in st.session_state:          # data editor with the default values, created once per fetch
+        st.session_state['template'] = None
+    if 'template_csv' not in st.session_state:      # (uploaded file, CSV template) prepared for download
+        st.session_state['template_csv'] = None
+    if 'scan_metrics' not in st.session_state:      # metrics of fetching files
+        st.session_state['scan_metrics'] = None
+    if 'force_rescan' not in st.session_state:      # ignore the scan cache in the next fetch
+        st.session_state['force_rescan'] = False
+    if 'plan' not in st.session_state:              # (output encoding, plan of the run) of the fetched files
+        st.session_state['plan'] = None
 
     # Page user interface
     st.set_page_config(page_title = 'DICOM Anonymizer')
@@ -34,7 +80,6 @@ def streamlit_app():
         st.markdown(
             f'''
             ### Folder Preparation
-            - :red[Large Folders]: If your folder contains more than 10,000 DICOM files, consider splitting it into smaller batches to optimize processing time.
             - :red[Scan Position]: It is recommended to include only one body part scanned per folder for consistency.
             
             ### Modification of DICOM Tag values
@@ -54,9 +99,33 @@ def streamlit_app():
             
             ### Folder Output
             - The anonymized files will be saved in a new folder named `"[your file path]-Anonymized"`. For example, if you file path is `"C:/Documents/dicom"`, the destination will be `"C:/Documents/dicom-Anonymized"`.
+            - :red[Resuming]: The status of every file is recorded in `"[your file path]-Anonymized.journal.sqlite"`. When you anonymize the same folder again, files which are unchanged since the previous run are skipped.
+            - :red[Archives]: Set `output_archive = 'zip'` (or `'tar'`) in `app_settings/config.py` to write the anonymized files into archives `"[your file path]-Anonymized-000.zip"`, `-001.zip`, ... of at most `archive_shard_mb` each instead of a folder. The file `"[your file path]-Anonymized.index.csv"` maps the original files and series to the archive members.
+            - :red[Output encoding]: Select an output encoding (default: `output_transfer_syntax` in `app_settings/config.py`) to re-encode the anonymized files losslessly while they are anonymized, e.g. uncompressed CT series written to a share or sent over a slow link. `Deflated` and `RLE Lossless` need no codec, JPEG-LS and JPEG 2000 are listed when their codec is installed. Files which are already compressed are kept as they are.
+            - :red[Burned-in annotations]: Set `pixel_masks` in `app_settings/config.py` to blank regions of the pixels (e.g. the patient name of ultrasound images) in the files of a modality, manufacturer or image size. Only the pixels of these files are decoded, and they are written uncompressed.
+            - :red[Linking exports]: Set `remap_uids` in `app_settings/config.py` to replace the study, series and instance UIDs by new UIDs, and `pseudonym_tags` to pre-fill the template with pseudonyms (e.g. of the Patient ID). The same original value always gets the same new value, as recorded in `"~/.dicom_anonymizer/uid_map.sqlite"`, so that later exports of a patient can be linked. Keep this file private, it links the new values to the original ones.
+            - :red[Duplicates]: Set `duplicate_mode` in `app_settings/config.py` to anonymize once the files with the same SOPInstanceUID and content, e.g. a series exported twice. Their copies are recorded in the journal and either not written (`'skip'`) or hard-linked to the anonymized file (`'link'`).
+            - :red[Verification]: After every run, the anonymized files are checked for the original {", ".join(unique_ids)} in every text element, including private tags and nested sequences. Leftovers are listed in `"[your file path]-Anonymized.leaks.csv"`.
+            - :red[Planning]: Click `Plan the run` to anonymize a sample of the files first and predict the time of the run for each number of workers, the size of the anonymized files and the memory needed, with a warning when the disk is too small. The prediction is checked against the run afterwards.
+            - :red[Scan cache]: The results of fetching files are kept in `"~/.dicom_anonymizer/scan_cache"`, so only the subfolders which changed since the last fetch are read again. Tick `Force rescan` to read every file again.
 
             '''
         )
+
+    # pandas, pydicom and the anonymization modules are imported once the page is drawn, so that it appears immediately
+    import pandas as pd
+    from anonymizer_utils.anonymization_profile import build_profile
+    from anonymizer_utils.anonymize_dicom import create_dcm_df, create_jobs, create_manifest
+    from anonymizer_utils.archive_sink import ArchiveSink
+    from anonymizer_utils.dedup import duplicate_index, resolve_duplicates, split_duplicates
+    from anonymizer_utils.pipeline import anonymize_pipelined
+    from anonymizer_utils.planner import compare_plan, plan_run
+    from anonymizer_utils.run_journal import RunJournal, journal_path, journal_secret
+    from anonymizer_utils.scan_cache import cached_scan
+    from anonymizer_utils.transcode import OUTPUT_SYNTAXES, available_syntaxes, encoding_summary
+    from anonymizer_utils.uid_remap import check_uid_store, with_pseudonyms
+    from anonymizer_utils.verify import collect_identifiers, leak_report_path, verify_outputs
+    from ui_utils.ui_logic import create_update_cols, find_conflicting_keys, page_of, template_csv, update_data_editor, validate_upload
     
     # Capture user's input of folder directory
     user_folder = st.text_input(
@@ -68,9 +137,17 @@ def streamlit_app():
         'File extension', 
         placeholder='e.g., "dcm"'
     )
+    force_rescan = st.checkbox(
+        'Force rescan', 
+        help='Read every file again instead of reusing the results of the last scan of this folder.'
+    )
 
     # When 'fetch' button is triggered, save user's inputs and reset last dcm_info in st.session_states
     if st.button('Fetch files', type='primary'): 
+        if force_rescan: 
+            st.session_state['dcm_info'] = None
+            st.session_state['force_rescan'] = True
+
         if not user_folder == st.session_state['user_folder']: 
             st.session_state['user_folder'] = user_folder
             st.session_state['folder'] = user_folder.replace('\\', '/')
@@ -94,14 +171,44 @@ def streamlit_app():
     else: 
         with st.spinner(text='Fetching files...'):
             try: 
-                st.session_state['dcm_info'] = create_dcm_df(
-                    folder=st.session_state['folder'], 
-                    fformat=st.session_state['fformat'], 
-                    unique_ids=unique_ids, 
-                    ref_tags=ref_tags, 
-                    new_tags=list(new_tags.keys())
-                )
+                scan_metrics = create_metrics(profiling)
+                with scan_metrics.capture('scan'): 
+                    if scan_cache: 
+                        st.session_state['manifest'], st.session_state['dcm_info'] = cached_scan(
+                            folder=st.session_state['folder'], 
+                            fformat=st.session_state['fformat'], 
+                            unique_ids=unique_ids, 
+                            ref_tags=ref_tags, 
+                            new_tags=list(new_tags.keys()), 
+                            cache_dir=scan_cache_dir, 
+                            max_bytes=scan_cache_max_mb * 1024 ** 2, 
+                            force=st.session_state['force_rescan'], 
+                            max_workers=scan_workers, 
+                            metrics=scan_metrics
+                        )
+                    else: 
+                        st.session_state['manifest'] = create_manifest(
+                            folder=st.session_state['folder'], 
+                            fformat=st.session_state['fformat'], 
+                            max_workers=scan_workers, 
+                            metrics=scan_metrics
+                        )
+                        st.session_state['dcm_info'] = create_dcm_df(
+                            folder=st.session_state['folder'], 
+                            fformat=st.session_state['fformat'], 
+                            unique_ids=unique_ids, 
+                            ref_tags=ref_tags, 
+                            new_tags=list(new_tags.keys()), 
+                            manifest=st.session_state['manifest'], 
+                            max_workers=scan_workers, 
+                            metrics=scan_metrics
+                        )
+                st.session_state['force_rescan'] = False
+                st.session_state['scan_metrics'] = scan_metrics
                 st.session_state['uids'] = st.session_state['dcm_info'][(unique_ids + ref_tags)].drop_duplicates()
+                st.session_state['template'] = None
+                st.session_state['template_csv'] = None
+                st.session_state['plan'] = None
             except: 
                 st.error(':warning: We cannot find any files in the file extension in the directory.')
 
@@ -111,7 +218,10 @@ def streamlit_app():
 
     # When files are found, display unique ID df
     else:     
-        edit_df = create_update_cols(st.session_state['uids'], update_tags)
+        # The default values are computed once per fetch, the reruns start from a copy
+        if st.session_state['template'] is None: 
+            st.session_state['template'] = create_update_cols(st.session_state['uids'].copy(), with_pseudonyms(update_tags, pseudonym_tags, uid_store, uid_secret))
+        edit_df = st.session_state['template'].copy()
         st.session_state['edit_df'] = edit_df
         
         st.success('''
@@ -176,25 +286,48 @@ def streamlit_app():
                     upload_df = upload_df.fillna('').astype(str)
                     try: 
                         edit_df = update_data_editor(st.session_state['edit_df'], upload_df, update_tags)
+                        conflicting_ids = find_conflicting_keys(upload_df, update_tags)
+                        if conflicting_ids: 
+                            upload_error.warning(f':warning: The following **PatientID** appear in several rows with different values, only the last row is applied - :blue[{", ".join(map(str, conflicting_ids))}].')
                     except Exception as e: 
                         upload_error.error(':warning: Error: Unable to read uploaded file. Please input your updates in the template and upload again.')
 
         # Save latest version of edit_df to session state
         st.session_state['edit_df'] = edit_df
         
-        display_data.dataframe(
-            st.session_state['edit_df'], 
-            use_container_width=True, 
-            hide_index=True
-        )
+        # Only a page of the cases is sent to the browser on every rerun
+        n_cases = len(st.session_state['edit_df'])
+        if n_cases > page_size: 
+            with display_data.container(): 
+                page = st.number_input(f'Page (of {-(-n_cases // page_size)})', min_value=1, max_value=-(-n_cases // page_size), value=1)
+                st.dataframe(page_of(st.session_state['edit_df'], page, page_size), use_container_width=True, hide_index=True)
+                st.caption(f'Cases {(page - 1) * page_size + 1:,} to {min(page * page_size, n_cases):,} of {n_cases:,}')
+        else: 
+            display_data.dataframe(
+                st.session_state['edit_df'], 
+                use_container_width=True, 
+                hide_index=True
+            )
 
-        # Download button for csv template (edit_df)
-        csv = st.session_state['edit_df'].reset_index(drop=True).to_csv(index=False).encode('utf-8')
-        download_function.download_button(
-            label='Download template as CSV', 
-            data=csv, 
-            file_name='unique_ids.csv'
-        )
+        # Download button for csv template (edit_df), which is only converted when requested for large templates
+        if n_cases <= page_size: 
+            download_function.download_button(
+                label='Download template as CSV', 
+                data=template_csv(st.session_state['edit_df']), 
+                file_name='unique_ids.csv'
+            )
+        else: 
+            template_version = None if upload_file is None else upload_file.file_id
+            if st.session_state['template_csv'] is None or st.session_state['template_csv'][0] != template_version: 
+                if download_function.button(f'Prepare template as CSV ({n_cases:,} cases)'): 
+                    with st.spinner(text='Preparing template...'): 
+                        st.session_state['template_csv'] = (template_version, template_csv(st.session_state['edit_df']))
+            if st.session_state['template_csv'] is not None and st.session_state['template_csv'][0] == template_version: 
+                download_function.download_button(
+                    label='Download template as CSV', 
+                    data=st.session_state['template_csv'][1], 
+                    file_name='unique_ids.csv'
+                )
         
         # Selectbox for selecting values for new tag
         tags_2_create = {}
@@ -210,31 +343,165 @@ def streamlit_app():
                 )
                 tags_2_create[dcm_tag] = create_new_tag.selectbox(f'Please select a value for DICOM Tag: `{dcm_tag}`.', options)
         
+        # Capture user's input to only retry the failures of the previous run
+        retry_failed = st.checkbox('Only retry the files which failed in the previous run')
+
+        # Capture user's input to re-encode the anonymized files, among the encoders installed
+        syntax_options = [None, *available_syntaxes()]
+        if output_transfer_syntax not in syntax_options: 
+            st.warning(f':warning: The encoder of `output_transfer_syntax = {output_transfer_syntax!r}` is not installed.')
+        output_syntax = st.selectbox(
+            'Output encoding', 
+            syntax_options, 
+            index=syntax_options.index(output_transfer_syntax) if output_transfer_syntax in syntax_options else 0, 
+            format_func=lambda name: 'Same as the input files' if name is None else OUTPUT_SYNTAXES[name].name
+        )
+
+        # Predict the run from a sample of the files, once per fetch and output encoding
+        if st.button('Plan the run'): 
+            with st.spinner(text=f'Anonymizing a sample of {plan_sample_files} files...'): 
+                if remap_uids: 
+                    check_uid_store(uid_store, uid_secret)
+                profile = build_profile(tags=tags_2_anon, tags_2_spare=tags_2_spare, tags_2_create=tags_2_create, 
+                                        remap_uids=remap_uids, uid_store=uid_store, uid_prefix=uid_prefix, 
+                                        pixel_masks=pixel_masks, output_syntax=output_syntax)
+                plan = plan_run(
+                    st.session_state['manifest'], 
+                    profile, 
+                    f"{st.session_state['folder']}-Anonymized", 
+                    max_workers=max_workers, 
+                    chunk_size=chunk_size, 
+                    io_threads=io_threads, 
+                    streaming_threshold=streaming_threshold, 
+                    sample_size=plan_sample_files
+                )
+                st.session_state['plan'] = (output_syntax, plan)
+        plan = st.session_state['plan'][1] if st.session_state['plan'] is not None and st.session_state['plan'][0] == output_syntax else None
+        if plan is not None: 
+            display_plan(plan)
+
         # Capture user's input to write anonymized files 
         if st.button("Anonymize files", type='primary'): 
             if upload_file is None: 
                 st.warning(':warning: Please upload a file as your inputs before file anonymization.')
             else:
-                anon_dcm_df = st.session_state['dcm_info'].copy().filter(like='dir', axis=1)
-                anon_dcm_df = anon_dcm_df.join(st.session_state['edit_df'].filter(like='Update_', axis=1))
-                
-                with st.spinner(text='Creating anonymized files...'): 
-                    for _, row in anon_dcm_df.iterrows():
-                        folder_dir = Path(row['folder_dir'])
-                        for file_dir in folder_dir.rglob(f"*.{st.session_state['fformat']}"):                        
-                            output_dir = f"{row['output_dir']}/{Path(file_dir).name}"
-                            update = consolidate_tags(row, update_tags)
-
-                            anonymize(
-                                file_dir=file_dir, 
-                                output_dir=output_dir, 
-                                tags=tags_2_anon,
-                                update=update,
-                                tags_2_spare=tags_2_spare, 
-                                tags_2_create=tags_2_create
-                            )
+                metrics = create_metrics(profiling)
+                if st.session_state['scan_metrics'] is not None: 
+                    metrics.merge(st.session_state['scan_metrics'].to_dict())
+
+                # The secret of the UID store also checks uid_secret, before any file is written
+                try: 
+                    secret = journal_secret(bool(remap_uids or pseudonym_tags), uid_store, uid_secret)
+                except ValueError as e: 
+                    st.error(f':warning: {e} Set `uid_secret` in `app_settings/config.py` to the secret of this store, or use another `uid_store`.')
+                    st.stop()
+
+                with st.spinner(text='Collecting files...'), metrics.stage('collect_jobs'): 
+                    if remap_uids: 
+                        check_uid_store(uid_store, uid_secret)
+                    profile = build_profile(tags=tags_2_anon, tags_2_spare=tags_2_spare, tags_2_create=tags_2_create, 
+                                            remap_uids=remap_uids, uid_store=uid_store, uid_prefix=uid_prefix, 
+                                            pixel_masks=pixel_masks, output_syntax=output_syntax)
+                    jobs = create_jobs(
+                        st.session_state['dcm_info'], 
+                        st.session_state['edit_df'], 
+                        st.session_state['manifest'], 
+                        update_tags, 
+                        profile, 
+                        streaming_threshold
+                    )
+
+                with RunJournal(journal_path(st.session_state['folder'])) as journal: 
+                    if secret is not None: 
+                        journal.record_mappings(st.session_state['edit_df'], unique_ids, secret)
+                    # Skip files which are unchanged since the previous run
+                    with metrics.stage('journal_filter'): 
+                        pending_jobs, job_keys = journal.filter_jobs(jobs, st.session_state['manifest'], only_failed=retry_failed, archive=output_archive)
+                    metrics.count('files_skipped', len(jobs) - len(pending_jobs))
+                    if len(pending_jobs) < len(jobs): 
+                        st.info(f':fast_forward: {len(jobs) - len(pending_jobs)} files are skipped as they are unchanged since the previous run.')
+
+                    # Anonymize the files with the same SOPInstanceUID and content once
+                    duplicates = []
+                    if duplicate_mode: 
+                        with st.spinner(text='Finding duplicates...'), metrics.stage('dedup'): 
+                            index = duplicate_index(st.session_state['manifest'], scan_workers, metrics)
+                            pending_jobs, duplicates = split_duplicates(jobs, pending_jobs, index)
+                        if duplicates: 
+                            st.info(f':busts_in_silhouette: {len(duplicates)} files are duplicates of other files, they are anonymized once.')
+
+                    # Anonymize files in parallel with a live progress bar, recording every finished chunk in the journal
+                    progress_bar = st.progress(0.0, text='Creating anonymized files...')
+                    sink = ArchiveSink(st.session_state['folder'], output_archive, archive_shard_mb * 1024 ** 2, archive_compress) if output_archive else None
+                    with metrics.stage('anonymize_wall'): 
+                        results = anonymize_pipelined(
+                            pending_jobs, 
+                            max_workers=max_workers, 
+                            chunk_size=chunk_size, 
+                            io_threads=io_threads, 
+                            progress_callback=lambda done, total: progress_bar.progress(done / total, text=f'Creating anonymized files... ({done}/{total})'), 
+                            result_callback=lambda chunk_results: journal.record(chunk_results, job_keys), 
+                            hash_inputs=journal_hash, 
+                            metrics=metrics, 
+                            sink=sink
+                        )
+                        if duplicates: 
+                            duplicate_results = resolve_duplicates(duplicates, journal.outputs(), duplicate_mode, sink, metrics)
+                            journal.record(duplicate_results, job_keys)
+                            results = results + duplicate_results
+                        if sink is not None: 
+                            sink.close()
+                            sink.write_index(results, st.session_state['manifest'])
+                    progress_bar.empty()
+
+                # Check that the anonymized files contain none of the original identifiers
+                if verify_output: 
+                    progress_bar = st.progress(0.0, text='Verifying anonymized files...')
+                    with metrics.stage('verify'): 
+                        leaks, unreadable = verify_outputs(
+                            list(dict.fromkeys(result['output_dir'] for result in results if result['error'] is None)), 
+                            collect_identifiers(st.session_state['dcm_info'], unique_ids), 
+                            max_workers=max_workers, 
+                            progress_callback=lambda done, total: progress_bar.progress(done / total, text=f'Verifying anonymized files... ({done}/{total})'), 
+                            metrics=metrics
+                        )
+                    progress_bar.empty()
+                    leaks.to_csv(leak_report_path(st.session_state['folder']), index=False)
+
+                # Export the metrics of the run and show the summary panel
+                metrics.collect_profiles()
+                metrics.export(metrics_path(st.session_state['folder']), folder=st.session_state['folder'], max_workers=max_workers)
+
+                # Report files which failed to be anonymized
+                failures = [result for result in results if result['error'] is not None]
+                if failures: 
+                    st.warning(f':warning: {len(failures)} of {len(results)} files could not be anonymized. Tick "Only retry the files which failed in the previous run" to retry them.')
+                    st.dataframe(pd.DataFrame(failures)[['file_dir', 'output_dir', 'error']], use_container_width=True, hide_index=True)
+
+                # Report original identifiers left in the anonymized files
+                if verify_output and len(leaks): 
+                    st.error(f':rotating_light: Original identifiers were found {len(leaks)} times in {leaks["output_dir"].nunique()} anonymized files. Add their DICOM tags to `tags_2_anon` in `app_settings/config.py`. The report is written in :blue[{leak_report_path(st.session_state["folder"])}].')
+                    st.dataframe(leaks, use_container_width=True, hide_index=True)
+                elif verify_output: 
+                    st.info(f':white_check_mark: Verified: the anonymized files contain none of the original {", ".join(unique_ids)}.')
+                if verify_output and len(unreadable): 
+                    st.warning(f':warning: {len(unreadable)} anonymized files could not be read for the verification.')
+                    st.dataframe(unreadable, use_container_width=True, hide_index=True)
             
-                st.write(f'''
-                        :star2: Anonymized files are written in:  
-                        :open_file_folder: :blue[{st.session_state['folder']}-Anonymized]
-                        ''')
\ No newline at end of file
+                if sink is not None: 
+                    st.write(f'''
+                            :star2: Anonymized files are written in:  
+                            :package: :blue[{', '.join(Path(shard).name for shard in sink.shards) or 'no new archive'}]  
+                            :card_index: :blue[{sink.index_path}]
+                            ''')
+                else: 
+                    st.write(f'''
+                            :star2: Anonymized files are written in:  
+                            :open_file_folder: :blue[{st.session_state['folder']}-Anonymized]
+                            ''')
+                if encoding_summary(metrics): 
+                    st.info(f':floppy_disk: Output encoding: {encoding_summary(metrics)}.')
+                if plan is not None and metrics.counters.get('files'): 
+                    with st.expander(':crystal_ball: **Plan against the run**'): 
+                        st.dataframe(compare_plan(plan, metrics, max_workers), use_container_width=True, hide_index=True)
+                display_metrics(metrics)
\ No newline at end of file
@@ -1,7 +1,12 @@
 import os
-import streamlit.web.bootstrap
+import multiprocessing
 
 if __name__ == "__main__":
+    # Required by the worker processes of the parallel anonymization in the executable. The workers return here
+    # before streamlit is imported, so that they only load the modules of the anonymization.
+    multiprocessing.freeze_support()
+    import streamlit.web.bootstrap
+
     os.chdir(os.path.dirname(__file__))
 
     flag_options = {
@@ -16,4 +21,4 @@ if __name__ == "__main__":
         "streamlit run",
         [],
         flag_options,
-    )
\ No newline at end of file
+    )